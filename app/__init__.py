@@ -1,31 +1,109 @@
 import os
 from flask import Flask, send_from_directory
-from app.routes.api import bp as api_blueprint
-from app.routes.auth import bp as auth_blueprint
-from app.routes.swagger import bp as swagger_blueprint
-from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-load_dotenv()
 
-db_uri = os.getenv("DB_URI")
+def create_app(config=None):
+    """Create the API app.
 
-jwt_secret = os.getenv("JWT_SECRET")
+    config overrides the settings otherwise read from the environment (and the
+    .env file). Creating the app does not touch the database: create the schema
+    and the admin user once with the init-db command.
+    """
+    # Imported here so that importing the package (e.g. to reach a submodule)
+    # does not build the app and its extensions
+    from app.auth import CachingJWTManager
+    from app.cache import dispenser_cache
+    from app.commands import (
+        init_db_command,
+        upgrade_db_command,
+        rebuild_stats_command,
+        check_stats_command,
+        repair_dispensers_command,
+        rebuild_rollups_command,
+        archive_transactions_command,
+    )
+    from app.database import get_engine_options, init_sqlite
+    from app.events import dispenser_events
+    from app.idempotency import idempotency_store
+    from app.ingest import tap_ingestion
+    from app.json_provider import ApiJSONProvider
+    from app.live import open_tap_registry
+    from app.metrics import metrics
+    from app.models import db
+    from app.passwords import password_hasher
+    from app.ratelimit import tap_limiter
+    from app.routes.api import bp as api_blueprint
+    from app.routes.auth import bp as auth_blueprint
+    from app.routes.metrics import bp as metrics_blueprint
 
-admin_username = os.getenv("ADMIN_USERNAME")
-admin_password = os.getenv("ADMIN_PASSWORD")
+    load_dotenv()
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["JWT_SECRET_KEY"] = jwt_secret
-jwt = JWTManager(app)
+    app = Flask(__name__)
+    app.json = ApiJSONProvider(app)
+    app.config.update(config or {})
+    app.config.setdefault("SQLALCHEMY_DATABASE_URI", os.getenv("DB_URI"))
+    app.config.setdefault("SQLALCHEMY_TRACK_MODIFICATIONS", False)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", get_engine_options())
+    app.config.setdefault("JWT_SECRET_KEY", os.getenv("JWT_SECRET"))
+    app.config.setdefault("ADMIN_USERNAME", os.getenv("ADMIN_USERNAME"))
+    app.config.setdefault("ADMIN_PASSWORD", os.getenv("ADMIN_PASSWORD"))
+    app.config.setdefault(
+        "ARCHIVE_AFTER_DAYS", float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+    )
+    app.config.setdefault(
+        "ARCHIVE_BATCH_SIZE", int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+    )
+    app.config.setdefault(
+        "ARCHIVE_BATCH_PAUSE", float(os.getenv("ARCHIVE_BATCH_PAUSE", "0.05"))
+    )
+    app.config.setdefault("TRUSTED_PROXIES", int(os.getenv("TRUSTED_PROXIES", "0")))
+    app.config.setdefault(
+        "SWAGGER_UI_ENABLED",
+        os.getenv("SWAGGER_UI_ENABLED", "true").lower() in ("1", "true", "yes"),
+    )
 
-app.register_blueprint(api_blueprint, url_prefix="/api")
-app.register_blueprint(auth_blueprint, url_prefix="/auth")
-app.register_blueprint(swagger_blueprint)
+    if app.config["TRUSTED_PROXIES"]:
+        # Take the client address (e.g. the rate limits' key) and scheme from the
+        # X-Forwarded-For and X-Forwarded-Proto headers set by that many proxies
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app,
+            x_for=app.config["TRUSTED_PROXIES"],
+            x_proto=app.config["TRUSTED_PROXIES"],
+        )
 
+    init_sqlite(app)
+    db.init_app(app)
+    CachingJWTManager(app)
+    password_hasher.init_app(app)
+    dispenser_cache.init_app(app)
+    open_tap_registry.init_app(app)
+    dispenser_events.init_app(app)
+    tap_ingestion.init_app(app)
+    tap_limiter.init_app(app)
+    idempotency_store.init_app(app)
+    metrics.init_app(app)
 
-@app.route("/docs/api.spec.yaml")
-def specs():
-    return send_from_directory(os.getcwd(), "docs/api.spec.yaml")
+    app.register_blueprint(api_blueprint, url_prefix="/api")
+    app.register_blueprint(auth_blueprint, url_prefix="/auth")
+    app.register_blueprint(metrics_blueprint)
+
+    if app.config["SWAGGER_UI_ENABLED"]:
+        from app.routes.swagger import bp as swagger_blueprint
+
+        app.register_blueprint(swagger_blueprint)
+
+        @app.route("/docs/api.spec.yaml")
+        def specs():
+            return send_from_directory(os.getcwd(), "docs/api.spec.yaml")
+
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(check_stats_command)
+    app.cli.add_command(repair_dispensers_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(archive_transactions_command)
+
+    return app
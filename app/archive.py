@@ -0,0 +1,117 @@
+import time
+from app.models import db, Transaction, ArchivedTransaction
+
+TRANSACTION_FIELDS = (
+    "id",
+    "dispenser_id",
+    "start_time",
+    "end_time",
+    "amount",
+    "revenue",
+)
+
+
+def archive_transactions(closed_before, batch_size=1000, pause=0.0):
+    """Move the transactions closed before closed_before to the archive table.
+
+    The transactions are moved batch_size at a time, each batch in its own short
+    database transaction, so taps keep opening and closing while the job runs;
+    pause seconds are left between batches for them. The running totals of the
+    dispensers already include the archived transactions and are left as they
+    are. Returns the number of transactions archived.
+    """
+    # SQLite gives new rows the largest id plus one, so deleting the latest
+    # transaction would let its id be reused while it is in the archive
+    latest_id = db.session.execute(db.select(db.func.max(Transaction.id))).scalar()
+    columns = [getattr(Transaction, field) for field in TRANSACTION_FIELDS]
+    archived = 0
+    last_id = 0
+
+    while latest_id is not None:
+        # Closed transactions are never updated again, so they can be moved
+        # without locking the rows
+        ids = (
+            db.session.execute(
+                db.select(Transaction.id)
+                .where(
+                    Transaction.id > last_id,
+                    Transaction.id < latest_id,
+                    Transaction.end_time < closed_before,
+                )
+                .order_by(Transaction.id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+
+        if not ids:
+            break
+
+        db.session.execute(
+            db.insert(ArchivedTransaction).from_select(
+                TRANSACTION_FIELDS, db.select(*columns).where(Transaction.id.in_(ids))
+            )
+        )
+        db.session.execute(
+            db.delete(Transaction)
+            .where(Transaction.id.in_(ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        archived += len(ids)
+        last_id = ids[-1]
+
+        if pause:
+            time.sleep(pause)
+
+    return archived
+
+
+def archive_reaches(start, session=None):
+    """Return whether archived transactions may have started at or after start.
+
+    A start of None stands for the whole history. The archive is read through
+    session, db.session by default.
+    """
+    session = db.session if session is None else session
+    latest_start = session.execute(
+        db.select(db.func.max(ArchivedTransaction.start_time))
+    ).scalar()
+
+    return latest_start is not None and (start is None or latest_start >= start)
+
+
+def transaction_tables(start=None, session=None):
+    """Return the models holding the transactions started from start on."""
+    if archive_reaches(start, session):
+        return (Transaction, ArchivedTransaction)
+
+    return (Transaction,)
+
+
+def select_transactions(dispenser_ids=None, start=None, end=None, session=None):
+    """Return a subquery of the transactions started in the [start, end) window.
+
+    Only the transactions of dispenser_ids are selected, unless it is None. The
+    archived transactions are merged in when the window reaches back to them, so
+    recent windows only read the transaction table.
+    """
+    queries = []
+    for table in transaction_tables(start, session):
+        query = db.select(*(getattr(table, field) for field in TRANSACTION_FIELDS))
+
+        if dispenser_ids is not None:
+            query = query.where(table.dispenser_id.in_(dispenser_ids))
+        if start is not None:
+            query = query.where(table.start_time >= start)
+        if end is not None:
+            query = query.where(table.start_time < end)
+
+        queries.append(query)
+
+    if len(queries) == 1:
+        return queries[0].subquery("transactions")
+
+    return db.union_all(*queries).subquery("transactions")
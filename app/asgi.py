@@ -0,0 +1,523 @@
+import contextlib
+import functools
+from datetime import datetime
+from a2wsgi import WSGIMiddleware
+from flask import current_app
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import ExpiredSignatureError, InvalidTokenError
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_etags, quote_etag
+from app.auth import admin_cache
+from app.cache import dispenser_cache
+from app.database import set_sqlite_pragmas
+from app.events import dispenser_events
+from app.idempotency import (
+    IdempotencyKeyError,
+    address_caller,
+    idempotency_store,
+    request_fingerprint,
+)
+from app.ingest import tap_ingestion
+from app.metrics import metrics, count_closed_pours
+from app.models import db, Admin, Dispenser, Transaction, DispenserEvent
+from app.ratelimit import TOO_MANY_REQUESTS, tap_limiter, retry_after_header
+from app.rollup import record_transaction_rollups
+from app.statistics import parse_statistics_args, get_dispenser_statistics
+
+# asyncio drivers of the databases the API runs on
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def create_asgi_app(flask_app):
+    """Create the ASGI app serving the tap endpoints of flask_app asynchronously.
+
+    Opening and closing taps, the dispenser info and the statistics are served by
+    async handlers over an asyncio engine, so a process holds many concurrent
+    requests without a thread per request. Their responses are those of the Flask
+    routes. Every other request is passed on to flask_app, run on a thread pool.
+
+    In the write-behind ingestion mode every request is served by flask_app, which
+    owns the in-memory tap state.
+    """
+    with flask_app.app_context():
+        url = get_async_url(db.engine.url)
+
+    engine_options = dict(flask_app.config["SQLALCHEMY_ENGINE_OPTIONS"])
+
+    if url.get_backend_name() == "sqlite":
+        # aiosqlite defaults to opening a connection, and its thread, per session.
+        # SQLite commits one write at a time anyway, so the sessions queue for a
+        # single connection on the event loop rather than in SQLite's busy handler
+        engine_options.setdefault("poolclass", AsyncAdaptedQueuePool)
+        engine_options.setdefault("pool_size", 1)
+        engine_options.setdefault("max_overflow", 0)
+
+    engine = create_async_engine(url, **engine_options)
+
+    if engine.dialect.name == "sqlite":
+        event.listen(
+            engine.sync_engine,
+            "connect",
+            lambda dbapi_connection, connection_record: set_sqlite_pragmas(
+                dbapi_connection
+            ),
+        )
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    routes = [] if tap_ingestion.enabled else list(API_ROUTES)
+    routes.append(Mount("/", WSGIMiddleware(flask_app)))
+
+    middleware = []
+    if flask_app.config["TRUSTED_PROXIES"]:
+        middleware.append(
+            Middleware(
+                TrustedProxiesMiddleware, count=flask_app.config["TRUSTED_PROXIES"]
+            )
+        )
+
+    app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
+    app.state.flask_app = flask_app
+    app.state.engine = engine
+    app.state.sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    return app
+
+
+class TrustedProxiesMiddleware:
+    """Take the client address and scheme from the headers set by count proxies.
+
+    The ASGI counterpart of the ProxyFix the Flask app is wrapped in: the client is
+    the count-th address from the right of X-Forwarded-For, and the scheme that of
+    X-Forwarded-Proto, so the rate limits and idempotency keys of the async routes
+    belong to the same callers as those of the Flask routes.
+    """
+
+    def __init__(self, app, count):
+        self.app = app
+        self.count = count
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            headers = dict(scope["headers"])
+            client = self._forwarded(headers.get(b"x-forwarded-for"))
+            scheme = self._forwarded(headers.get(b"x-forwarded-proto"))
+
+            if client is not None or scheme is not None:
+                scope = dict(scope)
+                if client is not None:
+                    scope["client"] = (client, 0)
+                if scheme is not None:
+                    scope["scheme"] = scheme
+
+        await self.app(scope, receive, send)
+
+    def _forwarded(self, value):
+        # As ProxyFix, ignore a header with fewer values than trusted proxies
+        if value is None:
+            return None
+
+        values = [item.strip() for item in value.decode("latin-1").split(",")]
+        if len(values) < self.count:
+            return None
+
+        return values[-self.count]
+
+
+def get_async_url(url):
+    """Return the URL of the asyncio driver of the database at url."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver for {backend} databases")
+
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def api_route(rule):
+    """Serve an async handler of the Flask API route rule.
+
+    The handler runs in the Flask app context, for the JSON provider and the JWT
+    settings, and its request is recorded in the metrics under rule.
+    """
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            with request.app.state.flask_app.app_context():
+                metrics.start_request()
+                try:
+                    response = await handler(request)
+                except Exception:
+                    metrics.end_request(request.method, rule, 500)
+                    raise
+                metrics.end_request(request.method, rule, response.status_code)
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def rate_limited(handler):
+    """Answer 429 to the tap requests the limiter rejects, like the Flask routes."""
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        client = request.client.host if request.client else None
+        retry_after = tap_limiter.check(client, request.path_params["dispenser_id"])
+
+        if retry_after is not None:
+            return json_response(
+                {"message": TOO_MANY_REQUESTS},
+                429,
+                {"Retry-After": retry_after_header(retry_after)},
+            )
+
+        return await handler(request)
+
+    return wrapper
+
+
+def idempotent(handler):
+    """Replay the stored responses of the retried requests, like the Flask routes."""
+
+    @functools.wraps(handler)
+    async def wrapper(request):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return await handler(request)
+
+        # The tap routes take no JWT, so callers are told apart by address
+        caller = address_caller(request.client.host if request.client else None)
+        fingerprint = request_fingerprint(
+            request.method, request.url.path, await request.body()
+        )
+
+        async with request.app.state.sessions() as session:
+            try:
+                stored = await session.run_sync(
+                    lambda sync_session: idempotency_store.start(
+                        caller, key, fingerprint, sync_session
+                    )
+                )
+            except IdempotencyKeyError as e:
+                return json_response({"message": str(e)}, e.status)
+
+        if stored is not None:
+            status, body = stored
+            return Response(
+                body,
+                status,
+                {"Idempotent-Replayed": "true"},
+                media_type="application/json",
+            )
+
+        status = body = None
+        try:
+            response = await handler(request)
+            status, body = response.status_code, response.body
+        finally:
+            async with request.app.state.sessions() as session:
+                await session.run_sync(
+                    lambda sync_session: idempotency_store.finish(
+                        caller, key, fingerprint, status, body, sync_session
+                    )
+                )
+
+        return response
+
+    return wrapper
+
+
+@api_route("/api/dispenser/<int:dispenser_id>")
+async def get_dispenser_info_by_id(request):
+    dispenser_id = request.path_params["dispenser_id"]
+    key = ("dispenser", dispenser_id)
+
+    async with request.app.state.sessions() as session:
+        version = await session.run_sync(dispenser_cache.backend.current)
+        cached = dispenser_cache.lookup(key, version)
+
+        if cached is None:
+            dispenser = await session.get(Dispenser, dispenser_id)
+            cached = dispenser_cache.store(
+                key, version, dispenser.get_dispenser_info() if dispenser else None
+            )
+
+    body, etag = cached
+
+    if body is None:
+        return json_response({"message": "Dispenser not found"}, 404)
+
+    return cached_json_response(request, body, etag)
+
+
+@api_route("/api/dispenser")
+async def get_all_dispenser_info(request):
+    async with request.app.state.sessions() as session:
+        version = await session.run_sync(dispenser_cache.backend.current)
+        cached = dispenser_cache.lookup("all", version)
+
+        if cached is None:
+            dispensers = await session.scalars(
+                db.select(Dispenser).order_by(Dispenser.id)
+            )
+            cached = dispenser_cache.store(
+                "all",
+                version,
+                [dispenser.get_dispenser_info() for dispenser in dispensers],
+            )
+
+    return cached_json_response(request, *cached)
+
+
+@api_route("/api/dispenser/<int:dispenser_id>/open")
+@idempotent
+@rate_limited
+async def open_dispenser(request):
+    dispenser_id = request.path_params["dispenser_id"]
+
+    async with request.app.state.sessions() as session:
+        dispenser = await session.get(Dispenser, dispenser_id)
+
+        if not dispenser:
+            return json_response({"message": "Dispenser not found"}, 404)
+
+        if dispenser.is_open:
+            return json_response({"message": "Dispenser is already open"}, 400)
+
+        try:
+            new_transaction = Transaction(
+                dispenser_id=dispenser_id, start_time=datetime.utcnow()
+            )
+            session.add(new_transaction)
+            await session.flush()
+
+            # Another request may have opened the tap since it was read above
+            result = await session.execute(
+                Dispenser.mark_open_statement(dispenser_id, new_transaction.id)
+            )
+            if result.rowcount != 1:
+                await session.rollback()
+                return json_response({"message": "Dispenser is already open"}, 400)
+
+            session.add(DispenserEvent("open", new_transaction))
+            await session.commit()
+            dispenser_events.notify()
+
+            return json_response({"message": "Dispenser opened successfully"})
+
+        except Exception as e:
+            await session.rollback()
+            return json_response({"message": f"Error opening dispenser: {e}"}, 500)
+
+
+@api_route("/api/dispenser/<int:dispenser_id>/close")
+@idempotent
+@rate_limited
+async def close_dispenser(request):
+    dispenser_id = request.path_params["dispenser_id"]
+
+    async with request.app.state.sessions() as session:
+        dispenser = await session.get(Dispenser, dispenser_id)
+
+        if not dispenser:
+            return json_response({"message": "Dispenser not found"}, 404)
+
+        if not dispenser.is_open:
+            return json_response({"message": "Dispenser is already closed"}, 400)
+
+        try:
+            last_transaction = await get_open_transaction(session, dispenser)
+
+            if not last_transaction:
+                return json_response({"message": "No open transaction found"}, 500)
+
+            end_time = datetime.utcnow()
+
+            # The dispenser is in the session, so the transaction reaches it
+            # without a query
+            amount, revenue = last_transaction.get_amount_and_revenue(end_time)
+
+            # Another request may have closed the tap since it was read above
+            result = await session.execute(
+                Dispenser.mark_closed_statement(
+                    dispenser_id, dispenser.open_transaction_id, amount, revenue
+                )
+            )
+            if result.rowcount != 1:
+                await session.rollback()
+                return json_response({"message": "Dispenser is already closed"}, 400)
+
+            last_transaction.amount = amount
+            last_transaction.revenue = revenue
+            last_transaction.end_time = end_time
+            await session.run_sync(_record_closed_transaction, last_transaction)
+            session.add(DispenserEvent("close", last_transaction))
+            await session.commit()
+            dispenser_events.notify()
+
+            return json_response(
+                {
+                    "message": "Dispenser closed successfully",
+                    "amount": amount,
+                    "cost": revenue,
+                }
+            )
+
+        except Exception as e:
+            await session.rollback()
+            return json_response({"message": f"Error closing dispenser: {e}"}, 500)
+
+
+@api_route("/api/statistics/<int:dispenser_id>")
+async def get_dispenser_stats_by_id(request):
+    async with request.app.state.sessions() as session:
+        error = await authenticate(request, session)
+        if error is not None:
+            return error
+
+        try:
+            statistics_args = parse_statistics_args(request.query_params)
+        except ValueError as e:
+            return json_response({"message": str(e)}, 400)
+
+        dispenser = await session.get(Dispenser, request.path_params["dispenser_id"])
+
+        if not dispenser:
+            return json_response({"message": "Dispenser not found"}, 404)
+
+        [dispenser_stats] = await session.run_sync(
+            _get_statistics, [dispenser], statistics_args
+        )
+
+    return json_response(dispenser_stats)
+
+
+@api_route("/api/statistics")
+async def get_all_dispenser_stats(request):
+    async with request.app.state.sessions() as session:
+        error = await authenticate(request, session)
+        if error is not None:
+            return error
+
+        try:
+            statistics_args = parse_statistics_args(request.query_params, fleet=True)
+        except ValueError as e:
+            return json_response({"message": str(e)}, 400)
+
+        dispensers = await session.scalars(db.select(Dispenser).order_by(Dispenser.id))
+        statistics = await session.run_sync(
+            _get_statistics, dispensers.all(), statistics_args
+        )
+
+    return json_response(statistics)
+
+
+API_ROUTES = (
+    Route("/api/dispenser/{dispenser_id:int}", get_dispenser_info_by_id),
+    Route("/api/dispenser", get_all_dispenser_info),
+    Route("/api/dispenser/{dispenser_id:int}/open", open_dispenser, methods=["POST"]),
+    Route("/api/dispenser/{dispenser_id:int}/close", close_dispenser, methods=["POST"]),
+    Route("/api/statistics/{dispenser_id:int}", get_dispenser_stats_by_id),
+    Route("/api/statistics", get_all_dispenser_stats),
+)
+
+
+async def authenticate(request, session):
+    """Return the error response of a request without a valid admin token, else None.
+
+    The errors are those of jwt_required. Verified tokens and admins are cached as
+    they are by the Flask app.
+    """
+    authorization = request.headers.get("Authorization")
+    if authorization is None:
+        return json_response({"msg": "Missing Authorization Header"}, 401)
+    if not authorization.startswith("Bearer "):
+        return json_response(
+            {"msg": "Missing 'Bearer' type in 'Authorization' header"}, 401
+        )
+
+    try:
+        claims = decode_token(authorization[len("Bearer ") :])
+    except ExpiredSignatureError:
+        return json_response({"msg": "Token has expired"}, 401)
+    except (InvalidTokenError, JWTExtendedException) as e:
+        return json_response({"msg": str(e)}, 422)
+
+    if claims["type"] != "access":
+        return json_response({"msg": "Only non-refresh tokens are allowed"}, 422)
+
+    admin_id = claims[request.app.state.flask_app.config["JWT_IDENTITY_CLAIM"]]
+    admin = admin_cache.get(admin_id)
+
+    if admin is None:
+        result = await session.execute(
+            db.select(Admin.id, Admin.username).where(Admin.id == admin_id)
+        )
+        admin = result.first()
+
+        if admin is None:
+            return json_response({"msg": f"Error loading the user {admin_id}"}, 401)
+
+        admin_cache.set(admin_id, admin)
+
+    return None
+
+
+async def get_open_transaction(session, dispenser):
+    if dispenser.open_transaction_id is not None:
+        return await session.get(Transaction, dispenser.open_transaction_id)
+
+    # Dispensers opened before open_transaction_id was tracked
+    result = await session.scalars(
+        db.select(Transaction)
+        .where(
+            Transaction.dispenser_id == dispenser.id,
+            Transaction.end_time.is_(None),  # type: ignore
+        )
+        .order_by(Transaction.start_time.desc())  # type: ignore
+        .limit(1)
+    )
+
+    return result.first()
+
+
+def json_response(data, status=200, headers=None):
+    # Serialized by the Flask JSON provider, like the Flask routes' responses
+    body = current_app.json.response(data).get_data()
+
+    return Response(body, status, headers, media_type="application/json")
+
+
+def cached_json_response(request, body, etag):
+    headers = {"ETag": quote_etag(etag)}
+
+    if parse_etags(request.headers.get("If-None-Match")).contains_weak(etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, headers=headers, media_type="application/json")
+
+
+def _record_closed_transaction(session, transaction):
+    # Run in the session's sync session, which the rollup and metrics helpers use
+    record_transaction_rollups([transaction], session)
+    count_closed_pours([transaction], session)
+
+
+def _get_statistics(session, dispensers, statistics_args):
+    return get_dispenser_statistics(dispensers, session=session, **statistics_args)
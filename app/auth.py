@@ -0,0 +1,199 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from flask_jwt_extended import JWTManager
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.metrics import CACHE_LOOKUPS, metrics
+from app.models import db, Admin
+
+
+class LRUCache:
+    """Thread-safe least recently used cache whose entries may expire.
+
+    Keeps hit, miss and eviction counts so the hit rate can be monitored. Hits
+    and misses are also counted in the cache_lookups_total metric, under name.
+    """
+
+    def __init__(self, max_size, name):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_counter = CACHE_LOOKUPS.labels(name, "hit")
+        self._miss_counter = CACHE_LOOKUPS.labels(name, "miss")
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry[1] is not None and entry[1] <= time.time():
+                del self._entries[key]
+                self.evictions += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                if metrics.enabled:
+                    self._miss_counter.inc()
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if metrics.enabled:
+                self._hit_counter.inc()
+            return entry[0]
+
+    def set(self, key, value, expires_at=None):
+        """Store value under key, until the expires_at timestamp if given."""
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def resize(self, max_size):
+        with self._lock:
+            self.max_size = max_size
+            self._entries.clear()
+
+
+verified_tokens = LRUCache(1024, "jwt")
+admin_cache = LRUCache(128, "admin")
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager remembering the claims of the tokens it already verified.
+
+    Dashboards poll the authenticated endpoints with the same token, so its
+    signature only has to be checked once. Entries are keyed by a hash of the
+    token and dropped when it expires. The admin of each request is looked up
+    through admin_cache, which drops an admin once a session changing it commits.
+
+    flask-jwt-extended has no public hook around the signature check, so this
+    overrides its private _decode_jwt_from_config, which every decode goes
+    through (verify_jwt_in_request and decode_token alike). The package is pinned
+    to the version it was written against in requirements.txt, and
+    tests/test_auth.py fails if the signature of the method changes.
+    """
+
+    def init_app(self, app, add_context_processor=False):
+        super().init_app(app, add_context_processor)
+
+        verified_tokens.resize(
+            app.config.setdefault(
+                "JWT_CACHE_SIZE", int(os.getenv("JWT_CACHE_SIZE", "1024"))
+            )
+        )
+        admin_cache.resize(
+            app.config.setdefault(
+                "ADMIN_CACHE_SIZE", int(os.getenv("ADMIN_CACHE_SIZE", "128"))
+            )
+        )
+        self.user_lookup_loader(load_admin)
+
+    def _decode_jwt_from_config(
+        self, encoded_token, csrf_value=None, allow_expired=False
+    ):
+        key = (
+            hashlib.sha256(encoded_token.encode()).digest(),
+            csrf_value,
+            allow_expired,
+        )
+        claims = verified_tokens.get(key)
+
+        if claims is None:
+            claims = super()._decode_jwt_from_config(
+                encoded_token, csrf_value, allow_expired
+            )
+            expires_at = None if allow_expired else claims.get("exp")
+            verified_tokens.set(key, claims, expires_at)
+
+        # The claims are stored for the request, which must not alter the cached ones
+        return dict(claims)
+
+
+def load_admin(jwt_header, jwt_data):
+    """Return the (id, username) row of the token's admin, or None if it is gone."""
+    admin_id = jwt_data[current_app.config["JWT_IDENTITY_CLAIM"]]
+    admin = admin_cache.get(admin_id)
+
+    if admin is None:
+        admin = db.session.execute(
+            db.select(Admin.id, Admin.username).where(Admin.id == admin_id)
+        ).first()
+
+        if admin is not None:
+            admin_cache.set(admin_id, admin)
+
+    return admin
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_admins(session, flush_context):
+    admin_ids = {
+        instance.id
+        for instance in itertools.chain(session.new, session.dirty, session.deleted)
+        if isinstance(instance, Admin)
+    }
+
+    if admin_ids:
+        changed_admins = session.info.setdefault("changed_admins", set())
+        # None stands for every admin, after a bulk statement
+        if changed_admins is not None:
+            changed_admins.update(admin_ids)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_admin_statements(orm_execute_state):
+    if (
+        orm_execute_state.is_update or orm_execute_state.is_delete
+    ) and orm_execute_state.bind_mapper is Admin.__mapper__:
+        # Which rows the statement matched is unknown, forget every admin
+        orm_execute_state.session.info["changed_admins"] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_admin_cache(session):
+    if "changed_admins" not in session.info:
+        return
+
+    admin_ids = session.info.pop("changed_admins")
+
+    if admin_ids is None:
+        admin_cache.clear()
+    else:
+        for admin_id in admin_ids:
+            admin_cache.discard(admin_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_admin_changes(session):
+    session.info.pop("changed_admins", None)
@@ -0,0 +1,284 @@
+from datetime import datetime
+from app.models import db, Dispenser, Transaction, DispenserEvent
+from app.rollup import record_transaction_rollups
+from app.metrics import count_closed_pours
+
+MAX_BULK_SIZE = 1000
+
+
+def parse_dispenser_ids(data):
+    """Read the dispenser_ids list of a bulk request, raising ValueError when invalid."""
+    dispenser_ids = data.get("dispenser_ids") if isinstance(data, dict) else None
+
+    if (
+        not isinstance(dispenser_ids, list)
+        or not 1 <= len(dispenser_ids) <= MAX_BULK_SIZE
+        or not all(
+            isinstance(dispenser_id, int) and not isinstance(dispenser_id, bool)
+            for dispenser_id in dispenser_ids
+        )
+    ):
+        raise ValueError(
+            f"A list of 1 to {MAX_BULK_SIZE} integer dispenser_ids is required"
+        )
+
+    return dispenser_ids
+
+
+def create_dispensers(items):
+    """Add the valid dispensers of items to the session, flushed as one batch.
+
+    Returns one result per item, in order.
+    """
+    new_dispensers = {}
+    results = []
+
+    for position, item in enumerate(items):
+        flow_volume = item.get("flow_volume") if isinstance(item, dict) else None
+        price = item.get("price") if isinstance(item, dict) else None
+
+        if flow_volume is None or price is None:
+            results.append(
+                {"status": 400, "message": "Flow volume and price are required"}
+            )
+        else:
+            new_dispensers[position] = Dispenser(flow_volume=flow_volume, price=price)
+            results.append(None)
+
+    db.session.add_all(new_dispensers.values())
+    db.session.flush()
+
+    for position, dispenser in new_dispensers.items():
+        results[position] = {
+            "status": 201,
+            "id": dispenser.id,
+            "flow_volume": dispenser.flow_volume,
+            "price": dispenser.price,
+        }
+
+    return results
+
+
+def open_dispensers(dispenser_ids):
+    """Open the given dispensers with one INSERT batch and one conditional UPDATE.
+
+    Returns one result per dispenser id, in order.
+    """
+    dispensers = _get_dispensers(dispenser_ids)
+    start_time = datetime.utcnow()
+
+    new_transactions = {
+        dispenser.id: Transaction(dispenser_id=dispenser.id, start_time=start_time)
+        for dispenser in dispensers.values()
+        if not dispenser.is_open
+    }
+    db.session.add_all(new_transactions.values())
+    db.session.flush()
+
+    opened = _mark_open(
+        {
+            dispenser_id: transaction.id
+            for dispenser_id, transaction in new_transactions.items()
+        }
+    )
+
+    for dispenser_id, transaction in new_transactions.items():
+        if dispenser_id in opened:
+            db.session.add(DispenserEvent("open", transaction))
+        else:
+            # Another request opened the tap in the meantime
+            db.session.delete(transaction)
+
+    def get_result(dispenser_id):
+        if dispenser_id not in dispensers:
+            return {"status": 404, "message": "Dispenser not found"}
+        if dispenser_id not in opened:
+            return {"status": 400, "message": "Dispenser is already open"}
+
+        return {"status": 200, "message": "Dispenser opened successfully"}
+
+    return _get_results(dispenser_ids, get_result)
+
+
+def close_dispensers(dispenser_ids):
+    """Close the given dispensers with one conditional UPDATE and one UPDATE batch.
+
+    Returns one result per dispenser id, in order.
+    """
+    dispensers = _get_dispensers(dispenser_ids)
+    open_transactions = {
+        transaction.id: transaction
+        for transaction in Transaction.query.filter(
+            Transaction.id.in_(
+                [
+                    dispenser.open_transaction_id
+                    for dispenser in dispensers.values()
+                    if dispenser.is_open
+                ]
+            )
+        )
+    }
+    end_time = datetime.utcnow()
+    closing = {}
+
+    for dispenser in dispensers.values():
+        if not dispenser.is_open:
+            continue
+
+        transaction = (
+            open_transactions.get(dispenser.open_transaction_id)
+            or dispenser.get_open_transaction()
+        )
+
+        if transaction is not None:
+            amount, revenue = transaction.get_amount_and_revenue(end_time)
+            closing[dispenser.id] = (
+                dispenser.open_transaction_id,
+                transaction,
+                amount,
+                revenue,
+            )
+
+    closed = _mark_closed(closing)
+
+    for dispenser_id in closed:
+        _, transaction, amount, revenue = closing[dispenser_id]
+        transaction.amount = amount
+        transaction.revenue = revenue
+        transaction.end_time = end_time
+        db.session.add(DispenserEvent("close", transaction))
+
+    closed_transactions = [closing[dispenser_id][1] for dispenser_id in closed]
+    record_transaction_rollups(closed_transactions)
+    count_closed_pours(closed_transactions)
+
+    def get_result(dispenser_id):
+        if dispenser_id not in dispensers:
+            return {"status": 404, "message": "Dispenser not found"}
+        if dispenser_id in closed:
+            _, _, amount, revenue = closing[dispenser_id]
+            return {
+                "status": 200,
+                "message": "Dispenser closed successfully",
+                "amount": amount,
+                "cost": revenue,
+            }
+        if dispensers[dispenser_id].is_open and dispenser_id not in closing:
+            return {"status": 500, "message": "No open transaction found"}
+
+        return {"status": 400, "message": "Dispenser is already closed"}
+
+    return _get_results(dispenser_ids, get_result)
+
+
+def _get_dispensers(dispenser_ids):
+    return {
+        dispenser.id: dispenser
+        for dispenser in Dispenser.query.filter(Dispenser.id.in_(set(dispenser_ids)))
+    }
+
+
+def _get_results(dispenser_ids, get_result):
+    results = []
+    seen = set()
+
+    for dispenser_id in dispenser_ids:
+        if dispenser_id in seen:
+            result = {"status": 400, "message": "Duplicate dispenser id"}
+        else:
+            result = get_result(dispenser_id)
+            seen.add(dispenser_id)
+
+        results.append({"id": dispenser_id, **result})
+
+    return results
+
+
+def _supports_update_returning():
+    return db.session.get_bind().dialect.update_returning
+
+
+def _mark_open(transaction_ids):
+    """Bulk version of Dispenser.mark_open, returning the ids of the opened dispensers."""
+    if not transaction_ids:
+        return set()
+
+    if not _supports_update_returning():
+        return {
+            dispenser_id
+            for dispenser_id, transaction_id in transaction_ids.items()
+            if Dispenser.mark_open(dispenser_id, transaction_id)
+        }
+
+    return set(
+        db.session.scalars(
+            db.update(Dispenser)
+            .where(
+                Dispenser.id.in_(transaction_ids),
+                Dispenser.is_open.isnot(True),
+            )
+            .values(
+                is_open=True,
+                open_transaction_id=db.case(transaction_ids, value=Dispenser.id),
+            )
+            .returning(Dispenser.id)
+            .execution_options(synchronize_session=False)
+        )
+    )
+
+
+def _mark_closed(closing):
+    """Bulk version of Dispenser.mark_closed, returning the ids of the closed dispensers."""
+    # Dispensers opened before open_transaction_id was tracked are matched on NULL,
+    # which a CASE expression cannot do
+    one_by_one = {
+        dispenser_id
+        for dispenser_id, (transaction_id, _, _, _) in closing.items()
+        if transaction_id is None or not _supports_update_returning()
+    }
+    closed = {
+        dispenser_id
+        for dispenser_id in one_by_one
+        if Dispenser.mark_closed(
+            dispenser_id,
+            closing[dispenser_id][0],
+            closing[dispenser_id][2],
+            closing[dispenser_id][3],
+        )
+    }
+
+    batch = {
+        dispenser_id: values
+        for dispenser_id, values in closing.items()
+        if dispenser_id not in one_by_one
+    }
+    if not batch:
+        return closed
+
+    def per_dispenser(index):
+        return db.case(
+            {dispenser_id: values[index] for dispenser_id, values in batch.items()},
+            value=Dispenser.id,
+        )
+
+    closed.update(
+        db.session.scalars(
+            db.update(Dispenser)
+            .where(
+                Dispenser.id.in_(batch),
+                Dispenser.is_open.is_(True),
+                Dispenser.open_transaction_id == per_dispenser(0),
+            )
+            .values(
+                is_open=False,
+                open_transaction_id=None,
+                **Dispenser.closed_transaction_values(
+                    per_dispenser(2), per_dispenser(3)
+                ),
+            )
+            .returning(Dispenser.id)
+            .execution_options(synchronize_session=False)
+        )
+    )
+
+    return closed
@@ -0,0 +1,195 @@
+import hashlib
+import itertools
+import os
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import db, Dispenser, CacheVersion
+
+
+class LocalVersionBackend:
+    """Version counter of a single process. Writes made by other processes are not seen."""
+
+    def __init__(self):
+        self._counter = itertools.count(1)
+        self._version = next(self._counter)
+
+    def current(self, session=None):
+        return self._version
+
+    def bump(self, session=None):
+        self._version = next(self._counter)
+
+        return self._version
+
+
+class DatabaseVersionBackend:
+    """Version counter stored in the database, shared by every worker using it.
+
+    The counter is read through session, db.session by default. It is bumped in
+    the transaction of session when given, so that it moves on together with the
+    dispensers it changed, else in a transaction of its own. Every bump adds one.
+    """
+
+    name = "dispenser"
+
+    def current(self, session=None):
+        session = db.session if session is None else session
+        version = session.execute(
+            db.select(CacheVersion.version).where(CacheVersion.name == self.name)
+        ).scalar()
+
+        return version or 0
+
+    def bump(self, session=None):
+        if session is not None:
+            return self._bump(session)
+
+        with db.engine.begin() as connection:
+            return self._bump(connection)
+
+    def _bump(self, connection):
+        result = connection.execute(
+            db.update(CacheVersion)
+            .where(CacheVersion.name == self.name)
+            .values(version=CacheVersion.version + 1)
+        )
+        if result.rowcount == 0:
+            connection.execute(
+                db.insert(CacheVersion).values(name=self.name, version=1)
+            )
+
+        return connection.execute(
+            db.select(CacheVersion.version).where(CacheVersion.name == self.name)
+        ).scalar()
+
+
+CACHE_BACKENDS = {
+    "local": LocalVersionBackend,
+    "database": DatabaseVersionBackend,
+}
+
+
+class DispenserCache:
+    """Read-through cache of serialized dispenser info responses.
+
+    Entries are tagged with the backend version they were loaded at and dropped
+    once it moves on. The version is bumped whenever a committed session changed
+    dispenser rows, so creating, opening or closing a dispenser invalidates it.
+    """
+
+    def __init__(self, app=None):
+        self.backend = LocalVersionBackend()
+        self._entries = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_name = app.config.setdefault(
+            "DISPENSER_CACHE_BACKEND", os.getenv("DISPENSER_CACHE_BACKEND", "local")
+        )
+
+        if backend_name not in CACHE_BACKENDS:
+            raise ValueError(f"Unknown dispenser cache backend: {backend_name}")
+
+        self.backend = CACHE_BACKENDS[backend_name]()
+        self._entries = {}
+        app.extensions["dispenser_cache"] = self
+
+    def get(self, key, load):
+        """Return the (body, etag) of key, serializing load() on a miss.
+
+        load returns the data to serialize, or None when there is nothing to cache.
+        """
+        version = self.backend.current()
+        cached = self.lookup(key, version)
+
+        if cached is not None:
+            return cached
+
+        return self.store(key, version, load())
+
+    def lookup(self, key, version):
+        """Return the (body, etag) of key if it was loaded at version, else None."""
+        entry = self._entries.get(key)
+
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+
+        return None
+
+    def store(self, key, version, data):
+        """Serialize data as the entry of key loaded at version, see get."""
+        if data is None:
+            return None, None
+
+        body = current_app.json.response(data).get_data()
+        etag = hashlib.sha1(body).hexdigest()
+        self._entries[key] = (version, body, etag)
+
+        return body, etag
+
+    def invalidate(self, version=None):
+        """Drop every entry, returning the new version.
+
+        version is the one the backend was already bumped to, by the transaction
+        that changed the dispensers; without it, the backend is bumped now.
+        """
+        if version is None:
+            version = self.backend.bump()
+        self._entries = {}
+
+        return version
+
+
+dispenser_cache = DispenserCache()
+
+
+def _dispensers_changed(session):
+    return any(
+        isinstance(instance, Dispenser)
+        for instance in itertools.chain(session.new, session.dirty, session.deleted)
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _track_flushed_dispensers(session, flush_context):
+    if _dispensers_changed(session):
+        session.info["dispensers_changed"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_dispenser_statements(orm_execute_state):
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ) and orm_execute_state.bind_mapper is Dispenser.__mapper__:
+        orm_execute_state.session.info["dispensers_changed"] = True
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_shared_dispenser_version(session):
+    # A shared version is bumped on the connection of the committing transaction,
+    # which may well be the only one its pool holds (e.g. SQLite under ASGI)
+    if not isinstance(dispenser_cache.backend, DatabaseVersionBackend):
+        return
+
+    if session.info.get("dispensers_changed") or _dispensers_changed(session):
+        session.info["dispenser_version"] = dispenser_cache.backend.bump(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_dispenser_cache(session):
+    version = session.info.pop("dispenser_version", None)
+
+    if session.info.pop("dispensers_changed", False) or version is not None:
+        # Read by the open tap registry's listener, which runs after this one
+        session.info["dispenser_version"] = dispenser_cache.invalidate(version)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_dispenser_changes(session):
+    session.info.pop("dispensers_changed", None)
+    session.info.pop("dispenser_version", None)
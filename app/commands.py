@@ -0,0 +1,140 @@
+import click
+from datetime import datetime, timedelta
+from flask import current_app
+from flask.cli import with_appcontext
+from app.models import (
+    db,
+    Admin,
+    rebuild_dispenser_aggregates,
+    check_dispenser_aggregates,
+    repair_dispenser_state,
+)
+from app.archive import archive_transactions
+from app.rollup import rebuild_rollups
+from app.schema import upgrade_database
+
+
+def create_admin():
+    """Create the admin user set in the config, unless it exists.
+
+    Returns whether the user was created.
+    """
+    username = current_app.config["ADMIN_USERNAME"]
+
+    if Admin.query.filter_by(username=username).first():
+        return False
+
+    password = current_app.config["ADMIN_PASSWORD"]
+    db.session.add(Admin(username=username, password=password))
+    db.session.commit()
+    return True
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Create or upgrade the database schema and create the admin user.
+
+    Run once per deployment, before starting the server.
+    """
+    for column in upgrade_database():
+        click.echo(f"Added column {column}")
+
+    if not current_app.config["ADMIN_USERNAME"]:
+        click.echo("ADMIN_USERNAME is not set, no admin user created.")
+    elif create_admin():
+        click.echo("Admin user created.")
+    else:
+        click.echo("Admin user already exists.")
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    """Bring an existing database up to the current schema."""
+    added_columns = upgrade_database()
+
+    for column in added_columns:
+        click.echo(f"Added column {column}")
+
+    if added_columns:
+        click.echo("Dispenser aggregates, open state and rollups rebuilt.")
+    else:
+        click.echo("Database schema is up to date.")
+
+
+@click.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats_command():
+    """Recompute the per-dispenser transaction totals from the transaction table."""
+    rebuild_dispenser_aggregates()
+    click.echo("Dispenser aggregates rebuilt.")
+
+
+@click.command("check-stats")
+@with_appcontext
+def check_stats_command():
+    """Compare the per-dispenser transaction totals against a full scan."""
+    mismatches = check_dispenser_aggregates()
+
+    for mismatch in mismatches:
+        click.echo(
+            f"Dispenser {mismatch['dispenser_id']}: "
+            f"stored {mismatch['stored']}, scanned {mismatch['scanned']}"
+        )
+
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} dispenser(s) out of sync")
+
+    click.echo("Dispenser aggregates are consistent.")
+
+
+@click.command("repair-dispensers")
+@with_appcontext
+def repair_dispensers_command():
+    """Make the open state of every dispenser agree with its open transactions."""
+    repaired = repair_dispenser_state()
+
+    for dispenser_id in repaired:
+        click.echo(f"Repaired dispenser {dispenser_id}")
+
+    if repaired:
+        # Closing the stale open transactions changed the totals
+        rebuild_rollups()
+
+    click.echo(f"{len(repaired)} dispenser(s) repaired.")
+
+
+@click.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups_command():
+    """Recompute the time-bucketed totals from the transaction table."""
+    rebuild_rollups()
+    click.echo("Dispenser rollups rebuilt.")
+
+
+@click.command("archive-transactions")
+@click.option(
+    "--older-than-days",
+    type=float,
+    help="Archive the transactions closed longer ago (ARCHIVE_AFTER_DAYS).",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    help="Transactions moved per database transaction (ARCHIVE_BATCH_SIZE).",
+)
+@with_appcontext
+def archive_transactions_command(older_than_days, batch_size):
+    """Move the old closed transactions to the archive table."""
+    config = current_app.config
+
+    if older_than_days is None:
+        older_than_days = config["ARCHIVE_AFTER_DAYS"]
+
+    archived = archive_transactions(
+        datetime.utcnow() - timedelta(days=older_than_days),
+        batch_size or config["ARCHIVE_BATCH_SIZE"],
+        config["ARCHIVE_BATCH_PAUSE"],
+    )
+    click.echo(f"{archived} transaction(s) archived.")
@@ -0,0 +1,67 @@
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Environment variables mapped to the SQLAlchemy engine option they set
+ENGINE_OPTION_VARIABLES = {
+    "DB_POOL_SIZE": ("pool_size", int),
+    "DB_MAX_OVERFLOW": ("max_overflow", int),
+    "DB_POOL_TIMEOUT": ("pool_timeout", float),
+    "DB_POOL_RECYCLE": ("pool_recycle", int),
+    "DB_POOL_PRE_PING": (
+        "pool_pre_ping",
+        lambda value: value.lower() in ("1", "true", "yes"),
+    ),
+}
+
+# Pragmas run on every new SQLite connection, set by init_sqlite
+sqlite_pragmas = {}
+
+
+def get_engine_options():
+    """Return the engine options set in the environment.
+
+    SQLAlchemy's defaults apply to the options that are not set.
+    """
+    options = {}
+
+    for variable, (option, parse) in ENGINE_OPTION_VARIABLES.items():
+        if os.getenv(variable):
+            options[option] = parse(os.environ[variable])
+
+    return options
+
+
+def init_sqlite(app):
+    """Set the pragmas of the SQLite connections from the app config.
+
+    WAL lets readers go on while a transaction writes, and busy_timeout makes a
+    writer wait for the database lock instead of failing right away when several
+    workers write at once.
+    """
+    app.config.setdefault(
+        "SQLITE_JOURNAL_MODE", os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    )
+    app.config.setdefault(
+        "SQLITE_BUSY_TIMEOUT", int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+    )
+
+    sqlite_pragmas.clear()
+    sqlite_pragmas["journal_mode"] = app.config["SQLITE_JOURNAL_MODE"]
+    sqlite_pragmas["busy_timeout"] = app.config["SQLITE_BUSY_TIMEOUT"]
+
+
+def set_sqlite_pragmas(dbapi_connection):
+    """Run the pragmas set by init_sqlite on a new SQLite DBAPI connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # The asyncio engine registers its own listener, see app.asgi
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        set_sqlite_pragmas(dbapi_connection)
@@ -0,0 +1,250 @@
+import collections
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from app.models import db, DispenserEvent
+
+logger = logging.getLogger(__name__)
+
+
+class DispenserEventStream:
+    """Fan the dispenser open/close events out to Server-Sent Events listeners.
+
+    Events are rows of the dispenser_event table, written in the same database
+    transaction as the open or close they describe, so every worker sees them in
+    id order. One poller thread per process reads the new rows into a buffer and
+    wakes the listeners up, so the database load does not grow with the number of
+    listeners. Listeners only wait on a condition variable; served by a gevent
+    worker, each of them is a cheap greenlet rather than a thread.
+
+    Every EVENT_PRUNE_INTERVAL seconds, the poller also deletes the events it read
+    that are older than EVENT_RETENTION seconds, so a listener can only resume from
+    an id that recent.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._events = collections.deque()
+        self._poller = None
+        self._listeners = 0
+        # Highest event id read by the poller, and the id below which the buffer
+        # no longer holds events
+        self._last_id = 0
+        self._floor = 0
+        self._gap_seen_at = None
+        self._pruned_at = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("EVENT_POLL_INTERVAL", 0.5)
+        app.config.setdefault("EVENT_HEARTBEAT_INTERVAL", 15.0)
+        app.config.setdefault("EVENT_BUFFER_SIZE", 1000)
+        app.config.setdefault("EVENT_GAP_TIMEOUT", 2.0)
+        app.config.setdefault("EVENT_RETRY_INTERVAL", 3000)
+        app.config.setdefault("EVENT_RETENTION", 86400.0)
+        app.config.setdefault("EVENT_PRUNE_INTERVAL", 300.0)
+        app.extensions["dispenser_events"] = self
+        self.app = app
+
+    def notify(self):
+        """Poll right away after events were committed by this process."""
+        self._wakeup.set()
+
+    def listen(self, last_event_id=None):
+        """Yield Server-Sent Events messages for the events after last_event_id.
+
+        Without last_event_id, only the events from now on are sent.
+        """
+        self._subscribe()
+
+        try:
+            with self._condition:
+                if last_event_id is None:
+                    last_event_id = self._last_id
+
+            # Sent right away so the headers are flushed, and tells clients how long
+            # to wait before reconnecting
+            yield f"retry: {self.app.config['EVENT_RETRY_INTERVAL']}\n\n"
+
+            while True:
+                with self._condition:
+                    events = self._buffered_events_after(last_event_id)
+
+                    if events == []:
+                        self._condition.wait(
+                            timeout=self.app.config["EVENT_HEARTBEAT_INTERVAL"]
+                        )
+                        events = self._buffered_events_after(last_event_id)
+
+                    floor = self._floor
+
+                if events is None:
+                    # The listener resumes from before the buffer, read the database
+                    events = self._load_events(last_event_id, floor)
+                    if not events:
+                        last_event_id = floor
+                        continue
+
+                if not events:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                for event in events:
+                    yield self._format_event(event)
+                    last_event_id = event["id"]
+        finally:
+            self._unsubscribe()
+
+    def _format_event(self, event):
+        data = self.app.json.dumps(event)
+
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+    def _buffered_events_after(self, last_event_id):
+        if last_event_id < self._floor:
+            return None
+
+        events = []
+        for event in reversed(self._events):
+            if event["id"] <= last_event_id:
+                break
+            events.append(event)
+
+        events.reverse()
+
+        return events
+
+    def _load_events(self, after_id, up_to_id):
+        with self.app.app_context():
+            events = DispenserEvent.query.filter(
+                DispenserEvent.id > after_id, DispenserEvent.id <= up_to_id
+            ).order_by(DispenserEvent.id)
+
+            return [
+                event.get_event_info()
+                for event in events.limit(self.app.config["EVENT_BUFFER_SIZE"])
+            ]
+
+    def _subscribe(self):
+        with self._condition:
+            self._listeners += 1
+
+            if self._poller is None:
+                with self.app.app_context():
+                    last_id = db.session.query(db.func.max(DispenserEvent.id)).scalar()
+
+                self._last_id = self._floor = last_id or 0
+                self._events.clear()
+                self._poller = threading.Thread(target=self._poll, daemon=True)
+                self._poller.start()
+
+    def _unsubscribe(self):
+        with self._condition:
+            self._listeners -= 1
+            idle = self._listeners == 0
+
+        if idle:
+            # Let the poller stop until someone listens again
+            self.notify()
+
+    def _poll(self):
+        while True:
+            self._wakeup.wait(timeout=self.app.config["EVENT_POLL_INTERVAL"])
+            self._wakeup.clear()
+
+            with self._condition:
+                if self._listeners == 0:
+                    self._poller = None
+                    return
+                last_id = self._last_id
+
+            self._prune(last_id)
+
+            try:
+                with self.app.app_context():
+                    events = [
+                        event.get_event_info()
+                        for event in DispenserEvent.query.filter(
+                            DispenserEvent.id > self._last_id
+                        )
+                        .order_by(DispenserEvent.id)
+                        .limit(self.app.config["EVENT_BUFFER_SIZE"])
+                    ]
+            except Exception:
+                logger.exception("Error polling dispenser events")
+                continue
+
+            with self._condition:
+                events = self._accept_in_order(events)
+
+                if events:
+                    self._events.extend(events)
+                    while len(self._events) > self.app.config["EVENT_BUFFER_SIZE"]:
+                        self._floor = self._events.popleft()["id"]
+
+                    self._condition.notify_all()
+
+    def _prune(self, last_id):
+        now = time.monotonic()
+        if (
+            self._pruned_at is not None
+            and now - self._pruned_at < self.app.config["EVENT_PRUNE_INTERVAL"]
+        ):
+            return
+
+        self._pruned_at = now
+        before = datetime.utcnow() - timedelta(
+            seconds=self.app.config["EVENT_RETENTION"]
+        )
+
+        try:
+            with self.app.app_context():
+                prune_dispenser_events(before, last_id)
+        except Exception:
+            logger.exception("Error pruning dispenser events")
+
+    def _accept_in_order(self, events):
+        accepted = []
+
+        for event in events:
+            if self._last_id and event["id"] != self._last_id + 1:
+                # The missing id may belong to a transaction that has not committed
+                # yet; give it some time before skipping it for good
+                now = time.monotonic()
+                if self._gap_seen_at is None:
+                    self._gap_seen_at = now
+                if now - self._gap_seen_at < self.app.config["EVENT_GAP_TIMEOUT"]:
+                    break
+
+            self._gap_seen_at = None
+            self._last_id = event["id"]
+            accepted.append(event)
+
+        return accepted
+
+
+def prune_dispenser_events(happened_before, up_to_id):
+    """Delete the events that happened before happened_before, up to id up_to_id.
+
+    An event happened when its transaction started (open) or ended (close). Events
+    above up_to_id, not yet read by the poller, are kept. Returns the number of
+    events deleted.
+    """
+    deleted = db.session.execute(
+        db.delete(DispenserEvent).where(
+            DispenserEvent.id <= up_to_id,
+            db.func.coalesce(DispenserEvent.end_time, DispenserEvent.start_time)
+            < happened_before,
+        )
+    ).rowcount
+    db.session.commit()
+
+    return deleted
+
+
+dispenser_events = DispenserEventStream()
@@ -0,0 +1,95 @@
+import csv
+import io
+from datetime import datetime
+from flask import current_app
+from app.models import db, Dispenser
+from app.archive import select_transactions
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_FIELDS = (
+    "transaction_id",
+    "dispenser_id",
+    "start_time",
+    "end_time",
+    "amount",
+    "revenue",
+)
+# Rows fetched from the database cursor and written out per chunk
+EXPORT_BATCH_SIZE = 1000
+
+
+def export_transactions(export_format, dispenser_id=None, start=None, end=None):
+    """Yield the matching transactions as NDJSON or CSV text chunks.
+
+    Rows are read from a server-side cursor in batches, so memory use does not
+    depend on how many transactions are exported.
+    """
+    transactions = select_transactions(
+        None if dispenser_id is None else [dispenser_id], start, end
+    )
+    query = (
+        db.select(
+            transactions.c.id,
+            transactions.c.dispenser_id,
+            transactions.c.start_time,
+            transactions.c.end_time,
+            transactions.c.amount,
+            transactions.c.revenue,
+            Dispenser.flow_volume,
+            Dispenser.price,
+        )
+        .join(Dispenser, transactions.c.dispenser_id == Dispenser.id)
+        .order_by(transactions.c.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    format_rows = _format_csv if export_format == "csv" else _format_ndjson
+    now = datetime.utcnow()
+
+    if export_format == "csv":
+        yield ",".join(EXPORT_FIELDS) + "\r\n"
+
+    result = db.session.execute(query)
+    try:
+        for rows in result.partitions():
+            yield format_rows(_get_export_row(row, now) for row in rows)
+    finally:
+        result.close()
+
+
+def _get_export_row(row, now):
+    (
+        transaction_id,
+        dispenser_id,
+        start_time,
+        end_time,
+        amount,
+        revenue,
+        flow_volume,
+        price,
+    ) = row
+
+    if end_time is None:
+        amount = (now - start_time).total_seconds() * flow_volume
+        revenue = amount * price
+
+    return {
+        "transaction_id": transaction_id,
+        "dispenser_id": dispenser_id,
+        "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "end_time": end_time.strftime("%Y-%m-%d %H:%M:%S") if end_time else None,
+        "amount": amount,
+        "revenue": revenue,
+    }
+
+
+def _format_ndjson(rows):
+    return "".join(current_app.json.dumps(row) + "\n" for row in rows)
+
+
+def _format_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writerows(rows)
+
+    return buffer.getvalue()
@@ -0,0 +1,337 @@
+import functools
+import hashlib
+import itertools
+import os
+import threading
+from datetime import datetime, timedelta
+from flask import Response, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from sqlalchemy.exc import IntegrityError
+from app.models import db, IdempotencyRecord
+
+MAX_KEY_LENGTH = 255
+# Longer callers are stored by digest, to fit the key column with the header
+MAX_CALLER_LENGTH = 64
+# Bytes a stored response is counted for on top of its key and body
+RECORD_OVERHEAD = 200
+# Responses stored between two purges of the expired ones from the database
+PURGE_EVERY = 100
+
+
+class IdempotencyKeyError(Exception):
+    """Raised when a request cannot be served under its Idempotency-Key."""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def request_caller():
+    """Return who the request came from: the identity of its JWT, else its address."""
+    try:
+        verified = verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        # Left to the route to refuse, if it requires a JWT
+        verified = None
+
+    if verified is None:
+        return address_caller(request.remote_addr)
+
+    return f"identity:{get_jwt_identity()}"
+
+
+def address_caller(address):
+    """Return the caller of the requests sent from address without a JWT."""
+    return f"address:{address}"
+
+
+def request_fingerprint(method, path, body):
+    """Return the digest telling apart the requests sent with the same key."""
+    return hashlib.sha1(b"\n".join([method.encode(), path.encode(), body])).digest()
+
+
+class LocalIdempotencyBackend:
+    """Responses kept in the memory of a single process.
+
+    A response is a (fingerprint, status, body, expires_at) tuple. Once they take
+    up more than max_bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._records = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, now, session=None):
+        with self._lock:
+            record = self._records.pop(key, None)
+            if record is None:
+                return None
+
+            if record[3] <= now:
+                self._size -= _record_size(key, record)
+                return None
+
+            # Back to the end of the dict, which is in order of use
+            self._records[key] = record
+
+            return record
+
+    def put(self, key, record, now, session=None):
+        with self._lock:
+            previous = self._records.pop(key, None)
+            if previous is not None:
+                self._size -= _record_size(key, previous)
+
+            self._records[key] = record
+            self._size += _record_size(key, record)
+
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._records))
+                self._size -= _record_size(oldest, self._records.pop(oldest))
+
+
+class DatabaseIdempotencyBackend(LocalIdempotencyBackend):
+    """Responses stored in the database, shared by every worker using it.
+
+    The responses a worker stored or read are also kept in its memory, so that
+    its own retries are answered without a query. The database is read and written
+    through session, db.session by default, and its engine.
+    """
+
+    def __init__(self, max_bytes):
+        super().__init__(max_bytes)
+        self._stores = itertools.count(1)
+
+    def get(self, key, now, session=None):
+        record = super().get(key, now)
+        if record is not None:
+            return record
+
+        session = db.session if session is None else session
+        row = session.execute(
+            db.select(
+                IdempotencyRecord.fingerprint,
+                IdempotencyRecord.status,
+                IdempotencyRecord.body,
+                IdempotencyRecord.expires_at,
+            ).where(IdempotencyRecord.key == key, IdempotencyRecord.expires_at > now)
+        ).first()
+        if row is None:
+            return None
+
+        record = tuple(row)
+        super().put(key, record, now)
+
+        return record
+
+    def put(self, key, record, now, session=None):
+        engine = db.engine if session is None else session.get_bind()
+
+        try:
+            self._insert(engine, key, record, now)
+        except IntegrityError:
+            # The key is taken, by an expired response or by the response of
+            # another worker serving the same request at the same time
+            with engine.begin() as connection:
+                expired = connection.execute(
+                    db.delete(IdempotencyRecord).where(
+                        IdempotencyRecord.key == key,
+                        IdempotencyRecord.expires_at <= now,
+                    )
+                ).rowcount
+
+            if not expired:
+                # The first response stored is the one replayed
+                self.get(key, now, session)
+                return
+
+            self._insert(engine, key, record, now)
+
+        super().put(key, record, now)
+
+    def _insert(self, engine, key, record, now):
+        fingerprint, status, body, expires_at = record
+
+        with engine.begin() as connection:
+            if next(self._stores) % PURGE_EVERY == 0:
+                connection.execute(
+                    db.delete(IdempotencyRecord).where(
+                        IdempotencyRecord.expires_at <= now
+                    )
+                )
+
+            connection.execute(
+                db.insert(IdempotencyRecord).values(
+                    key=key,
+                    fingerprint=fingerprint,
+                    status=status,
+                    body=body,
+                    expires_at=expires_at,
+                )
+            )
+
+
+IDEMPOTENCY_BACKENDS = {
+    "local": LocalIdempotencyBackend,
+    "database": DatabaseIdempotencyBackend,
+}
+
+
+class IdempotencyStore:
+    """Responses to the requests sent with an Idempotency-Key header.
+
+    The first response to a key is stored for IDEMPOTENCY_TTL seconds, together
+    with a fingerprint of its request (method, path and body), unless it is a 5xx
+    or 429 that the client is meant to retry anyway. Sending the same request with
+    the key again replays that response without serving the request. Using the key
+    for another request is answered 422, and retrying while the first request is
+    still being served by this process 409.
+
+    Keys belong to the caller that sent them, so that two clients picking the same
+    key do not see each other's responses.
+
+    Responses are kept in memory, up to IDEMPOTENCY_CACHE_BYTES per process. With
+    IDEMPOTENCY_BACKEND=database they are also stored in the database, so that a
+    retry reaching another worker is replayed as well.
+    """
+
+    def __init__(self, app=None):
+        self.backend = LocalIdempotencyBackend(16 * 2**20)
+        self.ttl = timedelta(days=1)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "IDEMPOTENCY_BACKEND", os.getenv("IDEMPOTENCY_BACKEND", "local")
+        )
+        app.config.setdefault(
+            "IDEMPOTENCY_TTL", float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+        )
+        app.config.setdefault(
+            "IDEMPOTENCY_CACHE_BYTES",
+            int(os.getenv("IDEMPOTENCY_CACHE_BYTES", str(16 * 2**20))),
+        )
+
+        backend_name = app.config["IDEMPOTENCY_BACKEND"]
+        if backend_name not in IDEMPOTENCY_BACKENDS:
+            raise ValueError(f"Unknown idempotency backend: {backend_name}")
+
+        self.backend = IDEMPOTENCY_BACKENDS[backend_name](
+            app.config["IDEMPOTENCY_CACHE_BYTES"]
+        )
+        self.ttl = timedelta(seconds=app.config["IDEMPOTENCY_TTL"])
+        with self._lock:
+            self._pending = set()
+        app.extensions["idempotency_store"] = self
+
+    def start(self, caller, key, fingerprint, session=None):
+        """Return the stored (status, body) of key, else claim key and return None.
+
+        Raises IdempotencyKeyError when the request cannot be served under key. A
+        claimed key must be passed to finish once the request is served.
+        """
+        if not 1 <= len(key) <= MAX_KEY_LENGTH:
+            raise IdempotencyKeyError(
+                f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters long", 400
+            )
+        key = _scoped_key(caller, key)
+        record = self.backend.get(key, datetime.utcnow(), session)
+
+        if record is not None:
+            if record[0] != fingerprint:
+                raise IdempotencyKeyError(
+                    "Idempotency-Key was already used with another request", 422
+                )
+
+            return record[1], record[2]
+
+        with self._lock:
+            if key in self._pending:
+                raise IdempotencyKeyError(
+                    "A request with this Idempotency-Key is still being served", 409
+                )
+
+            self._pending.add(key)
+
+        return None
+
+    def finish(self, caller, key, fingerprint, status, body, session=None):
+        """Store the response of the request that claimed key, and release key.
+
+        status is None when the request failed without a response.
+        """
+        key = _scoped_key(caller, key)
+        try:
+            if status is not None and status < 500 and status != 429:
+                now = datetime.utcnow()
+                self.backend.put(
+                    key, (fingerprint, status, body, now + self.ttl), now, session
+                )
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+idempotency_store = IdempotencyStore()
+
+
+def idempotent(view):
+    """Replay the stored response of the requests retried with an Idempotency-Key."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return view(*args, **kwargs)
+
+        caller = request_caller()
+        fingerprint = request_fingerprint(
+            request.method, request.path, request.get_data()
+        )
+
+        try:
+            stored = idempotency_store.start(caller, key, fingerprint)
+        except IdempotencyKeyError as e:
+            return jsonify({"message": str(e)}), e.status
+
+        if stored is not None:
+            return replayed_response(*stored)
+
+        status = body = None
+        try:
+            response = make_response(view(*args, **kwargs))
+            status, body = response.status_code, response.get_data()
+        finally:
+            idempotency_store.finish(caller, key, fingerprint, status, body)
+
+        return response
+
+    return wrapper
+
+
+def replayed_response(status, body):
+    return Response(
+        body,
+        status,
+        {"Idempotent-Replayed": "true"},
+        mimetype="application/json",
+    )
+
+
+def _scoped_key(caller, key):
+    if len(caller) > MAX_CALLER_LENGTH:
+        caller = hashlib.sha1(caller.encode()).hexdigest()
+
+    return f"{caller} {key}"
+
+
+def _record_size(key, record):
+    return len(key) + len(record[2]) + RECORD_OVERHEAD
@@ -0,0 +1,457 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from flask import jsonify
+from app.models import db, Dispenser, Transaction, DispenserEvent, IngestCheckpoint
+from app.events import dispenser_events
+from app.rollup import record_transaction_rollups
+from app.metrics import count_closed_pours
+
+logger = logging.getLogger(__name__)
+
+INGEST_MODES = ("sync", "write_behind")
+
+
+class TapIngestion:
+    """Write-behind ingestion of the tap open and close events.
+
+    With INGEST_MODE=write_behind, opening or closing a tap appends a record to a
+    local append-only log, fsyncs it and answers right away. A background worker
+    group-commits the records into the database in batches, and stores the
+    sequence number of the last one in the same database transaction, so that a
+    restart replays exactly the records that were not written yet. Readers call
+    flush() to see every acknowledged event.
+
+    A batch failing INGEST_MAX_RETRIES times in a row is written again one record
+    at a time. A record that still fails is appended to the dead-letter log
+    (INGEST_DEAD_LETTER_PATH) and skipped by the checkpoint, so that the records
+    behind it are written.
+
+    The open state of the taps is tracked in memory to answer without touching the
+    database, so this mode assumes a single process serves the taps.
+    """
+
+    checkpoint_name = "tap_events"
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._pending = deque()
+        self._dispensers = {}
+        self._log = None
+        self._worker = None
+        self._stopping = False
+        # Sequence number of the last record appended to the log, and of the last
+        # record written to the database
+        self._sequence = 0
+        self._written_sequence = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("INGEST_MODE", os.getenv("INGEST_MODE", "sync"))
+        app.config.setdefault(
+            "INGEST_LOG_PATH",
+            os.getenv("INGEST_LOG_PATH", os.path.join(app.instance_path, "ingest.log")),
+        )
+        app.config.setdefault(
+            "INGEST_DEAD_LETTER_PATH",
+            os.getenv(
+                "INGEST_DEAD_LETTER_PATH",
+                os.path.join(app.instance_path, "ingest.dead.log"),
+            ),
+        )
+        app.config.setdefault("INGEST_BATCH_SIZE", 500)
+        app.config.setdefault("INGEST_MAX_RETRIES", 3)
+        app.config.setdefault("INGEST_FLUSH_INTERVAL", 0.05)
+        app.config.setdefault("INGEST_FLUSH_TIMEOUT", 5.0)
+
+        if app.config["INGEST_MODE"] not in INGEST_MODES:
+            raise ValueError(f"Unknown ingest mode: {app.config['INGEST_MODE']}")
+
+        app.extensions["tap_ingestion"] = self
+        self.app = app
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config["INGEST_MODE"] == "write_behind"
+
+    def open_taps(self, dispenser_ids):
+        """Log the opening of the given taps, returning one result per dispenser id."""
+        self._start()
+        now = datetime.utcnow()
+        results = []
+        records = []
+
+        with self._lock:
+            dispensers = self._get_dispensers(dispenser_ids)
+
+            for dispenser_id in dispenser_ids:
+                dispenser = dispensers.get(dispenser_id)
+
+                if dispenser is None:
+                    result = {"status": 404, "message": "Dispenser not found"}
+                elif dispenser["open_since"] is not None:
+                    result = {"status": 400, "message": "Dispenser is already open"}
+                else:
+                    dispenser["open_since"] = now
+                    records.append(
+                        {
+                            "type": "open",
+                            "dispenser_id": dispenser_id,
+                            "time": now.isoformat(),
+                        }
+                    )
+                    result = {"status": 200, "message": "Dispenser opened successfully"}
+
+                results.append({"id": dispenser_id, **result})
+
+            self._append(records)
+
+        return results
+
+    def close_taps(self, dispenser_ids):
+        """Log the closing of the given taps, returning one result per dispenser id."""
+        self._start()
+        now = datetime.utcnow()
+        results = []
+        records = []
+
+        with self._lock:
+            dispensers = self._get_dispensers(dispenser_ids)
+
+            for dispenser_id in dispenser_ids:
+                dispenser = dispensers.get(dispenser_id)
+
+                if dispenser is None:
+                    result = {"status": 404, "message": "Dispenser not found"}
+                elif dispenser["open_since"] is None:
+                    result = {"status": 400, "message": "Dispenser is already closed"}
+                else:
+                    time_difference = now - dispenser["open_since"]
+                    amount = time_difference.total_seconds() * dispenser["flow_volume"]
+                    revenue = amount * dispenser["price"]
+                    dispenser["open_since"] = None
+                    records.append(
+                        {
+                            "type": "close",
+                            "dispenser_id": dispenser_id,
+                            "time": now.isoformat(),
+                            "amount": amount,
+                            "revenue": revenue,
+                        }
+                    )
+                    result = {
+                        "status": 200,
+                        "message": "Dispenser closed successfully",
+                        "amount": amount,
+                        "cost": revenue,
+                    }
+
+                results.append({"id": dispenser_id, **result})
+
+            self._append(records)
+
+        return results
+
+    def flush(self):
+        """Wait until every acknowledged event is written to the database.
+
+        Returns False when they could not be written within INGEST_FLUSH_TIMEOUT.
+        """
+        if not self.enabled:
+            return True
+
+        self._start()
+
+        with self._lock:
+            sequence = self._sequence
+            if self._written_sequence >= sequence:
+                return True
+
+            self._wakeup.set()
+
+            return self._written.wait_for(
+                lambda: self._written_sequence >= sequence,
+                timeout=self.app.config["INGEST_FLUSH_TIMEOUT"],
+            )
+
+    def stop(self):
+        """Stop the worker and close the log.
+
+        The records not written to the database yet stay in the log and are
+        replayed by the next start.
+        """
+        with self._lock:
+            if self._worker is None:
+                return
+
+            self._stopping = True
+            worker = self._worker
+
+        self._wakeup.set()
+        worker.join()
+
+        with self._lock:
+            self._log.close()
+            self._log = None
+            self._worker = None
+            self._stopping = False
+            self._pending.clear()
+            self._dispensers.clear()
+            self._wakeup.clear()
+
+    def _start(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+
+            path = self.app.config["INGEST_LOG_PATH"]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._recover(path)
+
+            self._log = open(path, "a", encoding="utf-8")
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def _recover(self, path):
+        """Write the records of a previous run that were missing from the database."""
+        with self.app.app_context():
+            checkpoint = db.session.get(IngestCheckpoint, self.checkpoint_name)
+            sequence = checkpoint.sequence if checkpoint else 0
+
+        records = [
+            record for record in self._read_log(path) if record["sequence"] > sequence
+        ]
+
+        if records:
+            logger.info("Replaying %s tap events from %s", len(records), path)
+            try:
+                self._write(records)
+            except Exception:
+                logger.exception("Error replaying tap events")
+                self._write_separately(records)
+            sequence = records[-1]["sequence"]
+            dispenser_events.notify()
+
+        self._sequence = self._written_sequence = sequence
+        open(path, "w").close()
+
+    def _read_log(self, path):
+        records = []
+
+        try:
+            log = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return records
+
+        with log:
+            for line in log:
+                try:
+                    if not line.endswith("\n"):
+                        raise ValueError("Incomplete record")
+                    records.append(json.loads(line))
+                except ValueError:
+                    # The write was cut short by a crash, so it was never acknowledged
+                    logger.warning("Ignoring a torn record at the end of %s", path)
+                    break
+
+        return records
+
+    def _get_dispensers(self, dispenser_ids):
+        missing = {
+            dispenser_id
+            for dispenser_id in dispenser_ids
+            if dispenser_id not in self._dispensers
+        }
+
+        # Unknown dispensers have no pending record yet, so the database is current
+        for dispenser in Dispenser.query.filter(Dispenser.id.in_(missing)):
+            transaction = (
+                dispenser.get_open_transaction() if dispenser.is_open else None
+            )
+            self._dispensers[dispenser.id] = {
+                "flow_volume": dispenser.flow_volume,
+                "price": dispenser.price,
+                "open_since": transaction.start_time if transaction else None,
+            }
+
+        return self._dispensers
+
+    def _append(self, records):
+        if not records:
+            return
+
+        lines = []
+        for record in records:
+            self._sequence += 1
+            record["sequence"] = self._sequence
+            lines.append(json.dumps(record) + "\n")
+
+        self._log.write("".join(lines))
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+        self._pending.extend(records)
+        if len(self._pending) >= self.app.config["INGEST_BATCH_SIZE"]:
+            self._wakeup.set()
+
+    def _run(self):
+        failures = 0
+
+        while True:
+            self._wakeup.wait(timeout=self.app.config["INGEST_FLUSH_INTERVAL"])
+            self._wakeup.clear()
+
+            with self._lock:
+                if self._stopping:
+                    return
+
+                batch = list(
+                    itertools.islice(
+                        self._pending, self.app.config["INGEST_BATCH_SIZE"]
+                    )
+                )
+
+            if not batch:
+                continue
+
+            try:
+                if failures < self.app.config["INGEST_MAX_RETRIES"]:
+                    self._write(batch)
+                else:
+                    self._write_separately(batch)
+            except Exception:
+                # The records stay pending and are retried with the next batch
+                failures += 1
+                logger.exception("Error writing tap events (%s failures)", failures)
+                continue
+
+            failures = 0
+
+            with self._lock:
+                for _ in batch:
+                    self._pending.popleft()
+                self._written_sequence = batch[-1]["sequence"]
+
+                if self._pending:
+                    self._wakeup.set()
+                else:
+                    # Everything in the log is in the database now
+                    self._log.truncate(0)
+
+                self._written.notify_all()
+
+            dispenser_events.notify()
+
+    def _write(self, records):
+        with self.app.app_context():
+            try:
+                for record in records:
+                    if record["type"] == "open":
+                        self._write_open(record)
+                    else:
+                        self._write_close(record)
+
+                self._set_checkpoint(records[-1]["sequence"])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _write_separately(self, records):
+        """Write records one at a time, moving those that fail to the dead letters.
+
+        Raises when the checkpoint cannot be written either, i.e. the database is
+        unavailable rather than the record at fault.
+        """
+        for record in records:
+            try:
+                self._write([record])
+                continue
+            except Exception:
+                logger.exception("Error writing tap event %s", record["sequence"])
+
+            with self.app.app_context():
+                try:
+                    self._set_checkpoint(record["sequence"])
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+            path = self.app.config["INGEST_DEAD_LETTER_PATH"]
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "a", encoding="utf-8") as dead_letters:
+                dead_letters.write(json.dumps(record) + "\n")
+            logger.error(
+                "Moved tap event %s to %s: %s", record["sequence"], path, record
+            )
+
+    def _set_checkpoint(self, sequence):
+        checkpoint = db.session.get(IngestCheckpoint, self.checkpoint_name)
+        if checkpoint is None:
+            checkpoint = IngestCheckpoint(name=self.checkpoint_name)
+            db.session.add(checkpoint)
+        checkpoint.sequence = sequence
+
+    def _write_open(self, record):
+        dispenser_id = record["dispenser_id"]
+        transaction = Transaction(
+            dispenser_id=dispenser_id,
+            start_time=datetime.fromisoformat(record["time"]),
+        )
+        db.session.add(transaction)
+        db.session.flush()
+
+        if not Dispenser.mark_open(dispenser_id, transaction.id):
+            logger.warning("Dispenser %s was opened by another process", dispenser_id)
+            db.session.delete(transaction)
+            return
+
+        db.session.add(DispenserEvent("open", transaction))
+
+    def _write_close(self, record):
+        dispenser_id = record["dispenser_id"]
+        dispenser = db.session.get(Dispenser, dispenser_id)
+        transaction = dispenser.get_open_transaction() if dispenser else None
+
+        if transaction is None or not Dispenser.mark_closed(
+            dispenser_id,
+            dispenser.open_transaction_id,
+            record["amount"],
+            record["revenue"],
+        ):
+            logger.warning("Dispenser %s was closed by another process", dispenser_id)
+            return
+
+        transaction.end_time = datetime.fromisoformat(record["time"])
+        transaction.amount = record["amount"]
+        transaction.revenue = record["revenue"]
+        record_transaction_rollups([transaction])
+        count_closed_pours([transaction])
+        db.session.add(DispenserEvent("close", transaction))
+
+
+tap_ingestion = TapIngestion()
+
+
+def flush_tap_events(view):
+    """Make a read view wait for the acknowledged tap events to be written."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not tap_ingestion.flush():
+            return jsonify({"message": "Tap events are still being written"}), 503
+
+        return view(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,107 @@
+import math
+import re
+from datetime import datetime
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+COMPACT_SEPARATORS = (",", ":")
+
+# Floats orjson writes differently from the standard library: below 1e-4, which
+# orjson writes as 0.0000..., and those it writes with an exponent where Python
+# writes one such as 1e-05 or 1e+16. A regular expression starting with a literal
+# scans a large body about as fast as a substring search
+SMALL_FLOAT = b"0.0000"
+EXPONENT = re.compile(rb"e[-+0-9]")
+# orjson writes NaN and the infinities as null, where Python writes NaN, Infinity
+# and -Infinity
+NULL = b"null"
+
+
+def default(value):
+    """Serialize datetimes in the API format, other types as Flask does."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).isoformat(" ", "seconds")
+
+    return _default(value)
+
+
+class ApiJSONProvider(DefaultJSONProvider):
+    """JSON provider writing compact responses with orjson when it is installed.
+
+    The output is byte for byte the one of Flask's default provider: keys are
+    sorted, non-ASCII characters escaped and datetimes written as
+    "%Y-%m-%d %H:%M:%S". Whatever orjson cannot write the same way is serialized
+    with the standard library json module instead, as are non-compact dumps (the
+    debug mode responses, the NDJSON export and the event stream).
+    """
+
+    default = staticmethod(default)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get("separators") == COMPACT_SEPARATORS and len(kwargs) == 1:
+            body = self._orjson_dumps(obj)
+            if body is not None:
+                return body.decode()
+
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+
+        if self.compact or (self.compact is None and not self._app.debug):
+            body = self._orjson_dumps(obj)
+            if body is not None:
+                return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+        return super().response(obj)
+
+    def _orjson_dumps(self, obj):
+        if orjson is None or not self.sort_keys or not self.ensure_ascii:
+            return None
+
+        try:
+            body = orjson.dumps(
+                obj,
+                default=self.default,
+                option=orjson.OPT_SORT_KEYS
+                | orjson.OPT_PASSTHROUGH_DATETIME
+                | orjson.OPT_PASSTHROUGH_DATACLASS,
+            )
+        except TypeError:
+            # Integers beyond 64 bits, non-string keys, ...
+            return None
+
+        # ensure_ascii escapes non-ASCII characters and DEL
+        if not body.isascii() or b"\x7f" in body:
+            return None
+
+        if SMALL_FLOAT in body or EXPONENT.search(body):
+            return None
+
+        if NULL in body and self._has_non_finite_float(obj):
+            return None
+
+        return body
+
+    def _has_non_finite_float(self, obj):
+        values = [obj]
+
+        while values:
+            value = values.pop()
+
+            if isinstance(value, float):
+                if not math.isfinite(value):
+                    return True
+            elif isinstance(value, dict):
+                values.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                values.extend(value)
+            elif not isinstance(value, (str, int, type(None))):
+                # Dataclasses, decimals, ... as orjson got them from default
+                values.append(self.default(value))
+
+        return False
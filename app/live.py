@@ -0,0 +1,157 @@
+import threading
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.cache import dispenser_cache
+from app.models import db, Dispenser, Transaction, DispenserEvent
+
+
+class OpenTapRegistry:
+    """In-memory registry of the taps currently pouring.
+
+    Maps each open dispenser to its open transaction, start time, flow volume and
+    price, so the live amounts of every pour are estimated without reading the
+    transaction table. The registry is tagged with the dispenser cache version it
+    is up to date with. It is loaded from the database on the first read, and
+    reloaded whenever the version moved on without it, e.g. after another worker
+    opened a tap with the database cache backend. The opens and closes committed
+    by this process are applied in place, as long as no other change to the
+    dispensers came in between.
+    """
+
+    def __init__(self, app=None):
+        self._taps = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        with self._lock:
+            self._taps = {}
+            self._version = None
+
+        app.extensions["open_tap_registry"] = self
+
+    def get_live_pours(self, now=None):
+        """Return the estimated amount and revenue of every open tap as of now."""
+        now = now or datetime.utcnow()
+        pours = []
+
+        for dispenser_id, (transaction_id, start_time, flow_volume, price) in sorted(
+            self.snapshot().items()
+        ):
+            amount = (now - start_time).total_seconds() * flow_volume
+            pours.append(
+                {
+                    "dispenser_id": dispenser_id,
+                    "transaction_id": transaction_id,
+                    "start_time": start_time,
+                    "amount": amount,
+                    "revenue": amount * price,
+                }
+            )
+
+        return pours
+
+    def snapshot(self):
+        """Return a copy of the registry, reloading it first if it is stale."""
+        version = dispenser_cache.backend.current()
+
+        with self._lock:
+            if self._version != version:
+                self._taps = self._load()
+                self._version = version
+
+            return dict(self._taps)
+
+    def apply(self, changes, version):
+        """Apply the opens and closes of a commit that moved the version to version."""
+        with self._lock:
+            # Another change to the dispensers came first: leave the registry stale
+            if self._version is None or self._version != version - 1:
+                return
+
+            # An open carries the tap, a close the id of the transaction it closed
+            for change, dispenser_id, value in changes:
+                if change == "open":
+                    self._taps[dispenser_id] = value
+                elif self._taps.get(dispenser_id, (None,))[0] == value:
+                    del self._taps[dispenser_id]
+
+            self._version = version
+
+    def _load(self):
+        rows = db.session.execute(
+            db.select(
+                Transaction.dispenser_id,
+                Transaction.id,
+                Transaction.start_time,
+                Dispenser.flow_volume,
+                Dispenser.price,
+            )
+            .join(Dispenser, Transaction.dispenser_id == Dispenser.id)
+            .where(Transaction.end_time.is_(None))  # type: ignore
+            # Should several transactions be left open, the latest one wins
+            .order_by(Transaction.start_time)
+        )
+
+        return {dispenser_id: tuple(tap) for dispenser_id, *tap in rows}
+
+
+open_tap_registry = OpenTapRegistry()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_tap_events(session, flush_context):
+    tap_events = [
+        instance for instance in session.new if isinstance(instance, DispenserEvent)
+    ]
+    if not tap_events or session.info.get("tap_changes", []) is None:
+        return
+
+    changes = session.info.setdefault("tap_changes", [])
+
+    for tap_event in tap_events:
+        if tap_event.event_type == "close":
+            changes.append(("close", tap_event.dispenser_id, tap_event.transaction_id))
+            continue
+
+        dispenser = session.identity_map.get(
+            Dispenser.__mapper__.identity_key_from_primary_key(
+                (tap_event.dispenser_id,)
+            )
+        )
+        if dispenser is None:
+            # The registry has to be reloaded to learn the flow volume and price
+            session.info["tap_changes"] = None
+            return
+
+        changes.append(
+            (
+                "open",
+                tap_event.dispenser_id,
+                (
+                    tap_event.transaction_id,
+                    tap_event.start_time,
+                    dispenser.flow_volume,
+                    dispenser.price,
+                ),
+            )
+        )
+
+
+# Registered after the dispenser cache's listener, which sets dispenser_version
+@event.listens_for(Session, "after_commit")
+def _apply_tap_changes(session):
+    changes = session.info.pop("tap_changes", None)
+    version = session.info.pop("dispenser_version", None)
+
+    if changes and version is not None:
+        open_tap_registry.apply(changes, version)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_tap_changes(session):
+    session.info.pop("tap_changes", None)
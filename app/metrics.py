@@ -0,0 +1,254 @@
+import os
+import time
+from contextvars import ContextVar
+from flask import request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+from app.models import db, Dispenser
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests served", ["method", "route", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time spent serving HTTP requests",
+    ["method", "route"],
+)
+REQUEST_STATEMENTS = Histogram(
+    "db_statements_per_request",
+    "SQL statements executed by an HTTP request",
+    ["route"],
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+REQUEST_DB_DURATION = Histogram(
+    "db_duration_per_request_seconds",
+    "Time spent executing SQL statements by an HTTP request",
+    ["route"],
+)
+STATEMENTS = Counter("db_statements_total", "SQL statements executed")
+STATEMENT_DURATION = Counter(
+    "db_statement_duration_seconds_total", "Time spent executing SQL statements"
+)
+POOL_OPEN = Gauge(
+    "db_pool_connections_open",
+    "Database connections opened by the connection pools",
+    multiprocess_mode="livesum",
+)
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_connections_checked_out",
+    "Database connections currently checked out of the connection pools",
+    multiprocess_mode="livesum",
+)
+DISPENSED_LITRES = Counter(
+    "dispensed_litres_total", "Litres poured by the closed transactions"
+)
+REVENUE = Counter("revenue_total", "Revenue of the closed transactions")
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Lookups of the in-process caches, by whether they found the entry",
+    ["cache", "result"],
+)
+
+# [start time, SQL statements, SQL duration] of the request being served
+_request_stats = ContextVar("request_stats", default=None)
+
+
+class OpenDispensersCollector:
+    """Reads the number of open dispensers from the database at scrape time.
+
+    The count is the same whichever worker is scraped, unlike a gauge kept up to
+    date by each process.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def collect(self):
+        with self.app.app_context():
+            count = db.session.execute(
+                db.select(db.func.count(Dispenser.id)).where(
+                    Dispenser.is_open.is_(True)
+                )
+            ).scalar()
+
+        yield GaugeMetricFamily(
+            "dispensers_open", "Dispensers currently pouring", value=count
+        )
+
+
+class Metrics:
+    """Prometheus metrics of the API, exposed by the /metrics route.
+
+    Every request is counted and timed per route, together with the number and
+    duration of the SQL statements it ran. When PROMETHEUS_MULTIPROC_DIR is set,
+    as it must be under several gunicorn workers, the metrics of every worker are
+    written to that directory and added up at scrape time. Set METRICS_ENABLED to
+    false to stop recording them.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._collector = None
+        self._children = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "METRICS_ENABLED",
+            os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes"),
+        )
+
+        self.enabled = app.config["METRICS_ENABLED"]
+        self._collector = OpenDispensersCollector(app)
+        app.before_request(self.start_request)
+        app.after_request(self._end_request)
+        # after_request is skipped when the view raises
+        app.teardown_request(self._end_failed_request)
+        app.extensions["metrics"] = self
+
+    def export(self):
+        """Return the body and content type of the /metrics response."""
+        registry = CollectorRegistry()
+
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry.register(_RegistryCollector(REGISTRY))
+
+        registry.register(self._collector)
+
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    def start_request(self):
+        """Start counting the SQL statements of the request served in this context."""
+        if self.enabled:
+            _request_stats.set([time.perf_counter(), 0, 0.0])
+
+    def end_request(self, method, route, status):
+        """Record the request started by start_request, labelled with route."""
+        stats = _request_stats.get()
+        if stats is None:
+            return
+
+        _request_stats.set(None)
+        key = (method, route, status)
+        children = self._children.get(key)
+
+        if children is None:
+            # Looking up the labelled children costs more than updating them
+            children = self._children[key] = (
+                REQUESTS.labels(*key),
+                REQUEST_DURATION.labels(method, route),
+                REQUEST_STATEMENTS.labels(route),
+                REQUEST_DB_DURATION.labels(route),
+            )
+
+        requests, duration, statements, db_duration = children
+        requests.inc()
+        duration.observe(time.perf_counter() - stats[0])
+        statements.observe(stats[1])
+        db_duration.observe(stats[2])
+
+    def _end_request(self, response):
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        self.end_request(request.method, route, response.status_code)
+
+        return response
+
+    def _end_failed_request(self, exc):
+        if _request_stats.get() is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            self.end_request(request.method, route, 500)
+
+
+class _RegistryCollector:
+    # Lets a scrape registry include the metrics of the default one
+    def __init__(self, registry):
+        self.registry = registry
+
+    def collect(self):
+        return self.registry.collect()
+
+
+metrics = Metrics()
+
+
+def count_closed_pours(transactions, session=None):
+    """Add the closed transactions to the litres and revenue counters on commit.
+
+    The counters are updated when session, db.session by default, commits.
+    """
+    if metrics.enabled:
+        session = db.session if session is None else session
+        session.info.setdefault("closed_pours", []).extend(
+            (transaction.amount, transaction.revenue) for transaction in transactions
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _count_committed_pours(session):
+    for amount, revenue in session.info.pop("closed_pours", ()):
+        DISPENSED_LITRES.inc(amount)
+        REVENUE.inc(revenue)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_closed_pours(session):
+    session.info.pop("closed_pours", None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if metrics.enabled and context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "metrics_started", None)
+    if started is None:
+        return
+
+    duration = time.perf_counter() - started
+    STATEMENTS.inc()
+    STATEMENT_DURATION.inc(duration)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats[1] += 1
+        stats[2] += duration
+
+
+@event.listens_for(Pool, "connect")
+def _open_connection(dbapi_connection, connection_record):
+    POOL_OPEN.inc()
+
+
+@event.listens_for(Pool, "close")
+def _close_connection(dbapi_connection, connection_record):
+    POOL_OPEN.dec()
+
+
+@event.listens_for(Pool, "checkout")
+def _check_out_connection(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKED_OUT.inc()
+
+
+@event.listens_for(Pool, "checkin")
+def _check_in_connection(dbapi_connection, connection_record):
+    POOL_CHECKED_OUT.dec()
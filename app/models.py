@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
-import bcrypt
-from datetime import datetime
+import math
+from app.passwords import password_hasher
 
 db = SQLAlchemy()
 
@@ -12,13 +12,24 @@ class Admin(db.Model):
 
     def __init__(self, username, password):
         self.username = username
-        self.password_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        self.password_hash = password_hasher.hash(password)
 
     def __repr__(self):
         return f"<User {self.username}>"
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode("utf-8"), self.password_hash)
+        """Check password in the bcrypt pool, rehashing it if the cost changed.
+
+        Raises PasswordCheckRejected when the pool is saturated. The caller commits
+        the new hash.
+        """
+        if not password_hasher.check(password, self.password_hash):
+            return False
+
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+
+        return True
 
 
 class Dispenser(db.Model):
@@ -26,12 +37,36 @@ class Dispenser(db.Model):
     flow_volume = db.Column(db.Float, nullable=False)
     price = db.Column(db.Float, nullable=False)
     is_open = db.Column(db.Boolean, default=False)
-    transactions = db.relationship("Transaction", back_populates="dispenser")
+    # The transaction of the pour in progress, set while is_open is True
+    open_transaction_id = db.Column(
+        db.Integer,
+        db.ForeignKey(
+            "transaction.id", use_alter=True, name="fk_dispenser_open_transaction_id"
+        ),
+        nullable=True,
+    )
+    # Running totals of closed transactions, kept up to date by close_dispenser
+    closed_transactions = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    closed_amount = db.Column(db.Float, nullable=False, default=0.0, server_default="0")
+    closed_revenue = db.Column(
+        db.Float, nullable=False, default=0.0, server_default="0"
+    )
+    transactions = db.relationship(
+        "Transaction",
+        back_populates="dispenser",
+        foreign_keys="Transaction.dispenser_id",
+    )
 
     def __init__(self, flow_volume, price):
         self.flow_volume = flow_volume
         self.price = price
         self.is_open = False
+        self.open_transaction_id = None
+        self.closed_transactions = 0
+        self.closed_amount = 0.0
+        self.closed_revenue = 0.0
 
     def get_dispenser_info(self):
         return {
@@ -41,46 +76,84 @@ class Dispenser(db.Model):
             "is_open": self.is_open,
         }
 
-    def get_dispenser_stats(self):
-        transactions = self.transactions
+    def get_open_transaction(self):
+        if self.open_transaction_id is not None:
+            return db.session.get(Transaction, self.open_transaction_id)
 
-        total_transactions = len(transactions)  # type: ignore
+        # Dispensers opened before open_transaction_id was tracked
+        return (
+            Transaction.query.filter_by(dispenser_id=self.id, end_time=None)
+            .order_by(Transaction.start_time.desc())  # type: ignore
+            .first()
+        )
 
-        dispenser_stats = {
-            "dispenser_id": self.id,
-            "flow_volume": self.flow_volume,
-            "price": self.price,
-            "is_open": self.is_open,
-            "total_transactions": total_transactions,
-            "total_amount": 0,
-            "total_revenue": 0,
-            "transactions": [],
+    def record_closed_transaction(self, amount, revenue, count=1):
+        for name, value in Dispenser.closed_transaction_values(
+            amount, revenue, count
+        ).items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def closed_transaction_values(amount, revenue, count=1):
+        # Increment in SQL so concurrent closes never overwrite each other
+        return {
+            "closed_transactions": Dispenser.closed_transactions + count,
+            "closed_amount": Dispenser.closed_amount + amount,
+            "closed_revenue": Dispenser.closed_revenue + revenue,
         }
 
-        total_amount = 0
-        total_revenue = 0
-        now = datetime.utcnow()
+    @classmethod
+    def mark_open(cls, dispenser_id, transaction_id):
+        """Flag a closed dispenser as open in a single conditional UPDATE.
+
+        Returns False when the dispenser was opened concurrently, in which case the
+        caller must roll back.
+        """
+        result = db.session.execute(
+            cls.mark_open_statement(dispenser_id, transaction_id)
+        )
 
-        for transaction in transactions:  # type: ignore
-            amount, revenue = transaction.get_amount_and_revenue(now)
+        return result.rowcount == 1
 
-            total_amount += amount
-            total_revenue += revenue
-            transaction_info = {
-                "transaction_id": transaction.id,
-                "start_time": transaction.start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "end_time": transaction.end_time.strftime("%Y-%m-%d %H:%M:%S")
-                if transaction.end_time
-                else None,
-                "amount": amount,
-                "revenue": revenue,
-            }
-            dispenser_stats["transactions"].append(transaction_info)
+    @classmethod
+    def mark_closed(cls, dispenser_id, transaction_id, amount, revenue):
+        """Flag an open dispenser as closed in a single conditional UPDATE.
 
-        dispenser_stats["total_amount"] = total_amount
-        dispenser_stats["total_revenue"] = total_revenue
+        The update only applies while transaction_id is still the dispenser's open
+        transaction, and adds the transaction to the running totals. Returns False
+        when the dispenser was closed concurrently.
+        """
+        result = db.session.execute(
+            cls.mark_closed_statement(dispenser_id, transaction_id, amount, revenue)
+        )
 
-        return dispenser_stats
+        return result.rowcount == 1
+
+    @classmethod
+    def mark_open_statement(cls, dispenser_id, transaction_id):
+        # The UPDATE run by mark_open, for sessions other than db.session
+        return (
+            db.update(cls)
+            .where(cls.id == dispenser_id, cls.is_open.isnot(True))
+            .values(is_open=True, open_transaction_id=transaction_id)
+        )
+
+    @classmethod
+    def mark_closed_statement(cls, dispenser_id, transaction_id, amount, revenue):
+        # The UPDATE run by mark_closed, for sessions other than db.session
+        return (
+            db.update(cls)
+            .where(
+                cls.id == dispenser_id,
+                cls.is_open.is_(True),
+                cls.open_transaction_id == transaction_id,
+            )
+            .values(
+                is_open=False,
+                open_transaction_id=None,
+                **cls.closed_transaction_values(amount, revenue),
+            )
+        )
 
 
 class Transaction(db.Model):
@@ -90,7 +163,21 @@ class Transaction(db.Model):
     end_time = db.Column(db.TIMESTAMP, nullable=True)
     amount = db.Column(db.Float, nullable=False, default=0.0)
     revenue = db.Column(db.Float, nullable=False, default=0.0)
-    dispenser = db.relationship("Dispenser", back_populates="transactions")
+    dispenser = db.relationship(
+        "Dispenser", back_populates="transactions", foreign_keys=[dispenser_id]
+    )
+
+    __table_args__ = (
+        db.Index("ix_transaction_dispenser_id_start_time", dispenser_id, start_time),
+        # Only open transactions are indexed, so closing a tap looks up a tiny index
+        db.Index(
+            "ix_transaction_open",
+            dispenser_id,
+            start_time,
+            sqlite_where=end_time.is_(None),  # type: ignore
+            postgresql_where=end_time.is_(None),  # type: ignore
+        ),
+    )
 
     def __init__(
         self, dispenser_id, start_time=None, end_time=None, amount=0.0, revenue=0.0
@@ -110,3 +197,221 @@ class Transaction(db.Model):
             return (amount, revenue)
 
         return (self.amount, self.revenue)
+
+
+class ArchivedTransaction(db.Model):
+    # Closed transactions moved out of the transaction table by
+    # archive_transactions. They keep their id, and are still counted in the
+    # running totals of their dispenser
+    __tablename__ = "transaction_archive"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    dispenser_id = db.Column(db.Integer, db.ForeignKey("dispenser.id"), nullable=False)
+    start_time = db.Column(db.TIMESTAMP, nullable=False)
+    end_time = db.Column(db.TIMESTAMP, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    revenue = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.Index(
+            "ix_transaction_archive_dispenser_id_start_time", dispenser_id, start_time
+        ),
+        db.Index("ix_transaction_archive_start_time", start_time),
+    )
+
+
+class DispenserEvent(db.Model):
+    # The autoincrement id doubles as the Server-Sent Events id
+    id = db.Column(db.Integer, primary_key=True)
+    dispenser_id = db.Column(db.Integer, db.ForeignKey("dispenser.id"), nullable=False)
+    event_type = db.Column(db.String(16), nullable=False)
+    transaction_id = db.Column(db.Integer, nullable=False)
+    start_time = db.Column(db.TIMESTAMP, nullable=False)
+    end_time = db.Column(db.TIMESTAMP, nullable=True)
+    amount = db.Column(db.Float, nullable=True)
+    cost = db.Column(db.Float, nullable=True)
+
+    # Never reuse the ids of deleted events, listeners resume from them
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    def __init__(self, event_type, transaction):
+        self.dispenser_id = transaction.dispenser_id
+        self.event_type = event_type
+        self.transaction_id = transaction.id
+        self.start_time = transaction.start_time
+        self.end_time = transaction.end_time
+        if transaction.end_time is not None:
+            self.amount = transaction.amount
+            self.cost = transaction.revenue
+
+    def get_event_info(self):
+        return {
+            "id": self.id,
+            "type": self.event_type,
+            "dispenser_id": self.dispenser_id,
+            "transaction_id": self.transaction_id,
+            # Formatted by the JSON provider
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "amount": self.amount,
+            "cost": self.cost,
+        }
+
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DispenserRollup(db.Model):
+    # Closed transactions totalled per dispenser and time bucket. A bucket spans
+    # bucket_minutes minutes from its start, counted in minutes since the epoch
+    dispenser_id = db.Column(
+        db.Integer, db.ForeignKey("dispenser.id"), primary_key=True
+    )
+    bucket_minutes = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    transactions = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index("ix_dispenser_rollup_bucket_minutes_bucket", bucket_minutes, bucket),
+    )
+
+
+class IngestCheckpoint(db.Model):
+    # Sequence number of the last write-behind log record written to the database
+    name = db.Column(db.String(80), primary_key=True)
+    sequence = db.Column(db.Integer, nullable=False, default=0)
+
+
+class IdempotencyRecord(db.Model):
+    # Response replayed to the retries of a request sent with an Idempotency-Key,
+    # together with a digest of that request. key is the caller (the client
+    # address or JWT identity, up to 64 characters) and the header, space separated
+    key = db.Column(db.String(320), primary_key=True)
+    fingerprint = db.Column(db.LargeBinary(20), nullable=False)
+    status = db.Column(db.SmallInteger, nullable=False)
+    body = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.TIMESTAMP, nullable=False)
+
+    __table_args__ = (db.Index("ix_idempotency_record_expires_at", expires_at),)
+
+
+def rebuild_dispenser_aggregates():
+    """Recompute the closed transaction totals of every dispenser with a full scan."""
+    totals = _scan_closed_transaction_totals()
+
+    for dispenser in Dispenser.query.all():
+        count, amount, revenue = totals.get(dispenser.id, (0, 0.0, 0.0))
+        dispenser.closed_transactions = count
+        dispenser.closed_amount = amount
+        dispenser.closed_revenue = revenue
+
+    db.session.commit()
+
+
+def check_dispenser_aggregates():
+    """Return the dispensers whose stored totals disagree with a full scan."""
+    totals = _scan_closed_transaction_totals()
+    mismatches = []
+
+    for dispenser in Dispenser.query.all():
+        count, amount, revenue = totals.get(dispenser.id, (0, 0.0, 0.0))
+        if (
+            dispenser.closed_transactions != count
+            or not math.isclose(dispenser.closed_amount, amount, abs_tol=1e-9)
+            or not math.isclose(dispenser.closed_revenue, revenue, abs_tol=1e-9)
+        ):
+            mismatches.append(
+                {
+                    "dispenser_id": dispenser.id,
+                    "stored": (
+                        dispenser.closed_transactions,
+                        dispenser.closed_amount,
+                        dispenser.closed_revenue,
+                    ),
+                    "scanned": (count, amount, revenue),
+                }
+            )
+
+    return mismatches
+
+
+def repair_dispenser_state():
+    """Make the open state of every dispenser agree with its open transactions.
+
+    The latest open transaction of a dispenser becomes its current one, and any
+    older open transaction is closed at the time the next one started. Returns the
+    ids of the dispensers that had to be repaired.
+    """
+    open_transactions = {}
+    for transaction in Transaction.query.filter(
+        Transaction.end_time.is_(None)  # type: ignore
+    ).order_by(Transaction.dispenser_id, Transaction.start_time):
+        open_transactions.setdefault(transaction.dispenser_id, []).append(transaction)
+
+    repaired = []
+
+    for dispenser in Dispenser.query.all():
+        transactions = open_transactions.get(dispenser.id, [])
+        current = transactions[-1] if transactions else None
+        stale_amount = 0.0
+        stale_revenue = 0.0
+
+        for stale, following in zip(transactions, transactions[1:]):
+            amount, revenue = stale.get_amount_and_revenue(following.start_time)
+            stale.amount = amount
+            stale.revenue = revenue
+            stale.end_time = following.start_time
+            stale_amount += amount
+            stale_revenue += revenue
+
+        if len(transactions) > 1:
+            dispenser.record_closed_transaction(
+                stale_amount, stale_revenue, count=len(transactions) - 1
+            )
+
+        current_id = current.id if current else None
+        if (
+            len(transactions) > 1
+            or dispenser.open_transaction_id != current_id
+            or bool(dispenser.is_open) != (current is not None)
+        ):
+            dispenser.open_transaction_id = current_id
+            dispenser.is_open = current is not None
+            repaired.append(dispenser.id)
+
+    db.session.commit()
+
+    return repaired
+
+
+def _scan_closed_transaction_totals():
+    totals = {}
+
+    for table in (Transaction, ArchivedTransaction):
+        rows = (
+            db.session.query(
+                table.dispenser_id,
+                db.func.count(table.id),
+                db.func.coalesce(db.func.sum(table.amount), 0.0),
+                db.func.coalesce(db.func.sum(table.revenue), 0.0),
+            )
+            .filter(table.end_time.isnot(None))  # type: ignore
+            .group_by(table.dispenser_id)
+            .all()
+        )
+
+        for dispenser_id, count, amount, revenue in rows:
+            total_count, total_amount, total_revenue = totals.get(
+                dispenser_id, (0, 0.0, 0.0)
+            )
+            totals[dispenser_id] = (
+                total_count + count,
+                total_amount + amount,
+                total_revenue + revenue,
+            )
+
+    return totals
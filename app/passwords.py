@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+
+class PasswordCheckRejected(Exception):
+    """Raised when too many password checks are already running or waiting."""
+
+
+class PasswordHasher:
+    """Runs bcrypt off the request threads, in a bounded pool.
+
+    bcrypt releases the GIL, so the hashes run on BCRYPT_WORKERS threads while the
+    request thread (or greenlet, under gevent, where they run on the hub's
+    native thread pool) waits. At most BCRYPT_QUEUE_SIZE more checks may wait for
+    a free thread; past that, check raises PasswordCheckRejected right away
+    instead of tying up yet another request.
+
+    Hashes are created with BCRYPT_ROUNDS; needs_rehash tells when a stored hash
+    used another cost.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self._workers = 1
+        self._slots = threading.BoundedSemaphore(self._workers)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # The threads of a pool started before a fork (e.g. gunicorn --preload
+        # hashing the admin password) do not exist in the child
+        os.register_at_fork(after_in_child=self._forget_executor)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("BCRYPT_ROUNDS", int(os.getenv("BCRYPT_ROUNDS", "12")))
+        app.config.setdefault("BCRYPT_WORKERS", int(os.getenv("BCRYPT_WORKERS", "1")))
+        app.config.setdefault(
+            "BCRYPT_QUEUE_SIZE", int(os.getenv("BCRYPT_QUEUE_SIZE", "8"))
+        )
+
+        self.rounds = app.config["BCRYPT_ROUNDS"]
+        self._workers = app.config["BCRYPT_WORKERS"]
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self._slots = threading.BoundedSemaphore(
+            self._workers + app.config["BCRYPT_QUEUE_SIZE"]
+        )
+        app.extensions["password_hasher"] = self
+
+    def hash(self, password):
+        return self._run(
+            bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds)
+        )
+
+    def check(self, password, password_hash):
+        """Check password against password_hash in the pool.
+
+        Raises PasswordCheckRejected when the pool and its queue are full.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PasswordCheckRejected()
+
+        try:
+            return self._run(bcrypt.checkpw, password.encode("utf-8"), password_hash)
+        finally:
+            self._slots.release()
+
+    def needs_rehash(self, password_hash):
+        # Hashes look like $2b$12$<salt and hash>, the cost being the second field
+        return int(password_hash.split(b"$")[2]) != self.rounds
+
+    def _run(self, function, *args):
+        # Monkeypatching imports gevent, so it needs no importing when it is unused
+        monkey = sys.modules.get("gevent.monkey")
+        if monkey is not None and monkey.is_module_patched("threading"):
+            from gevent import get_hub
+
+            return get_hub().threadpool.apply(function, args)
+
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self._workers, thread_name_prefix="bcrypt"
+                )
+
+        return self._executor.submit(function, *args).result()
+
+    def _forget_executor(self):
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,247 @@
+import functools
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from fcntl import lockf, LOCK_EX, LOCK_UN
+from flask import jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TOO_MANY_REQUESTS = "Too many requests, try again later"
+# Buckets kept by the local backend, the least recently used being dropped past it
+MAX_LOCAL_BUCKETS = 10000
+# Buckets of the shared backend, each holding its tokens and the time they were
+# counted at
+SHARED_SLOTS = 65536
+SLOT = struct.Struct("dd")
+# Weight of each statement in the moving average of the database latency, and
+# seconds it takes the average to halve while no statement runs
+LATENCY_WEIGHT = 0.1
+LATENCY_HALF_LIFE = 1.0
+
+
+def take_token(tokens, updated, rate, burst, now):
+    """Take a token from a bucket that held tokens at the time updated.
+
+    The bucket refills at rate tokens per second, up to burst. Returns the tokens
+    left and the seconds to wait for a token, 0 when one was taken.
+    """
+    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+
+    if tokens >= 1:
+        return tokens - 1, 0.0
+
+    return tokens, (1 - tokens) / rate
+
+
+class LocalBucketBackend:
+    """Token buckets of a single process. Every worker limits the requests it serves."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            # A bucket seen for the first time, or dropped, is full
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens, wait = take_token(tokens, updated, rate, burst, now)
+            self._buckets[key] = (tokens, now)
+
+            # The dict is in order of use, the idlest bucket first
+            while len(self._buckets) > MAX_LOCAL_BUCKETS:
+                del self._buckets[next(iter(self._buckets))]
+
+        return wait
+
+
+class SharedBucketBackend:
+    """Token buckets in a file mapped by every worker of the host.
+
+    Keys are hashed to a fixed number of slots, so the file keeps its size (1 MiB)
+    and the keys sharing a slot share a bucket. A slot is locked with a POSIX
+    record lock while a token is taken from it.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        size = SHARED_SLOTS * SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # Record locks belong to the process, so its threads take turns first
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        offset = zlib.crc32(key.encode()) % SHARED_SLOTS * SLOT.size
+
+        with self._lock:
+            lockf(self._fd, LOCK_EX, SLOT.size, offset, os.SEEK_SET)
+            try:
+                # A new slot counted 0 tokens at time 0, so it is full by now
+                tokens, updated = SLOT.unpack_from(self._map, offset)
+                tokens, wait = take_token(tokens, updated, rate, burst, now)
+                SLOT.pack_into(self._map, offset, tokens, now)
+            finally:
+                lockf(self._fd, LOCK_UN, SLOT.size, offset, os.SEEK_SET)
+
+        return wait
+
+
+class TapLimiter:
+    """Rate limiting and admission control of the tap endpoints.
+
+    Every client address and every dispenser id has a token bucket, refilled at
+    RATE_LIMIT_CLIENT_RATE (or RATE_LIMIT_DISPENSER_RATE) requests per second up to
+    bursts of RATE_LIMIT_CLIENT_BURST (or RATE_LIMIT_DISPENSER_BURST) requests; a
+    rate of 0 turns the limit off. The buckets are kept by each process with the
+    local backend, or with RATE_LIMIT_BACKEND=shared in a file (RATE_LIMIT_FILE)
+    mapped by every worker of the host.
+
+    With ADMISSION_DB_LATENCY_MS set, requests are also shed while the moving
+    average of the SQL statement durations of the process is above it. The average
+    decays while no statement runs, so requests are let in again once the database
+    had time to catch up.
+    """
+
+    def __init__(self, app=None):
+        self.backend = LocalBucketBackend()
+        # (rate, burst) of the buckets, None when unlimited
+        self.client_limit = None
+        self.dispenser_limit = None
+        # Seconds, 0 when admission control is off
+        self.latency_threshold = 0.0
+        self._latency = 0.0
+        self._latency_updated = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "RATE_LIMIT_BACKEND", os.getenv("RATE_LIMIT_BACKEND", "local")
+        )
+        app.config.setdefault(
+            "RATE_LIMIT_FILE",
+            os.getenv(
+                "RATE_LIMIT_FILE", os.path.join(app.instance_path, "ratelimit.bin")
+            ),
+        )
+        for name, burst in (("CLIENT", "20"), ("DISPENSER", "5")):
+            app.config.setdefault(
+                f"RATE_LIMIT_{name}_RATE",
+                float(os.getenv(f"RATE_LIMIT_{name}_RATE", "0")),
+            )
+            app.config.setdefault(
+                f"RATE_LIMIT_{name}_BURST",
+                float(os.getenv(f"RATE_LIMIT_{name}_BURST", burst)),
+            )
+        app.config.setdefault(
+            "ADMISSION_DB_LATENCY_MS", float(os.getenv("ADMISSION_DB_LATENCY_MS", "0"))
+        )
+
+        backend_name = app.config["RATE_LIMIT_BACKEND"]
+        if backend_name == "local":
+            self.backend = LocalBucketBackend()
+        elif backend_name == "shared":
+            self.backend = SharedBucketBackend(app.config["RATE_LIMIT_FILE"])
+        else:
+            raise ValueError(f"Unknown rate limit backend: {backend_name}")
+
+        self.client_limit = self._get_limit(app, "CLIENT")
+        self.dispenser_limit = self._get_limit(app, "DISPENSER")
+        self.latency_threshold = app.config["ADMISSION_DB_LATENCY_MS"] / 1000
+        self._latency = 0.0
+        app.extensions["tap_limiter"] = self
+
+    def check(self, client, dispenser_id=None, now=None):
+        """Admit a tap request of client, on dispenser_id when it targets one.
+
+        Returns None when the request may go on, else the seconds after which to
+        retry it. A request over the limit of its dispenser still uses up a token
+        of its client.
+        """
+        now = time.time() if now is None else now
+
+        if self.latency_threshold:
+            latency = self.db_latency(now)
+            if latency > self.latency_threshold:
+                return LATENCY_HALF_LIFE * math.log2(latency / self.latency_threshold)
+
+        buckets = [(self.client_limit, f"client {client}")]
+        if dispenser_id is not None:
+            buckets.append((self.dispenser_limit, f"dispenser {dispenser_id}"))
+
+        for limit, key in buckets:
+            if limit is not None:
+                wait = self.backend.take(key, *limit, now)
+                if wait:
+                    return wait
+
+        return None
+
+    def db_latency(self, now=None):
+        """Return the moving average of the statement durations in seconds."""
+        now = time.time() if now is None else now
+        elapsed = max(now - self._latency_updated, 0)
+
+        return self._latency * 0.5 ** (elapsed / LATENCY_HALF_LIFE)
+
+    def observe(self, duration, now=None):
+        """Add a statement that took duration seconds to the database latency."""
+        now = time.time() if now is None else now
+        latency = self.db_latency(now)
+        # Concurrent statements may overwrite each other's update, losing a sample
+        self._latency = latency + LATENCY_WEIGHT * (duration - latency)
+        self._latency_updated = now
+
+    @staticmethod
+    def _get_limit(app, name):
+        rate = app.config[f"RATE_LIMIT_{name}_RATE"]
+
+        return (rate, app.config[f"RATE_LIMIT_{name}_BURST"]) if rate > 0 else None
+
+
+tap_limiter = TapLimiter()
+
+
+def retry_after_header(seconds):
+    """Return the Retry-After header value, in whole seconds, of a rejected request."""
+    return str(max(1, math.ceil(seconds)))
+
+
+def limit_tap_requests(view):
+    """Answer 429 to the tap requests over their rate limits or shed by admission control."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        retry_after = tap_limiter.check(request.remote_addr, kwargs.get("dispenser_id"))
+
+        if retry_after is not None:
+            return (
+                jsonify({"message": TOO_MANY_REQUESTS}),
+                429,
+                {"Retry-After": retry_after_header(retry_after)},
+            )
+
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if tap_limiter.latency_threshold and context is not None:
+        context.admission_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "admission_started", None)
+    if started is not None:
+        tap_limiter.observe(time.perf_counter() - started)
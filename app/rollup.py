@@ -0,0 +1,298 @@
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from app.models import (
+    db,
+    Dispenser,
+    Transaction,
+    ArchivedTransaction,
+    DispenserRollup,
+)
+from app.statistics import parse_time_window
+
+# Bucket sizes in minutes. Every closed transaction is totalled at each of them,
+# so a series is read from precomputed rows whatever its granularity
+ROLLUP_GRANULARITIES = {"minute": 1, "hour": 60, "day": 1440}
+EPOCH = datetime(1970, 1, 1)
+REBUILD_BATCH_SIZE = 10000
+
+
+def parse_rollup_args(args):
+    """Read the rollup query string parameters, raising ValueError when invalid."""
+    granularity = args.get("granularity", "hour")
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(
+            f"'granularity' must be one of: {', '.join(ROLLUP_GRANULARITIES)}"
+        )
+
+    start, end = parse_time_window(args)
+
+    dispenser_id = args.get("dispenser_id")
+    if dispenser_id is not None:
+        try:
+            dispenser_id = int(dispenser_id)
+        except ValueError:
+            raise ValueError("'dispenser_id' must be an integer")
+
+    fleet = args.get("fleet", "false").lower() in ("1", "true", "yes")
+
+    return {
+        "granularity": granularity,
+        "start": start,
+        "end": end,
+        "dispenser_id": dispenser_id,
+        "fleet": fleet,
+    }
+
+
+def split_into_buckets(start_time, end_time, amount, revenue, bucket_minutes):
+    """Share a pour's amount and revenue among the buckets it overlaps.
+
+    Each bucket gets the part of the pour that happened during it. Returns
+    (bucket, transactions, amount, revenue) tuples; the transaction is counted in
+    the bucket it started in.
+    """
+    bucket_size = bucket_minutes * 60_000_000
+    start = (start_time - EPOCH) // timedelta(microseconds=1)
+    end = (end_time - EPOCH) // timedelta(microseconds=1)
+    duration = end - start
+    first_bucket = start // bucket_size
+    last_bucket = (end - 1) // bucket_size if duration > 0 else first_bucket
+
+    shares = []
+    for bucket in range(first_bucket, last_bucket + 1):
+        if duration > 0:
+            overlap = min(end, (bucket + 1) * bucket_size) - max(
+                start, bucket * bucket_size
+            )
+            share = overlap / duration
+        else:
+            share = 1.0
+
+        shares.append(
+            (
+                bucket * bucket_minutes,
+                1 if bucket == first_bucket else 0,
+                amount * share,
+                revenue * share,
+            )
+        )
+
+    return shares
+
+
+def record_transaction_rollups(transactions, session=None):
+    """Add closed transactions to the rollup totals, in session or db.session."""
+    totals = {}
+
+    for transaction in transactions:
+        _add_transaction(
+            totals,
+            transaction.dispenser_id,
+            transaction.start_time,
+            transaction.end_time,
+            transaction.amount,
+            transaction.revenue,
+        )
+
+    _upsert_rollups(totals, db.session if session is None else session)
+
+
+def rebuild_rollups():
+    """Recompute the rollup totals of every closed transaction."""
+    db.session.execute(db.delete(DispenserRollup))
+
+    totals = {}
+
+    for table in (Transaction, ArchivedTransaction):
+        query = (
+            db.select(
+                table.dispenser_id,
+                table.start_time,
+                table.end_time,
+                table.amount,
+                table.revenue,
+            )
+            .where(table.end_time.isnot(None))  # type: ignore
+            .execution_options(yield_per=REBUILD_BATCH_SIZE)
+        )
+
+        for row in db.session.execute(query):
+            _add_transaction(totals, *row)
+
+    _upsert_rollups(totals, db.session)
+    db.session.commit()
+
+
+def get_rollups(granularity, start=None, end=None, dispenser_id=None, fleet=False):
+    """Return the amount and revenue series per dispenser, or fleet-wide.
+
+    Closed transactions are read from the rollup table; the pours in progress are
+    split into buckets on the fly, up to now.
+    """
+    bucket_minutes = ROLLUP_GRANULARITIES[granularity]
+    first_bucket = (
+        _to_minutes(start) // bucket_minutes * bucket_minutes if start else None
+    )
+    end_minutes = _to_minutes(end) if end else None
+
+    group_by = [DispenserRollup.bucket]
+    if not fleet:
+        group_by.insert(0, DispenserRollup.dispenser_id)
+
+    query = db.select(
+        *group_by,
+        db.func.sum(DispenserRollup.transactions),
+        db.func.sum(DispenserRollup.amount),
+        db.func.sum(DispenserRollup.revenue),
+    ).where(DispenserRollup.bucket_minutes == bucket_minutes)
+
+    if dispenser_id is not None:
+        query = query.where(DispenserRollup.dispenser_id == dispenser_id)
+    if first_bucket is not None:
+        query = query.where(DispenserRollup.bucket >= first_bucket)
+    if end_minutes is not None:
+        query = query.where(DispenserRollup.bucket < end_minutes)
+
+    totals = {}
+    for row in db.session.execute(query.group_by(*group_by)):
+        key = (None, row[0]) if fleet else (row[0], row[1])
+        totals[key] = list(row[-3:])
+
+    now = datetime.utcnow()
+    for open_dispenser_id, start_time, flow_volume, price in _get_open_transactions(
+        dispenser_id
+    ):
+        amount = (now - start_time).total_seconds() * flow_volume
+        shares = split_into_buckets(
+            start_time, now, amount, amount * price, bucket_minutes
+        )
+
+        for bucket, count, bucket_amount, bucket_revenue in shares:
+            if (first_bucket is not None and bucket < first_bucket) or (
+                end_minutes is not None and bucket >= end_minutes
+            ):
+                continue
+
+            key = (None if fleet else open_dispenser_id, bucket)
+            total = totals.setdefault(key, [0, 0.0, 0.0])
+            total[0] += count
+            total[1] += bucket_amount
+            total[2] += bucket_revenue
+
+    # Dispensers share their buckets; the JSON provider formats the datetimes
+    starts = {
+        bucket: EPOCH + timedelta(minutes=bucket)
+        for bucket in {bucket for _, bucket in totals}
+    }
+
+    series = {}
+    for (series_dispenser_id, bucket), (count, amount, revenue) in sorted(
+        totals.items(), key=lambda item: (item[0][0] or 0, item[0][1])
+    ):
+        series.setdefault(series_dispenser_id, []).append(
+            {
+                "start": starts[bucket],
+                "transactions": count,
+                "amount": amount,
+                "revenue": revenue,
+            }
+        )
+
+    return [
+        {"dispenser_id": series_dispenser_id, "buckets": buckets}
+        for series_dispenser_id, buckets in series.items()
+    ]
+
+
+def _to_minutes(time):
+    return (time - EPOCH) // timedelta(minutes=1)
+
+
+def _add_transaction(totals, dispenser_id, start_time, end_time, amount, revenue):
+    for bucket_minutes in ROLLUP_GRANULARITIES.values():
+        for bucket, count, bucket_amount, bucket_revenue in split_into_buckets(
+            start_time, end_time, amount, revenue, bucket_minutes
+        ):
+            total = totals.setdefault(
+                (dispenser_id, bucket_minutes, bucket), [0, 0.0, 0.0]
+            )
+            total[0] += count
+            total[1] += bucket_amount
+            total[2] += bucket_revenue
+
+
+def _get_open_transactions(dispenser_id):
+    query = (
+        db.select(
+            Transaction.dispenser_id,
+            Transaction.start_time,
+            Dispenser.flow_volume,
+            Dispenser.price,
+        )
+        .join(Dispenser, Transaction.dispenser_id == Dispenser.id)
+        .where(Transaction.end_time.is_(None))  # type: ignore
+    )
+
+    if dispenser_id is not None:
+        query = query.where(Transaction.dispenser_id == dispenser_id)
+
+    return db.session.execute(query).all()
+
+
+def _upsert_rollups(totals, session):
+    rows = [
+        {
+            "dispenser_id": dispenser_id,
+            "bucket_minutes": bucket_minutes,
+            "bucket": bucket,
+            "transactions": count,
+            "amount": amount,
+            "revenue": revenue,
+        }
+        for (dispenser_id, bucket_minutes, bucket), (
+            count,
+            amount,
+            revenue,
+        ) in totals.items()
+    ]
+    dialect = session.get_bind().dialect.name
+
+    if dialect not in ("sqlite", "postgresql"):
+        for row in rows:
+            _update_or_insert_rollup(row, session)
+        return
+
+    if not rows:
+        return
+
+    insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+    statement = insert(DispenserRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=["dispenser_id", "bucket_minutes", "bucket"],
+        set_={
+            "transactions": DispenserRollup.transactions
+            + statement.excluded.transactions,
+            "amount": DispenserRollup.amount + statement.excluded.amount,
+            "revenue": DispenserRollup.revenue + statement.excluded.revenue,
+        },
+    )
+    session.execute(statement, rows)
+
+
+def _update_or_insert_rollup(row, session):
+    result = session.execute(
+        db.update(DispenserRollup)
+        .where(
+            DispenserRollup.dispenser_id == row["dispenser_id"],
+            DispenserRollup.bucket_minutes == row["bucket_minutes"],
+            DispenserRollup.bucket == row["bucket"],
+        )
+        .values(
+            transactions=DispenserRollup.transactions + row["transactions"],
+            amount=DispenserRollup.amount + row["amount"],
+            revenue=DispenserRollup.revenue + row["revenue"],
+        )
+    )
+
+    if result.rowcount == 0:
+        session.add(DispenserRollup(**row))
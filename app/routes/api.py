@@ -1,13 +1,35 @@
-from flask import Blueprint, request, jsonify
-from app.models import db, Dispenser, Transaction
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from app.models import db, Dispenser, Transaction, DispenserEvent
 from datetime import datetime
 from flask_jwt_extended import jwt_required
+from app.statistics import (
+    parse_time_window,
+    parse_statistics_args,
+    get_dispenser_statistics,
+)
+from app.export import EXPORT_FORMATS, export_transactions
+from app.rollup import parse_rollup_args, get_rollups, record_transaction_rollups
+from app.metrics import count_closed_pours
+from app.cache import dispenser_cache
+from app.live import open_tap_registry
+from app.events import dispenser_events
+from app.ingest import tap_ingestion, flush_tap_events
+from app.ratelimit import limit_tap_requests
+from app.idempotency import idempotent
+from app.bulk import (
+    MAX_BULK_SIZE,
+    parse_dispenser_ids,
+    create_dispensers,
+    open_dispensers,
+    close_dispensers,
+)
 
 bp = Blueprint("api", __name__)
 
 
 @bp.route("/dispenser", methods=["POST"])
 @jwt_required()
+@idempotent
 def create_dispenser():
     data = request.get_json()
     flow_volume = data.get("flow_volume")
@@ -36,29 +58,65 @@ def create_dispenser():
         return jsonify({"message": f"Error creating dispenser: {e}"}), 500
 
 
+@bp.route("/dispenser/bulk", methods=["POST"])
+@jwt_required()
+@idempotent
+def create_dispensers_in_bulk():
+    data = request.get_json()
+    items = data.get("dispensers") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_BULK_SIZE:
+        return (
+            jsonify(
+                {"message": f"A list of 1 to {MAX_BULK_SIZE} dispensers is required"}
+            ),
+            400,
+        )
+
+    try:
+        results = create_dispensers(items)
+        db.session.commit()
+
+        return jsonify({"results": results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Error creating dispensers: {e}"}), 500
+
+
 @bp.route("/dispenser/<int:dispenser_id>", methods=["GET"])
+@flush_tap_events
 def get_dispenser_info_by_id(dispenser_id):
-    dispenser = db.session.get(Dispenser, dispenser_id)
+    def load_dispenser_info():
+        dispenser = db.session.get(Dispenser, dispenser_id)
+        return dispenser.get_dispenser_info() if dispenser else None
 
-    if not dispenser:
-        return jsonify({"message": "Dispenser not found"}), 404
+    body, etag = dispenser_cache.get(("dispenser", dispenser_id), load_dispenser_info)
 
-    dispenser_info = dispenser.get_dispenser_info()
+    if body is None:
+        return jsonify({"message": "Dispenser not found"}), 404
 
-    return jsonify(dispenser_info), 200
+    return cached_json_response(body, etag)
 
 
 @bp.route("/dispenser", methods=["GET"])
+@flush_tap_events
 def get_all_dispenser_info():
-    dispensers = Dispenser.query.all()
+    def load_all_dispenser_info():
+        dispensers = Dispenser.query.order_by(Dispenser.id).all()
+        return [dispenser.get_dispenser_info() for dispenser in dispensers]
 
-    dispenser_info = [dispenser.get_dispenser_info() for dispenser in dispensers]
+    body, etag = dispenser_cache.get("all", load_all_dispenser_info)
 
-    return jsonify(dispenser_info), 200
+    return cached_json_response(body, etag)
 
 
 @bp.route("/dispenser/<int:dispenser_id>/open", methods=["POST"])
+@idempotent
+@limit_tap_requests
 def open_dispenser(dispenser_id):
+    if tap_ingestion.enabled:
+        return ingested_response(tap_ingestion.open_taps([dispenser_id])[0])
+
     dispenser = db.session.get(Dispenser, dispenser_id)
 
     if not dispenser:
@@ -72,8 +130,16 @@ def open_dispenser(dispenser_id):
             dispenser_id=dispenser_id, start_time=datetime.utcnow()
         )
         db.session.add(new_transaction)
-        dispenser.is_open = True
+        db.session.flush()
+
+        # Another request may have opened the tap since it was read above
+        if not Dispenser.mark_open(dispenser_id, new_transaction.id):
+            db.session.rollback()
+            return jsonify({"message": "Dispenser is already open"}), 400
+
+        db.session.add(DispenserEvent("open", new_transaction))
         db.session.commit()
+        dispenser_events.notify()
 
         return jsonify({"message": "Dispenser opened successfully"}), 200
 
@@ -83,7 +149,12 @@ def open_dispenser(dispenser_id):
 
 
 @bp.route("/dispenser/<int:dispenser_id>/close", methods=["POST"])
+@idempotent
+@limit_tap_requests
 def close_dispenser(dispenser_id):
+    if tap_ingestion.enabled:
+        return ingested_response(tap_ingestion.close_taps([dispenser_id])[0])
+
     dispenser = db.session.get(Dispenser, dispenser_id)
 
     if not dispenser:
@@ -93,11 +164,7 @@ def close_dispenser(dispenser_id):
         return jsonify({"message": "Dispenser is already closed"}), 400
 
     try:
-        last_transaction = (
-            Transaction.query.filter_by(dispenser_id=dispenser_id, end_time=None)
-            .order_by(Transaction.start_time.desc())  # type: ignore
-            .first()
-        )
+        last_transaction = dispenser.get_open_transaction()
 
         if not last_transaction:
             return jsonify({"message": "No open transaction found"}), 500
@@ -106,11 +173,21 @@ def close_dispenser(dispenser_id):
 
         amount, revenue = last_transaction.get_amount_and_revenue(end_time)
 
+        # Another request may have closed the tap since it was read above
+        if not Dispenser.mark_closed(
+            dispenser_id, dispenser.open_transaction_id, amount, revenue
+        ):
+            db.session.rollback()
+            return jsonify({"message": "Dispenser is already closed"}), 400
+
         last_transaction.amount = amount
         last_transaction.revenue = revenue
         last_transaction.end_time = end_time
-        dispenser.is_open = False
+        record_transaction_rollups([last_transaction])
+        count_closed_pours([last_transaction])
+        db.session.add(DispenserEvent("close", last_transaction))
         db.session.commit()
+        dispenser_events.notify()
 
         return (
             jsonify(
@@ -128,28 +205,186 @@ def close_dispenser(dispenser_id):
         return jsonify({"message": f"Error closing dispenser: {e}"}), 500
 
 
+@bp.route("/dispenser/bulk/open", methods=["POST"])
+@idempotent
+@limit_tap_requests
+def open_dispensers_in_bulk():
+    try:
+        dispenser_ids = parse_dispenser_ids(request.get_json())
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if tap_ingestion.enabled:
+        return jsonify({"results": tap_ingestion.open_taps(dispenser_ids)}), 200
+
+    try:
+        results = open_dispensers(dispenser_ids)
+        db.session.commit()
+        dispenser_events.notify()
+
+        return jsonify({"results": results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Error opening dispensers: {e}"}), 500
+
+
+@bp.route("/dispenser/bulk/close", methods=["POST"])
+@idempotent
+@limit_tap_requests
+def close_dispensers_in_bulk():
+    try:
+        dispenser_ids = parse_dispenser_ids(request.get_json())
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if tap_ingestion.enabled:
+        return jsonify({"results": tap_ingestion.close_taps(dispenser_ids)}), 200
+
+    try:
+        results = close_dispensers(dispenser_ids)
+        db.session.commit()
+        dispenser_events.notify()
+
+        return jsonify({"results": results}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Error closing dispensers: {e}"}), 500
+
+
+@bp.route("/events", methods=["GET"])
+def stream_dispenser_events():
+    last_event_id = request.headers.get(
+        "Last-Event-ID", request.args.get("last_event_id")
+    )
+
+    if last_event_id is not None:
+        try:
+            last_event_id = int(last_event_id)
+        except ValueError:
+            return jsonify({"message": "Last-Event-ID must be an integer"}), 400
+
+    response = Response(
+        dispenser_events.listen(last_event_id), mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies such as nginx from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+
+    return response
+
+
 @bp.route("/statistics/<int:dispenser_id>", methods=["GET"])
 @jwt_required()
+@flush_tap_events
 def get_dispenser_stats_by_id(dispenser_id):
+    try:
+        statistics_args = parse_statistics_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
     dispenser = db.session.get(Dispenser, dispenser_id)
 
     if not dispenser:
         return jsonify({"message": "Dispenser not found"}), 404
 
-    dispenser_stats = dispenser.get_dispenser_stats()
+    [dispenser_stats] = get_dispenser_statistics([dispenser], **statistics_args)
 
     return jsonify(dispenser_stats), 200
 
 
 @bp.route("/statistics", methods=["GET"])
 @jwt_required()
+@flush_tap_events
 def get_all_dispenser_stats():
-    statistics = []
-    dispensers = Dispenser.query.all()
+    try:
+        statistics_args = parse_statistics_args(request.args, fleet=True)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
 
-    for dispenser in dispensers:
-        dispenser_stats = dispenser.get_dispenser_stats()
+    dispensers = Dispenser.query.order_by(Dispenser.id).all()
 
-        statistics.append(dispenser_stats)
+    statistics = get_dispenser_statistics(dispensers, **statistics_args)
 
     return jsonify(statistics), 200
+
+
+@bp.route("/statistics/live", methods=["GET"])
+@jwt_required()
+@flush_tap_events
+def get_live_pours():
+    pours = open_tap_registry.get_live_pours()
+
+    return (
+        jsonify(
+            {
+                "pours": pours,
+                "total_amount": sum((pour["amount"] for pour in pours), 0.0),
+                "total_revenue": sum((pour["revenue"] for pour in pours), 0.0),
+            }
+        ),
+        200,
+    )
+
+
+@bp.route("/statistics/rollup", methods=["GET"])
+@jwt_required()
+@flush_tap_events
+def get_dispenser_rollups():
+    try:
+        rollup_args = parse_rollup_args(request.args)
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return (
+        jsonify(
+            {
+                "granularity": rollup_args["granularity"],
+                "series": get_rollups(**rollup_args),
+            }
+        ),
+        200,
+    )
+
+
+@bp.route("/export/transactions", methods=["GET"])
+@jwt_required()
+@flush_tap_events
+def export_transaction_history():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"message": "Format must be one of: ndjson, csv"}), 400
+
+    try:
+        start, end = parse_time_window(request.args)
+        dispenser_id = request.args.get("dispenser_id")
+        if dispenser_id is not None:
+            dispenser_id = int(dispenser_id)
+    except ValueError as e:
+        return jsonify({"message": f"Invalid export parameters: {e}"}), 400
+
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+
+    return Response(
+        stream_with_context(
+            export_transactions(export_format, dispenser_id, start, end)
+        ),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename=transactions.{export_format}"
+        },
+    )
+
+
+def cached_json_response(body, etag):
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+
+    return response.make_conditional(request)
+
+
+def ingested_response(result):
+    body = {key: value for key, value in result.items() if key not in ("id", "status")}
+
+    return jsonify(body), result["status"]
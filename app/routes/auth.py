@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
-from app.models import Admin
+from app.models import db, Admin
+from app.passwords import PasswordCheckRejected
 from flask_jwt_extended import create_access_token
 
 bp = Blueprint("auth", __name__)
@@ -13,8 +14,21 @@ def login():
 
     user = Admin.query.filter_by(username=username).first()
 
-    if not user or not user.check_password(password):
+    try:
+        valid = user is not None and user.check_password(password)
+    except PasswordCheckRejected:
+        return (
+            jsonify({"message": "Too many login attempts, try again later"}),
+            429,
+            {"Retry-After": "1"},
+        )
+
+    if not valid:
         return jsonify({"message": "Invalid credentials"}), 401
 
+    # check_password rehashes the password when the bcrypt cost changed
+    if db.session.is_modified(user):
+        db.session.commit()
+
     access_token = create_access_token(identity=user.id)
     return jsonify({"access_token": access_token}), 200
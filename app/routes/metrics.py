@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from app.metrics import metrics
+
+bp = Blueprint("metrics", __name__)
+
+
+@bp.route("/metrics", methods=["GET"])
+def get_metrics():
+    body, content_type = metrics.export()
+    return Response(body, content_type=content_type)
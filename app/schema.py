@@ -0,0 +1,66 @@
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+from app.models import (
+    db,
+    DispenserRollup,
+    rebuild_dispenser_aggregates,
+    repair_dispenser_state,
+)
+from app.rollup import rebuild_rollups
+
+
+def upgrade_schema():
+    """Create missing tables, and add the columns and indexes introduced since the
+    database was created.
+
+    Returns the list of "table.column" names that had to be added.
+    """
+    db.create_all()
+
+    added_columns = []
+    inspector = inspect(db.engine)
+
+    with db.engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+
+        for table in db.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.exec_driver_sql(
+                    f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}"
+                )
+                added_columns.append(f"{table.name}.{column.name}")
+
+            existing_indexes = {
+                index["name"] for index in inspector.get_indexes(table.name)
+            }
+
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+
+    return added_columns
+
+
+def upgrade_database():
+    """Upgrade the schema and backfill the data derived into any newly added column
+    or table.
+
+    Returns the list of "table.column" names that had to be added.
+    """
+    rollups_missing = not inspect(db.engine).has_table(DispenserRollup.__tablename__)
+    added_columns = upgrade_schema()
+
+    if added_columns:
+        rebuild_dispenser_aggregates()
+        repair_dispenser_state()
+
+    if added_columns or rollups_missing:
+        rebuild_rollups()
+
+    return added_columns
@@ -0,0 +1,418 @@
+import numpy as np
+from datetime import datetime, timezone
+from app.models import db, Transaction
+from app.archive import select_transactions, transaction_tables
+
+MAX_PAGE_SIZE = 1000
+TRANSACTION_COLUMNS = (
+    Transaction.id,
+    Transaction.dispenser_id,
+    Transaction.start_time,
+    Transaction.end_time,
+    Transaction.amount,
+    Transaction.revenue,
+)
+
+
+def parse_time_window(args):
+    """Read the from/to query string parameters, raising ValueError when invalid."""
+    start = _parse_datetime(args.get("from"), "from")
+    end = _parse_datetime(args.get("to"), "to")
+
+    if start and end and start >= end:
+        raise ValueError("'from' must be earlier than 'to'")
+
+    return start, end
+
+
+def parse_statistics_args(args, fleet=False):
+    """Read the statistics query string parameters, raising ValueError when invalid.
+
+    A cursor is the id of the last transaction listed for a dispenser, so it is
+    refused for the statistics of the whole fleet (fleet=True): their next pages
+    are read per dispenser.
+    """
+    start, end = parse_time_window(args)
+
+    limit = None
+    if args.get("limit") is not None:
+        limit = _parse_int(args["limit"], "limit")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+
+    cursor = None
+    if args.get("cursor") is not None:
+        if fleet:
+            raise ValueError(
+                "'cursor' is only supported by /api/statistics/<dispenser_id>; "
+                "follow each dispenser's next_cursor there"
+            )
+        cursor = _parse_int(args["cursor"], "cursor")
+
+    summary_only = args.get("summary_only", "false").lower() in ("1", "true", "yes")
+
+    return {
+        "start": start,
+        "end": end,
+        "limit": limit,
+        "cursor": cursor,
+        "summary_only": summary_only,
+    }
+
+
+class TransactionColumns:
+    """Transaction rows held column by column in NumPy arrays.
+
+    The amount and revenue of open transactions are only meaningful once
+    with_open_amounts has computed them.
+    """
+
+    def __init__(self, rows):
+        columns = list(zip(*rows)) or [()] * len(TRANSACTION_COLUMNS)
+
+        self.id = np.array(columns[0], dtype=np.int64)
+        self.dispenser_id = np.array(columns[1], dtype=np.int64)
+        self.start_time = _to_datetime64(columns[2])
+        self.end_time = _to_datetime64(columns[3])
+        self.amount = np.array(columns[4], dtype=np.float64)
+        self.revenue = np.array(columns[5], dtype=np.float64)
+        self.is_open = np.isnat(self.end_time)
+
+    def with_open_amounts(self, flow_volumes, prices, now):
+        """Set the amount and revenue of the open transactions as of now.
+
+        flow_volumes and prices hold the value of the dispenser of each row.
+        """
+        elapsed = (now - self.start_time[self.is_open]) / np.timedelta64(1, "s")
+        amount = elapsed * flow_volumes[self.is_open]
+
+        self.amount[self.is_open] = amount
+        self.revenue[self.is_open] = amount * prices[self.is_open]
+
+    def latest_open(self):
+        """Return the index of the last open row of each dispenser."""
+        open_rows = np.flatnonzero(self.is_open)[::-1]
+        _, last = np.unique(self.dispenser_id[open_rows], return_index=True)
+
+        return open_rows[last]
+
+    def to_dicts(self):
+        return [
+            {
+                "transaction_id": transaction_id,
+                "start_time": start_time,
+                "end_time": end_time,
+                "amount": amount,
+                "revenue": revenue,
+            }
+            for transaction_id, start_time, end_time, amount, revenue in zip(
+                self.id.tolist(),
+                _format_times(self.start_time),
+                _format_times(self.end_time),
+                self.amount.tolist(),
+                self.revenue.tolist(),
+            )
+        ]
+
+
+def get_dispenser_statistics(
+    dispensers,
+    start=None,
+    end=None,
+    limit=None,
+    cursor=None,
+    summary_only=False,
+    session=None,
+):
+    """Build the statistics of the given dispensers in a constant number of queries.
+
+    Totals cover the transactions started inside the [start, end) window. When
+    every transaction of the window is listed, they are summed from the listed
+    rows. Otherwise, without a window they come from the running totals kept on
+    each dispenser, so only the open transaction has to be read. When limit is set, at most limit transactions
+    with an id greater than cursor are listed per dispenser, plus a next_cursor;
+    as the cursor is that of a single dispenser, only pass one with one dispenser.
+
+    Transactions are read into NumPy columns, and the live amounts and totals are
+    computed with array operations. Per-transaction dicts are only built when the
+    transaction list is returned. The queries run in session, db.session by
+    default.
+    """
+    if not dispensers:
+        return []
+
+    session = db.session if session is None else session
+    dispenser_ids = np.array([dispenser.id for dispenser in dispensers])
+    flow_volumes = np.array([dispenser.flow_volume for dispenser in dispensers])
+    prices = np.array([dispenser.price for dispenser in dispensers])
+    sorter = np.argsort(dispenser_ids)
+    windowed = start is not None or end is not None
+    now = np.datetime64(datetime.utcnow(), "us")
+
+    def get_positions(row_dispenser_ids):
+        # Index in dispensers of the dispenser of each row
+        return sorter[np.searchsorted(dispenser_ids, row_dispenser_ids, sorter=sorter)]
+
+    def read_columns(columns):
+        positions = get_positions(columns.dispenser_id)
+        columns.with_open_amounts(flow_volumes[positions], prices[positions], now)
+
+        return columns
+
+    transactions = None
+    if not summary_only:
+        transactions = read_columns(
+            _get_transaction_columns(
+                session, dispenser_ids.tolist(), start, end, limit, cursor
+            )
+        )
+
+    # Unless paginated, the listed transactions are all those of the window
+    listed_all = transactions is not None and limit is None and cursor is None
+
+    if listed_all:
+        open_transactions = transactions
+    else:
+        open_transactions = read_columns(
+            _get_open_transaction_columns(session, dispenser_ids.tolist(), start, end)
+        )
+
+    if listed_all:
+        # Summed from the rows listed, so the totals always agree with the list
+        count, amount, revenue = _sum_closed_transactions(
+            transactions, get_positions, len(dispensers)
+        )
+    elif not windowed:
+        count = np.array([dispenser.closed_transactions for dispenser in dispensers])
+        amount = np.array([dispenser.closed_amount for dispenser in dispensers])
+        revenue = np.array([dispenser.closed_revenue for dispenser in dispensers])
+    else:
+        totals = _get_closed_totals(session, dispenser_ids.tolist(), start, end)
+        count, amount, revenue = (
+            np.array(column)
+            for column in zip(
+                *(
+                    totals.get(dispenser_id, (0, 0.0, 0.0))
+                    for dispenser_id in dispenser_ids.tolist()
+                )
+            )
+        )
+
+    # Should several transactions be left open, the latest one wins
+    latest_open = open_transactions.latest_open()
+    open_positions = get_positions(open_transactions.dispenser_id[latest_open])
+    count[open_positions] += 1
+    amount[open_positions] += open_transactions.amount[latest_open]
+    revenue[open_positions] += open_transactions.revenue[latest_open]
+
+    statistics = [
+        {
+            "dispenser_id": dispenser.id,
+            "flow_volume": dispenser.flow_volume,
+            "price": dispenser.price,
+            "is_open": dispenser.is_open,
+            "total_transactions": dispenser_count,
+            "total_amount": dispenser_amount,
+            "total_revenue": dispenser_revenue,
+        }
+        for dispenser, dispenser_count, dispenser_amount, dispenser_revenue in zip(
+            dispensers, count.tolist(), amount.tolist(), revenue.tolist()
+        )
+    ]
+
+    if transactions is not None:
+        rows = transactions.to_dicts()
+        # The rows are sorted by dispenser, so each dispenser's rows are a slice
+        first_rows = np.searchsorted(transactions.dispenser_id, dispenser_ids, "left")
+        last_rows = np.searchsorted(transactions.dispenser_id, dispenser_ids, "right")
+
+        for dispenser_stats, first_row, last_row in zip(
+            statistics, first_rows.tolist(), last_rows.tolist()
+        ):
+            page = rows[first_row:last_row]
+            next_cursor = None
+
+            if limit is not None and len(page) > limit:
+                page = page[:limit]
+                next_cursor = page[-1]["transaction_id"]
+
+            dispenser_stats["transactions"] = page
+
+            if limit is not None:
+                dispenser_stats["next_cursor"] = next_cursor
+
+    return statistics
+
+
+def _sum_closed_transactions(transactions, get_positions, size):
+    closed = ~transactions.is_open
+    positions = get_positions(transactions.dispenser_id[closed])
+
+    # Without any position, bincount returns integers even when given weights
+    return (
+        np.bincount(positions, minlength=size),
+        np.bincount(
+            positions, weights=transactions.amount[closed], minlength=size
+        ).astype(np.float64),
+        np.bincount(
+            positions, weights=transactions.revenue[closed], minlength=size
+        ).astype(np.float64),
+    )
+
+
+def _to_datetime64(values):
+    # NumPy parses ISO 8601 strings much faster than it converts datetime objects
+    return np.array(
+        [
+            value.isoformat() if isinstance(value, datetime) else value
+            for value in values
+        ],
+        dtype="datetime64[us]",
+    )
+
+
+def _format_times(times):
+    if len(times) == 0:
+        return []
+
+    formatted = np.datetime_as_string(times, unit="s")
+    # Swap the "T" separator for a space, working on the characters' code points
+    formatted.view(np.uint32).reshape(len(formatted), -1)[:, 10] = ord(" ")
+    formatted = formatted.astype(object)
+    formatted[np.isnat(times)] = None
+
+    return formatted.tolist()
+
+
+def _select_columns(session, columns):
+    # SQLite stores timestamps as ISO 8601 strings; read them as such and let NumPy
+    # parse them rather than building a datetime object per value
+    if session.get_bind().dialect.name == "sqlite":
+        columns = [
+            db.type_coerce(column, db.String).label(column.name)
+            if isinstance(column.type, db.TIMESTAMP)
+            else column
+            for column in columns
+        ]
+
+    return db.select(*columns)
+
+
+def _read_columns(session, query):
+    return TransactionColumns(session.connection().execute(query).all())
+
+
+def _filter_window(query, transaction, dispenser_ids, start, end):
+    query = query.where(transaction.dispenser_id.in_(dispenser_ids))
+
+    if start is not None:
+        query = query.where(transaction.start_time >= start)
+    if end is not None:
+        query = query.where(transaction.start_time < end)
+
+    return query
+
+
+def _get_open_transaction_columns(session, dispenser_ids, start, end):
+    query = _filter_window(
+        _select_columns(session, TRANSACTION_COLUMNS).where(
+            Transaction.end_time.is_(None)  # type: ignore
+        ),
+        Transaction,
+        dispenser_ids,
+        start,
+        end,
+    ).order_by(Transaction.dispenser_id, Transaction.start_time)
+
+    return _read_columns(session, query)
+
+
+def _get_closed_totals(session, dispenser_ids, start, end):
+    totals = {}
+
+    # Summed table by table, which is cheaper than summing their union
+    for table in transaction_tables(start, session):
+        query = _filter_window(
+            db.select(
+                table.dispenser_id,
+                db.func.count(table.id),
+                db.func.coalesce(db.func.sum(table.amount), 0.0),
+                db.func.coalesce(db.func.sum(table.revenue), 0.0),
+            ).where(
+                table.end_time.isnot(None)  # type: ignore
+            ),
+            table,
+            dispenser_ids,
+            start,
+            end,
+        ).group_by(table.dispenser_id)
+
+        for dispenser_id, count, amount, revenue in session.execute(query):
+            total_count, total_amount, total_revenue = totals.get(
+                dispenser_id, (0, 0.0, 0.0)
+            )
+            totals[dispenser_id] = (
+                total_count + count,
+                total_amount + amount,
+                total_revenue + revenue,
+            )
+
+    return totals
+
+
+def _get_transaction_columns(session, dispenser_ids, start, end, limit, cursor):
+    # Listed in full when there is no window, including the archived transactions
+    transactions = select_transactions(dispenser_ids, start, end, session)
+    query = _select_columns(
+        session, [transactions.c[column.name] for column in TRANSACTION_COLUMNS]
+    )
+
+    if cursor is not None:
+        query = query.where(transactions.c.id > cursor)
+
+    if limit is None:
+        query = query.order_by(transactions.c.dispenser_id, transactions.c.id)
+    else:
+        # Number each dispenser's rows so one query returns a page per dispenser;
+        # the extra row tells whether there is a next page
+        row_number = (
+            db.func.row_number()
+            .over(
+                partition_by=transactions.c.dispenser_id,
+                order_by=transactions.c.id,
+            )
+            .label("row_number")
+        )
+        ranked = query.add_columns(row_number).subquery()
+        query = (
+            _select_columns(
+                session, [ranked.c[column.name] for column in TRANSACTION_COLUMNS]
+            )
+            .where(ranked.c.row_number <= limit + 1)
+            .order_by(ranked.c.dispenser_id, ranked.c.id)
+        )
+
+    return _read_columns(session, query)
+
+
+def _parse_datetime(value, name):
+    if value is None:
+        return None
+
+    try:
+        parsed = datetime.fromisoformat(value.rstrip("Z"))
+    except ValueError:
+        raise ValueError(f"'{name}' must be an ISO 8601 datetime")
+
+    # Times are stored as naive UTC
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return parsed
+
+
+def _parse_int(value, name):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
@@ -0,0 +1,164 @@
+"""Measure the statistics and tap latency before and after archiving the old
+transactions, and the tap latency while the archival job runs.
+
+The transactions are spread over the past year; those closed more than
+--archive-after-days days ago are archived.
+
+Usage: python -m benchmarks.archive [--transactions 500000] [--archive-after-days 90]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.archive import archive_transactions
+from app.models import db, Admin, Dispenser, Transaction, rebuild_dispenser_aggregates
+
+DISPENSER_COUNT = 100
+INSERT_BATCH_SIZE = 50000
+
+
+def fill_transactions(dispenser_ids, count, now):
+    spacing = timedelta(days=365) / count
+
+    for offset in range(0, count, INSERT_BATCH_SIZE):
+        rows = [
+            {
+                "dispenser_id": random.choice(dispenser_ids),
+                "start_time": now - timedelta(days=365) + i * spacing,
+                "end_time": now - timedelta(days=365) + i * spacing,
+                "amount": 5.0,
+                "revenue": 10.0,
+            }
+            for i in range(offset, min(offset + INSERT_BATCH_SIZE, count))
+        ]
+        db.session.execute(db.insert(Transaction), rows)
+        db.session.commit()
+
+
+def measure_queries(client, headers, now, repeat):
+    week_ago = (now - timedelta(days=7)).isoformat()
+    year_ago = (now - timedelta(days=366)).isoformat()
+    queries = {
+        "week totals": ("/api/statistics", {"from": week_ago, "summary_only": "1"}),
+        "week page": ("/api/statistics", {"from": week_ago, "limit": 100}),
+        "week export": ("/api/export/transactions", {"from": week_ago}),
+        "year totals": ("/api/statistics", {"from": year_ago, "summary_only": "1"}),
+    }
+    timings = {}
+
+    for name, (path, query_string) in queries.items():
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.get(path, headers=headers, query_string=query_string)
+            response.get_data()
+            durations.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.json
+        timings[name] = statistics.median(durations)
+
+    return timings
+
+
+def measure_taps(app, dispenser_ids, stop, latencies):
+    with app.test_client() as client:
+        while not stop.is_set():
+            dispenser_id = random.choice(dispenser_ids)
+            for action in ("open", "close"):
+                started = time.perf_counter()
+                client.post(f"/api/dispenser/{dispenser_id}/{action}")
+                latencies.append((time.perf_counter() - started) * 1000)
+
+
+def tap_percentiles(app, dispenser_ids, run):
+    """Run run() while a thread opens and closes taps, returning the tap p50/p99."""
+    stop = threading.Event()
+    latencies = []
+    thread = threading.Thread(
+        target=measure_taps, args=(app, dispenser_ids, stop, latencies)
+    )
+    thread.start()
+
+    try:
+        result = run()
+    finally:
+        stop.set()
+        thread.join()
+
+    latencies.sort()
+    return result, statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, default=500000)
+    parser.add_argument("--archive-after-days", type=float, default=90)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--pause", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+            }
+        )
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            admin = Admin(username="benchmark", password="benchmark")
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(DISPENSER_COUNT)
+            ]
+            db.session.add_all([admin, *dispensers])
+            db.session.commit()
+            headers = {"Authorization": f"Bearer {create_access_token(admin.id)}"}
+            dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+            now = datetime.utcnow()
+            fill_transactions(dispenser_ids, args.transactions, now)
+            rebuild_dispenser_aggregates()
+
+            before = measure_queries(client, headers, now, args.repeat)
+            _, *taps_before = tap_percentiles(app, dispenser_ids, lambda: time.sleep(2))
+
+            def run_archival():
+                started = time.perf_counter()
+                archived = archive_transactions(
+                    datetime.utcnow() - timedelta(days=args.archive_after_days),
+                    args.batch_size,
+                    args.pause,
+                )
+                return archived, time.perf_counter() - started
+
+            (archived, duration), *taps_during = tap_percentiles(
+                app, dispenser_ids, run_archival
+            )
+            print(f"Archived {archived} transactions in {duration:.1f} s\n")
+
+            after = measure_queries(client, headers, now, args.repeat)
+            _, *taps_after = tap_percentiles(app, dispenser_ids, lambda: time.sleep(2))
+
+    print(f"{'':>16} {'before ms':>10} {'after ms':>10}")
+    for name in before:
+        print(f"{name:>16} {before[name]:>10.2f} {after[name]:>10.2f}")
+    for name, (before_ms, after_ms) in zip(
+        ("tap p50", "tap p99"), zip(taps_before, taps_after)
+    ):
+        print(f"{name:>16} {before_ms:>10.2f} {after_ms:>10.2f}")
+    print(
+        f"\nTaps while archiving: p50 {taps_during[0]:.2f} ms, p99 {taps_during[1]:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
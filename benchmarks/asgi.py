@@ -0,0 +1,218 @@
+"""Compare the ASGI app under Uvicorn with the WSGI app under Gunicorn.
+
+Starts each server on a temporary SQLite database and holds --connections
+keep-alive connections to it at once, each opening, closing and reading a tap of
+its own in a loop. Prints the requests/s and latency of each server, and the
+memory its processes use per connection: the growth of their resident set size
+over an idle server, divided by the number of connections. Requests answered with
+a 5xx status or not answered within REQUEST_TIMEOUT seconds are errors.
+
+Usage: python -m benchmarks.asgi [--connections 16 256] [--duration 10] [--workers 1]
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import subprocess
+import tempfile
+import time
+
+from app import create_app
+from app.models import db, Dispenser
+from benchmarks.server import wait_until_up
+
+HOST = "127.0.0.1"
+PORT = 5000
+# Seconds after which a request without response counts as an error
+REQUEST_TIMEOUT = 30
+
+
+def server_commands(workers):
+    return {
+        # gunicorn.conf.py's gthread workers
+        "gunicorn": ["gunicorn", "wsgi:app", "--workers", str(workers)],
+        "uvicorn": [
+            "uvicorn",
+            "asgi:app",
+            "--host",
+            HOST,
+            "--port",
+            str(PORT),
+            "--workers",
+            str(workers),
+            "--no-access-log",
+        ],
+    }
+
+
+def process_tree_rss(pid):
+    """Return the resident set size in bytes of pid and of its descendants."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                continue
+            children.setdefault(parent, []).append(int(entry))
+
+    rss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/statm") as statm:
+                rss += int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+
+    return rss
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    length = 0
+
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+
+    await reader.readexactly(length)
+
+    return int(lines[0].split()[1])
+
+
+async def pour(dispenser_id, stop, latencies, statuses):
+    reader, writer = await asyncio.open_connection(HOST, PORT)
+    requests = [
+        ("POST", f"/api/dispenser/{dispenser_id}/open"),
+        ("POST", f"/api/dispenser/{dispenser_id}/close"),
+        ("GET", f"/api/dispenser/{dispenser_id}"),
+    ]
+
+    try:
+        while not stop.is_set():
+            for method, path in requests:
+                started = time.perf_counter()
+                writer.write(
+                    f"{method} {path} HTTP/1.1\r\nHost: {HOST}\r\n"
+                    "Content-Length: 0\r\n\r\n".encode()
+                )
+                try:
+                    status = await asyncio.wait_for(
+                        read_response(reader), REQUEST_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    # e.g. past the worker_connections of a Gunicorn worker
+                    statuses["timeout"] = statuses.get("timeout", 0) + 1
+                    return
+
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_connections(connections, duration, process):
+    stop = asyncio.Event()
+    latencies = []
+    statuses = {}
+    tasks = [
+        asyncio.create_task(pour(dispenser_id, stop, latencies, statuses))
+        for dispenser_id in range(1, connections + 1)
+    ]
+
+    # Memory is sampled once every connection is open and busy
+    await asyncio.sleep(duration / 2)
+    rss = process_tree_rss(process.pid)
+    await asyncio.sleep(duration / 2)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    return latencies, statuses, rss
+
+
+def set_up_database(db_path, dispensers):
+    app = create_app(
+        {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}", "JWT_SECRET_KEY": "x"}
+    )
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(
+            [Dispenser(flow_volume=0.5, price=2.0) for _ in range(dispensers)]
+        )
+        db.session.commit()
+        db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, nargs="+", default=[16, 256])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    print(
+        f"{'server':>10} {'conns':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'RSS MB':>8} {'KB/conn':>8} {'errors':>7}"
+    )
+
+    for name, command in server_commands(args.workers).items():
+        for connections in args.connections:
+            with tempfile.TemporaryDirectory() as directory:
+                db_path = os.path.join(directory, "asgi.db")
+                set_up_database(db_path, max(args.connections))
+                environment = {
+                    **os.environ,
+                    "DB_URI": f"sqlite:///{db_path}",
+                    "JWT_SECRET": "benchmark-secret-of-at-least-32-bytes",
+                    "GUNICORN_BIND": f"{HOST}:{PORT}",
+                    "GUNICORN_ACCESS_LOG": "",
+                    "PROMETHEUS_MULTIPROC_DIR": os.path.join(directory, "metrics"),
+                }
+                os.makedirs(environment["PROMETHEUS_MULTIPROC_DIR"])
+                process = subprocess.Popen(
+                    command,
+                    env=environment,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    start_new_session=True,
+                )
+
+                try:
+                    wait_until_up(f"http://{HOST}:{PORT}", process)
+                    # Warm up a single connection, so that the imports and caches
+                    # the first requests load are not counted per connection
+                    asyncio.run(run_connections(1, 1, process))
+                    idle_rss = process_tree_rss(process.pid)
+                    latencies, statuses, rss = asyncio.run(
+                        run_connections(connections, args.duration, process)
+                    )
+                finally:
+                    if process.poll() is None:
+                        os.killpg(process.pid, signal.SIGTERM)
+                    process.wait()
+
+            latencies.sort()
+            errors = sum(
+                count
+                for status, count in statuses.items()
+                if status == "timeout" or status >= 500
+            )
+            print(
+                f"{name:>10} {connections:>6} {len(latencies) / args.duration:>8.1f} "
+                f"{statistics.median(latencies):>8.2f} "
+                f"{latencies[int(len(latencies) * 0.99)]:>8.2f} "
+                f"{rss / 2**20:>8.1f} "
+                f"{(rss - idle_rss) / 1024 / connections:>8.1f} {errors:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
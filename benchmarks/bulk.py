@@ -0,0 +1,70 @@
+"""Compare setting up and pouring N dispensers one request at a time and in bulk.
+
+Usage: python -m benchmarks.bulk [--count 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.models import db, Admin
+
+
+def run_single(client, headers, count):
+    ids = [
+        client.post(
+            "/api/dispenser", headers=headers, json={"flow_volume": 0.5, "price": 2.0}
+        ).json["id"]
+        for _ in range(count)
+    ]
+    for dispenser_id in ids:
+        client.post(f"/api/dispenser/{dispenser_id}/open")
+    for dispenser_id in ids:
+        client.post(f"/api/dispenser/{dispenser_id}/close")
+
+
+def run_bulk(client, headers, count):
+    response = client.post(
+        "/api/dispenser/bulk",
+        headers=headers,
+        json={"dispensers": [{"flow_volume": 0.5, "price": 2.0}] * count},
+    )
+    ids = [result["id"] for result in response.json["results"]]
+    client.post("/api/dispenser/bulk/open", json={"dispenser_ids": ids})
+    client.post("/api/dispenser/bulk/close", json={"dispenser_ids": ids})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+            }
+        )
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            admin = Admin(username="benchmark", password="benchmark")
+            db.session.add(admin)
+            db.session.commit()
+            headers = {"Authorization": f"Bearer {create_access_token(admin.id)}"}
+
+            print(f"{'mode':>8} {'seconds':>8} {'dispensers/s':>12}")
+
+            for mode, run in (("single", run_single), ("bulk", run_bulk)):
+                started = time.perf_counter()
+                run(client, headers, args.count)
+                elapsed = time.perf_counter() - started
+                print(f"{mode:>8} {elapsed:>8.2f} {args.count / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Measure how the latency of closing a tap evolves as the transaction table grows.
+
+Usage: python -m benchmarks.close_latency [--sizes 10000 100000] [--no-indexes]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from app import create_app
+from app.models import db, Dispenser, Transaction
+
+DISPENSER_COUNT = 100
+INSERT_BATCH_SIZE = 50000
+
+
+def fill_transactions(dispenser_ids, count):
+    start = datetime(2023, 7, 14)
+
+    for offset in range(0, count, INSERT_BATCH_SIZE):
+        rows = [
+            {
+                "dispenser_id": random.choice(dispenser_ids),
+                "start_time": start + timedelta(seconds=i),
+                "end_time": start + timedelta(seconds=i + 5),
+                "amount": 5.0,
+                "revenue": 10.0,
+            }
+            for i in range(offset, min(offset + INSERT_BATCH_SIZE, count))
+        ]
+        db.session.execute(db.insert(Transaction), rows)
+        db.session.commit()
+
+
+def measure_close_latency(client, dispenser_ids, cycles):
+    latencies = []
+
+    for _ in range(cycles):
+        dispenser_id = random.choice(dispenser_ids)
+        client.post(f"/api/dispenser/{dispenser_id}/open")
+
+        started = time.perf_counter()
+        response = client.post(f"/api/dispenser/{dispenser_id}/close")
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        assert response.status_code == 200, response.json
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--no-indexes", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            if args.no_indexes:
+                for index in Transaction.__table__.indexes:  # type: ignore
+                    index.drop(db.engine)
+
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(DISPENSER_COUNT)
+            ]
+            db.session.add_all(dispensers)
+            db.session.commit()
+            dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+            filled = 0
+            print(f"{'transactions':>12} {'p50 ms':>8} {'p95 ms':>8}")
+
+            for size in sorted(args.sizes):
+                fill_transactions(dispenser_ids, size - filled)
+                filled = size
+
+                latencies = measure_close_latency(client, dispenser_ids, args.cycles)
+                p95 = statistics.quantiles(latencies, n=20)[-1]
+                print(f"{size:>12} {statistics.median(latencies):>8.2f} {p95:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Measure how long a fresh process takes to import the app, create it and serve
+its first request, as an autoscaled worker started without preloading would.
+
+Each run is a new interpreter on a temporary SQLite database set up beforehand by
+the init-db command. Exits with an error when the median time to create the app
+exceeds --budget.
+
+Usage: python -m benchmarks.cold_start [--runs 5] [--budget 1000]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Run in the fresh interpreter; prints the cumulated milliseconds of each step
+STARTUP = """
+import json, time
+started = time.perf_counter()
+timings = {}
+import app
+timings["import"] = time.perf_counter() - started
+application = app.create_app()
+timings["create_app"] = time.perf_counter() - started
+application.test_client().get("/api/dispenser")
+timings["first request"] = time.perf_counter() - started
+print(json.dumps({step: seconds * 1000 for step, seconds in timings.items()}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1000, help="milliseconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        environment = {
+            **os.environ,
+            "DB_URI": "sqlite:///" + os.path.join(directory, "cold_start.db"),
+            "JWT_SECRET": "benchmark-secret-of-at-least-32-bytes",
+            "ADMIN_USERNAME": "benchmark",
+            "ADMIN_PASSWORD": "benchmark",
+        }
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "wsgi", "init-db"],
+            env=environment,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP],
+                env=environment,
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout
+            runs.append(json.loads(output.splitlines()[-1]))
+
+    print(f"{'step':>14} {'median ms':>10} {'max ms':>8}")
+    for step in runs[0]:
+        timings = [run[step] for run in runs]
+        print(f"{step:>14} {statistics.median(timings):>10.1f} {max(timings):>8.1f}")
+
+    created = statistics.median(run["create_app"] for run in runs)
+    if created > args.budget:
+        raise SystemExit(
+            f"Creating the app took {created:.0f} ms, over the {args.budget:.0f} ms "
+            "budget"
+        )
+
+
+if __name__ == "__main__":
+    main()
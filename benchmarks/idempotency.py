@@ -0,0 +1,133 @@
+"""Compare the ways a tap controller can recover from a lost close response.
+
+Opens and closes --taps taps, each close sent with an Idempotency-Key, then
+retries every close: without the key, which answers 400 and leaves the controller
+to read the statistics of the tap to learn what was poured; with the key, replayed
+from the memory of the worker; and with the key, replayed from the database by
+another worker (IDEMPOTENCY_BACKEND=database). Prints the median latency and SQL
+statements of each way.
+
+Usage: python -m benchmarks.idempotency [--taps 500] [--transactions 100]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.idempotency import DatabaseIdempotencyBackend, idempotency_store
+from app.models import db, Admin, Dispenser, Transaction
+
+
+def measure(recover, dispenser_ids, statements):
+    durations = []
+    counts = []
+
+    for dispenser_id in dispenser_ids:
+        del statements[:]
+        started = time.perf_counter()
+        recover(dispenser_id)
+        durations.append((time.perf_counter() - started) * 1000)
+        counts.append(len(statements))
+
+    return statistics.median(durations), statistics.median(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--taps", type=int, default=500)
+    parser.add_argument(
+        "--transactions",
+        type=int,
+        default=100,
+        help="past transactions of each tap, listed by its statistics",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+                "IDEMPOTENCY_BACKEND": "database",
+            }
+        )
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            admin = Admin(username="benchmark", password="benchmark")
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(args.taps)
+            ]
+            db.session.add_all([admin, *dispensers])
+            db.session.commit()
+            headers = {"Authorization": f"Bearer {create_access_token(admin.id)}"}
+            dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+            start = datetime.utcnow() - timedelta(days=1)
+            db.session.add_all(
+                Transaction(
+                    dispenser_id=dispenser_id,
+                    start_time=start + timedelta(minutes=index),
+                    end_time=start + timedelta(minutes=index, seconds=10),
+                    amount=5.0,
+                    revenue=10.0,
+                )
+                for dispenser_id in dispenser_ids
+                for index in range(args.transactions)
+            )
+            db.session.commit()
+
+            for dispenser_id in dispenser_ids:
+                client.post(f"/api/dispenser/{dispenser_id}/open")
+                response = client.post(
+                    f"/api/dispenser/{dispenser_id}/close",
+                    headers={"Idempotency-Key": f"close-{dispenser_id}"},
+                )
+                assert response.status_code == 200, response.json
+
+            statements = []
+            event.listen(
+                db.engine,
+                "before_cursor_execute",
+                lambda *arguments: statements.append(arguments[2]),
+            )
+
+            def reconcile(dispenser_id):
+                response = client.post(f"/api/dispenser/{dispenser_id}/close")
+                assert response.status_code == 400
+                response = client.get(
+                    f"/api/statistics/{dispenser_id}", headers=headers
+                )
+                assert response.status_code == 200
+
+            def replay(dispenser_id):
+                response = client.post(
+                    f"/api/dispenser/{dispenser_id}/close",
+                    headers={"Idempotency-Key": f"close-{dispenser_id}"},
+                )
+                assert response.headers["Idempotent-Replayed"] == "true"
+
+            def replay_from_database(dispenser_id):
+                # Nothing in memory, as in a worker that did not serve the close
+                idempotency_store.backend = DatabaseIdempotencyBackend(2**20)
+                replay(dispenser_id)
+
+            timings = {
+                "reconcile": measure(reconcile, dispenser_ids, statements),
+                "memory": measure(replay, dispenser_ids, statements),
+                "database": measure(replay_from_database, dispenser_ids, statements),
+            }
+
+    print(f"{'':>10} {'median ms':>10} {'statements':>11}")
+    for name, (duration, count) in timings.items():
+        print(f"{name:>10} {duration:>10.2f} {count:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
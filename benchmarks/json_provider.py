@@ -0,0 +1,58 @@
+"""Compare the API JSON provider to Flask's default on a statistics payload.
+
+Usage: python -m benchmarks.json_provider [--transactions 100000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from flask.json.provider import DefaultJSONProvider
+from app import create_app
+from app.models import db, Dispenser
+from app.json_provider import ApiJSONProvider
+from app.statistics import get_dispenser_statistics
+from benchmarks.close_latency import DISPENSER_COUNT, fill_transactions
+
+
+def measure(provider, payload, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        body = provider.response(payload).get_data()
+
+    return (time.perf_counter() - started) / repeat, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+
+        with app.app_context():
+            db.create_all()
+
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(DISPENSER_COUNT)
+            ]
+            db.session.add_all(dispensers)
+            db.session.commit()
+            fill_transactions(
+                [dispenser.id for dispenser in dispensers], args.transactions
+            )
+
+            payload = get_dispenser_statistics(dispensers)
+            default, expected = measure(DefaultJSONProvider(app), payload, args.repeat)
+            fast, body = measure(ApiJSONProvider(app), payload, args.repeat)
+
+            assert body == expected, "the providers disagree"
+            print(f"{'provider':>8} {'ms':>8}")
+            print(f"{'default':>8} {default * 1000:>8.1f}")
+            print(f"{'api':>8} {fast * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
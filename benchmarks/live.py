@@ -0,0 +1,93 @@
+"""Compare the live pour estimates of the open tap registry with the statistics.
+
+Opens --open of --dispensers taps, then times a dashboard refresh through the
+summary statistics and through /api/statistics/live, and counts the SQL
+statements each runs. The registry is loaded by the first request.
+
+Usage: python -m benchmarks.live [--dispensers 1000] [--open 500] [--repeat 200]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.bulk import open_dispensers
+from app.models import db, Admin, Dispenser
+
+
+def measure(client, path, headers, repeat, statements):
+    durations = []
+    counts = []
+
+    for _ in range(repeat):
+        del statements[:]
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        response.get_data()
+        durations.append((time.perf_counter() - started) * 1000)
+        counts.append(len(statements))
+        assert response.status_code == 200, response.json
+
+    return statistics.median(durations), statistics.median(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dispensers", type=int, default=1000)
+    parser.add_argument("--open", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+            }
+        )
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            admin = Admin(username="benchmark", password="benchmark")
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(args.dispensers)
+            ]
+            db.session.add_all([admin, *dispensers])
+            db.session.commit()
+            headers = {"Authorization": f"Bearer {create_access_token(admin.id)}"}
+
+            open_dispensers([dispenser.id for dispenser in dispensers[: args.open]])
+            db.session.commit()
+
+            statements = []
+            event.listen(
+                db.engine,
+                "before_cursor_execute",
+                lambda *arguments: statements.append(arguments[2]),
+            )
+
+            timings = {
+                "statistics": measure(
+                    client,
+                    "/api/statistics?summary_only=1",
+                    headers,
+                    args.repeat,
+                    statements,
+                ),
+                "live": measure(
+                    client, "/api/statistics/live", headers, args.repeat, statements
+                ),
+            }
+
+    print(f"{'':>12} {'median ms':>10} {'statements':>11}")
+    for name, (duration, count) in timings.items():
+        print(f"{name:>12} {duration:>10.2f} {count:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+"""Replay a tap traffic workload against the API and report latency per endpoint.
+
+A workload is a JSON Lines file with one request per line, e.g.
+
+  {"client": "taps-0", "name": "open", "method": "POST",
+   "path": "/api/dispenser/{dispenser}/open", "dispenser": 3}
+
+"dispenser" is an index into the dispensers the run creates beforehand, and is
+substituted in the path. "auth": true sends the admin token, "login": true posts
+the admin credentials and "body" is sent as JSON. Every client replays its own
+lines in order, the clients running concurrently. "generate" writes a workload of
+interleaved opens and closes on many dispensers, periodic statistics and
+dispenser list polls, and an optional login storm.
+
+The run is in-process through the Flask test client (on a temporary SQLite
+database unless --db-uri is given), which also counts the SQL statements of each
+request, or over HTTP against a running server with --url. Results can be saved
+as JSON with --output and compared to a previous run with --baseline.
+
+Usage:
+  python -m benchmarks.load generate workload.jsonl [--dispensers 50]
+  python -m benchmarks.load run workload.jsonl [--url http://localhost:8000]
+      [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.metrics import metrics
+from app.models import db, Admin, Dispenser
+
+BULK_SIZE = 1000
+
+
+def generate_workload(
+    dispensers, tap_clients, pours, stats_every, login_clients, logins, seed
+):
+    """Return the lines of a workload, see the module docstring."""
+    rng = random.Random(seed)
+    lines = []
+
+    # Each tap client owns a share of the dispensers, so that the opens and closes
+    # of a dispenser alternate whatever the interleaving of the clients
+    for client in range(tap_clients):
+        name = f"taps-{client}"
+        remaining = {
+            index: 2 * pours for index in range(client, dispensers, tap_clients)
+        }
+        is_open = set()
+        sent = 0
+
+        while remaining:
+            index = rng.choice(list(remaining))
+            action = "close" if index in is_open else "open"
+            is_open ^= {index}
+            remaining[index] -= 1
+            if not remaining[index]:
+                del remaining[index]
+
+            lines.append(
+                {
+                    "client": name,
+                    "name": action,
+                    "method": "POST",
+                    "path": f"/api/dispenser/{{dispenser}}/{action}",
+                    "dispenser": index,
+                }
+            )
+            sent += 1
+
+            if stats_every and sent % stats_every == 0:
+                lines.append(
+                    {
+                        "client": name,
+                        "name": "statistics",
+                        "method": "GET",
+                        "path": "/api/statistics?summary_only=true",
+                        "auth": True,
+                    }
+                )
+                lines.append(
+                    {
+                        "client": name,
+                        "name": "dispensers",
+                        "method": "GET",
+                        "path": "/api/dispenser",
+                    }
+                )
+
+    for client in range(login_clients):
+        lines.extend(
+            {
+                "client": f"logins-{client}",
+                "name": "login",
+                "method": "POST",
+                "path": "/auth/login",
+                "login": True,
+            }
+            for _ in range(logins)
+        )
+
+    return lines
+
+
+class InProcessTarget:
+    """Sends the requests through the Flask test client, counting SQL statements."""
+
+    name = "in-process"
+    counts_statements = True
+
+    def __init__(self, db_uri, username, password):
+        self.username = username
+        self.password = password
+        self._statements = threading.local()
+
+        self.app = create_app(
+            {"SQLALCHEMY_DATABASE_URI": db_uri, "JWT_SECRET_KEY": "benchmark"}
+        )
+
+    def setup(self, dispenser_count):
+        """Create the admin and dispensers, returning the token and dispenser ids."""
+        with self.app.app_context():
+            db.create_all()
+
+            admin = Admin.query.filter_by(username=self.username).first()
+            if admin is None:
+                admin = Admin(username=self.username, password=self.password)
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(dispenser_count)
+            ]
+            db.session.add_all([admin, *dispensers])
+            db.session.commit()
+
+            event.listen(db.engine, "before_cursor_execute", self._count_statement)
+
+            return create_access_token(admin.id), [
+                dispenser.id for dispenser in dispensers
+            ]
+
+    def connect(self):
+        client = self.app.test_client()
+
+        def send(method, path, body, headers):
+            self._statements.count = 0
+            response = client.open(path, method=method, json=body, headers=headers)
+            return response.status_code, self._statements.count
+
+        return send
+
+    def _count_statement(self, *args):
+        self._statements.count = getattr(self._statements, "count", 0) + 1
+
+
+class HttpTarget:
+    """Sends the requests over HTTP, one keep-alive connection per client."""
+
+    counts_statements = False
+
+    def __init__(self, url, username, password):
+        self.name = url
+        self.username = username
+        self.password = password
+        parts = urlsplit(url)
+        self._connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self._netloc = parts.netloc
+        self._prefix = parts.path.rstrip("/")
+
+    def setup(self, dispenser_count):
+        """Log in and create the dispensers in bulk, returning the token and ids."""
+        send = self.connect(expect_json=True)
+        status, token = send(
+            "POST",
+            "/auth/login",
+            {"username": self.username, "password": self.password},
+            {},
+        )
+        if status != 200:
+            raise SystemExit(f"Login failed with status {status}")
+
+        token = token["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        dispenser_ids = []
+
+        while len(dispenser_ids) < dispenser_count:
+            count = min(BULK_SIZE, dispenser_count - len(dispenser_ids))
+            status, created = send(
+                "POST",
+                "/api/dispenser/bulk",
+                {"dispensers": [{"flow_volume": 0.5, "price": 2.0}] * count},
+                headers,
+            )
+            if status != 200:
+                raise SystemExit(f"Creating dispensers failed with status {status}")
+            dispenser_ids.extend(result["id"] for result in created["results"])
+
+        return token, dispenser_ids
+
+    def connect(self, expect_json=False):
+        connection = self._connection_class(self._netloc)
+
+        def send(method, path, body, headers):
+            headers = dict(headers)
+            payload = None
+            if body is not None:
+                payload = json.dumps(body).encode()
+                headers["Content-Type"] = "application/json"
+
+            for attempt in range(2):
+                try:
+                    connection.request(
+                        method, self._prefix + path, body=payload, headers=headers
+                    )
+                    response = connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, ConnectionError):
+                    # The server closed the keep-alive connection, open another
+                    connection.close()
+                    if attempt:
+                        raise
+
+            return response.status, json.loads(data) if expect_json else None
+
+        return send
+
+
+def load_workload(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def run_workload(target, workload):
+    """Replay workload against target, returning the results of every request."""
+    dispenser_count = 1 + max(
+        (line["dispenser"] for line in workload if "dispenser" in line), default=-1
+    )
+    token, dispenser_ids = target.setup(dispenser_count)
+    credentials = {"username": target.username, "password": target.password}
+
+    clients = defaultdict(list)
+    for line in workload:
+        clients[line.get("client", "default")].append(line)
+
+    results = []
+    lock = threading.Lock()
+
+    def replay(lines):
+        send = target.connect()
+        client_results = []
+
+        for line in lines:
+            path = line["path"]
+            if "dispenser" in line:
+                path = path.replace(
+                    "{dispenser}", str(dispenser_ids[line["dispenser"]])
+                )
+            headers = {"Authorization": f"Bearer {token}"} if line.get("auth") else {}
+            body = credentials if line.get("login") else line.get("body")
+
+            started = time.perf_counter()
+            status, statements = send(line["method"], path, body, headers)
+            latency = (time.perf_counter() - started) * 1000
+            client_results.append((line["name"], latency, status, statements))
+
+        with lock:
+            results.extend(client_results)
+
+    threads = [
+        threading.Thread(target=replay, args=(lines,)) for lines in clients.values()
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[
+        min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    ]
+
+
+def summarize(results, duration, target):
+    """Aggregate the results per endpoint name, plus an "all" entry."""
+    by_name = defaultdict(list)
+    for result in results:
+        by_name[result[0]].append(result)
+        by_name["all"].append(result)
+
+    endpoints = {}
+    for name, name_results in sorted(by_name.items()):
+        latencies = sorted(result[1] for result in name_results)
+        statements = [result[3] for result in name_results]
+
+        endpoints[name] = {
+            "requests": len(name_results),
+            "requests_per_second": len(name_results) / duration,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "sql_statements_per_request": sum(statements) / len(statements)
+            if target.counts_statements
+            else None,
+            "statuses": {
+                str(status): count
+                for status, count in sorted(
+                    Counter(result[2] for result in name_results).items()
+                )
+            },
+        }
+
+    return {"target": target.name, "duration_s": duration, "endpoints": endpoints}
+
+
+def print_summary(summary, baseline=None):
+    print(
+        f"{'endpoint':>12} {'requests':>8} {'req/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'sql/req':>7}  statuses"
+    )
+    for name, endpoint in summary["endpoints"].items():
+        statements = endpoint["sql_statements_per_request"]
+        print(
+            f"{name:>12} {endpoint['requests']:>8} "
+            f"{endpoint['requests_per_second']:>8.1f} {endpoint['p50_ms']:>8.2f} "
+            f"{endpoint['p95_ms']:>8.2f} {endpoint['p99_ms']:>8.2f} "
+            f"{'-' if statements is None else format(statements, '.1f'):>7}  "
+            f"{endpoint['statuses']}"
+        )
+
+    if baseline is None:
+        return
+
+    print(f"\nChange against the baseline ({baseline['target']}):")
+    print(f"{'endpoint':>12} {'req/s':>8} {'p50':>8} {'p99':>8}")
+    for name, endpoint in summary["endpoints"].items():
+        previous = baseline["endpoints"].get(name)
+        if previous is None:
+            continue
+
+        changes = [
+            (endpoint[key] - previous[key]) / previous[key] * 100
+            if previous[key]
+            else 0
+            for key in ("requests_per_second", "p50_ms", "p99_ms")
+        ]
+        print(f"{name:>12} " + " ".join(f"{change:>+7.1f}%" for change in changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a workload file")
+    generate.add_argument("workload")
+    generate.add_argument("--dispensers", type=int, default=50)
+    generate.add_argument("--clients", type=int, default=8)
+    generate.add_argument("--pours", type=int, default=10, help="per dispenser")
+    generate.add_argument(
+        "--stats-every", type=int, default=20, help="tap requests between polls"
+    )
+    generate.add_argument("--login-clients", type=int, default=2)
+    generate.add_argument("--logins", type=int, default=10, help="per login client")
+    generate.add_argument("--seed", type=int, default=0)
+
+    run = commands.add_parser("run", help="replay a workload file")
+    run.add_argument("workload")
+    run.add_argument("--url", help="server to send the requests to over HTTP")
+    run.add_argument("--db-uri", help="database of the in-process run")
+    run.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="do not record the Prometheus metrics in the in-process run",
+    )
+    run.add_argument("--username", default="benchmark")
+    run.add_argument("--password", default="benchmark")
+    run.add_argument("--output", help="write the results as JSON")
+    run.add_argument("--baseline", help="JSON results of a run to compare with")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        lines = generate_workload(
+            args.dispensers,
+            args.clients,
+            args.pours,
+            args.stats_every,
+            args.login_clients,
+            args.logins,
+            args.seed,
+        )
+        with open(args.workload, "w") as file:
+            file.writelines(json.dumps(line) + "\n" for line in lines)
+        print(f"Wrote {len(lines)} requests to {args.workload}")
+        return
+
+    workload = load_workload(args.workload)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.url:
+            target = HttpTarget(args.url, args.username, args.password)
+        else:
+            db_uri = args.db_uri or "sqlite:///" + os.path.join(directory, "load.db")
+            target = InProcessTarget(db_uri, args.username, args.password)
+            metrics.enabled = not args.no_metrics
+
+        results, duration = run_workload(target, workload)
+
+    summary = summarize(results, duration, target)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    print_summary(summary, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summary, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Measure the tap endpoints' latency while many clients log in at once.
+
+Each run opens and closes a tap in a loop while --logins threads keep posting to
+/auth/login, with bcrypt allowed as many threads as there are logins (unbounded)
+or the default bounded pool, which answers 429 once saturated.
+
+Usage: python -m benchmarks.login_storm [--logins 16] [--taps 200]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from app import create_app
+from app.models import db, Admin, Dispenser
+from app.passwords import password_hasher
+
+
+def measure_taps(client, dispenser_id, taps):
+    latencies = []
+
+    for _ in range(taps):
+        for action in ("open", "close"):
+            started = time.perf_counter()
+            client.post(f"/api/dispenser/{dispenser_id}/{action}")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def storm(app, logins, stop):
+    statuses = []
+
+    def log_in():
+        with app.test_client() as client:
+            while not stop.is_set():
+                response = client.post(
+                    "/auth/login",
+                    json={"username": "benchmark", "password": "benchmark"},
+                )
+                statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=log_in) for _ in range(logins)]
+    for thread in threads:
+        thread.start()
+
+    return threads, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=16)
+    parser.add_argument("--taps", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+            }
+        )
+        pool = (app.config["BCRYPT_WORKERS"], app.config["BCRYPT_QUEUE_SIZE"])
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            dispenser = Dispenser(flow_volume=0.5, price=2.0)
+            db.session.add_all(
+                [Admin(username="benchmark", password="benchmark"), dispenser]
+            )
+            db.session.commit()
+            dispenser_id = dispenser.id
+
+            print(
+                f"{'mode':>10} {'tap p50 ms':>10} {'tap p99 ms':>10} "
+                f"{'logins/s':>8} {'429s':>6}"
+            )
+            # (login threads, bcrypt threads, bcrypt queue size)
+            modes = {
+                "no logins": (0, *pool),
+                "unbounded": (args.logins, args.logins, 0),
+                "bounded": (args.logins, *pool),
+            }
+
+            for mode, (logins, workers, queue_size) in modes.items():
+                app.config["BCRYPT_WORKERS"] = workers
+                app.config["BCRYPT_QUEUE_SIZE"] = queue_size
+                password_hasher.init_app(app)
+
+                stop = threading.Event()
+                threads, statuses = storm(app, logins, stop)
+                started = time.perf_counter()
+                p50, p99 = measure_taps(client, dispenser_id, args.taps)
+                elapsed = time.perf_counter() - started
+                stop.set()
+                for thread in threads:
+                    thread.join()
+
+                accepted = statuses.count(200)
+                print(
+                    f"{mode:>10} {p50:>10.2f} {p99:>10.2f} "
+                    f"{accepted / elapsed:>8.1f} {statuses.count(429):>6}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Measure the latency of well-behaved tap controllers next to a misbehaving one.
+
+--clients threads each open and close a tap of their own, pausing --pause seconds
+between requests, from addresses of their own. Meanwhile --bad-clients threads
+open and close taps from a single address, pausing only --bad-pause seconds and
+ignoring Retry-After, as a controller stuck in a retry loop would. Each mode runs
+for --duration seconds on a fresh SQLite database: without rate limits, with the
+per-client limit of --rate requests/s (bursts of --burst), and shedding requests
+while the statements take more than --admission-ms on average. Prints the latency and 429s of the good
+clients, the requests of the bad one and the transactions each wrote.
+
+Usage: python -m benchmarks.rate_limit [--clients 8] [--rate 20] [--admission-ms 20]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from app import create_app
+from app.models import db, Dispenser, Transaction
+
+
+def pour(app, dispenser_id, address, pause, stop, latencies, statuses):
+    environ = {"REMOTE_ADDR": address}
+
+    with app.test_client() as client:
+        while not stop.is_set():
+            for action in ("open", "close"):
+                started = time.perf_counter()
+                response = client.post(
+                    f"/api/dispenser/{dispenser_id}/{action}", environ_base=environ
+                )
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[response.status_code] = (
+                    statuses.get(response.status_code, 0) + 1
+                )
+                time.sleep(pause)
+
+
+def run(config, args):
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+                "METRICS_ENABLED": False,
+                **config,
+            }
+        )
+
+        with app.app_context():
+            db.create_all()
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0)
+                for _ in range(args.clients + args.bad_clients)
+            ]
+            db.session.add_all(dispensers)
+            db.session.commit()
+            dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+            stop = threading.Event()
+            good = ([], {})
+            bad = ([], {})
+            threads = [
+                threading.Thread(
+                    target=pour,
+                    args=(
+                        app,
+                        dispenser_id,
+                        f"10.0.0.{index}",
+                        args.pause,
+                        stop,
+                        *good,
+                    ),
+                )
+                for index, dispenser_id in enumerate(dispenser_ids[: args.clients])
+            ] + [
+                threading.Thread(
+                    target=pour,
+                    args=(app, dispenser_id, "10.0.1.0", args.bad_pause, stop, *bad),
+                )
+                for dispenser_id in dispenser_ids[args.clients :]
+            ]
+            for thread in threads:
+                thread.start()
+            time.sleep(args.duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            writes = dict(
+                db.session.execute(
+                    db.select(Transaction.dispenser_id, db.func.count()).group_by(
+                        Transaction.dispenser_id
+                    )
+                ).all()
+            )
+
+    good_writes = sum(writes.get(i, 0) for i in dispenser_ids[: args.clients])
+    bad_writes = sum(writes.get(i, 0) for i in dispenser_ids[args.clients :])
+
+    return good, bad, good_writes, bad_writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--bad-clients", type=int, default=4)
+    parser.add_argument("--pause", type=float, default=0.1)
+    parser.add_argument("--bad-pause", type=float, default=0.01)
+    parser.add_argument("--rate", type=float, default=20)
+    parser.add_argument("--burst", type=float, default=20)
+    parser.add_argument("--admission-ms", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    modes = {
+        "unlimited": {},
+        "limited": {
+            "RATE_LIMIT_CLIENT_RATE": args.rate,
+            "RATE_LIMIT_CLIENT_BURST": args.burst,
+        },
+        "shedding": {"ADMISSION_DB_LATENCY_MS": args.admission_ms},
+    }
+
+    print(
+        f"{'mode':>10} {'good p50 ms':>11} {'good p99 ms':>11} {'good 429s':>9} "
+        f"{'good tx':>8} "
+        f"{'bad req/s':>9} {'bad 429s':>8} {'bad tx':>7}"
+    )
+    for name, config in modes.items():
+        (
+            (latencies, statuses),
+            (bad_latencies, bad_statuses),
+            good_writes,
+            bad_writes,
+        ) = run(config, args)
+        latencies.sort()
+        print(
+            f"{name:>10} {statistics.median(latencies):>11.2f} "
+            f"{latencies[int(len(latencies) * 0.99)]:>11.2f} "
+            f"{statuses.get(429, 0):>9} {good_writes:>8} "
+            f"{len(bad_latencies) / args.duration:>9.1f} "
+            f"{bad_statuses.get(429, 0):>8} {bad_writes:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
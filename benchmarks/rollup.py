@@ -0,0 +1,75 @@
+"""Measure the rollup endpoint over a weekend of pours.
+
+Usage: python -m benchmarks.rollup [--transactions 200000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from flask_jwt_extended import create_access_token
+from app import create_app
+from app.models import db, Admin, Dispenser
+from app.rollup import rebuild_rollups
+from benchmarks.close_latency import DISPENSER_COUNT, fill_transactions
+
+QUERIES = {
+    "hour, per dispenser": {"granularity": "hour"},
+    "hour, fleet": {"granularity": "hour", "fleet": "true"},
+    "day, per dispenser": {"granularity": "day"},
+    "minute, one dispenser": {"granularity": "minute", "dispenser_id": "1"},
+    "minute, fleet": {"granularity": "minute", "fleet": "true"},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    # fill_transactions starts one pour per second, so 200000 span about 55 hours
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+                "JWT_SECRET_KEY": "benchmark",
+            }
+        )
+
+        with app.app_context(), app.test_client() as client:
+            db.create_all()
+
+            admin = Admin(username="benchmark", password="benchmark")
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(DISPENSER_COUNT)
+            ]
+            db.session.add_all([admin, *dispensers])
+            db.session.commit()
+            headers = {"Authorization": f"Bearer {create_access_token(admin.id)}"}
+
+            fill_transactions(
+                [dispenser.id for dispenser in dispensers], args.transactions
+            )
+
+            started = time.perf_counter()
+            rebuild_rollups()
+            print(f"rebuild-rollups: {time.perf_counter() - started:.2f}s\n")
+
+            print(f"{'query':>22} {'p50 ms':>8} {'buckets':>8}")
+            for name, query in QUERIES.items():
+                latencies = []
+                for _ in range(args.repeat):
+                    started = time.perf_counter()
+                    response = client.get(
+                        "/api/statistics/rollup", headers=headers, query_string=query
+                    )
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+                buckets = sum(len(s["buckets"]) for s in response.json["series"])
+                print(f"{name:>22} {statistics.median(latencies):>8.2f} {buckets:>8}")
+
+
+if __name__ == "__main__":
+    main()
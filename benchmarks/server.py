@@ -0,0 +1,103 @@
+"""Compare the throughput of the Flask development server and of Gunicorn.
+
+Starts each server on a temporary SQLite database, replays the same generated
+workload against it over HTTP (see benchmarks.load) and prints the requests/s and
+latency of each.
+
+Usage: python -m benchmarks.server [--clients 16] [--dispensers 64] [--pours 10]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from benchmarks.load import HttpTarget, generate_workload, run_workload, summarize
+
+SERVERS = {
+    # What the Dockerfile used to run
+    "dev server": [sys.executable, "run_dev.py"],
+    "gunicorn": ["gunicorn", "wsgi:app"],
+}
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("The server exited while starting")
+        try:
+            urllib.request.urlopen(url + "/api/dispenser", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.2)
+
+    raise SystemExit(f"The server did not answer within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--dispensers", type=int, default=64)
+    parser.add_argument("--pours", type=int, default=10)
+    args = parser.parse_args()
+
+    workload = generate_workload(
+        args.dispensers, args.clients, args.pours, 20, 0, 0, seed=0
+    )
+    # run_dev.py always listens on port 5000
+    url = "http://127.0.0.1:5000"
+
+    print(f"{'server':>10} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+
+    for name, command in SERVERS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            environment = {
+                **os.environ,
+                "DB_URI": "sqlite:///" + os.path.join(directory, "server.db"),
+                "JWT_SECRET": "benchmark-secret-of-at-least-32-bytes",
+                "ADMIN_USERNAME": "benchmark",
+                "ADMIN_PASSWORD": "benchmark",
+                "GUNICORN_BIND": "127.0.0.1:5000",
+                "GUNICORN_ACCESS_LOG": "",
+                "PROMETHEUS_MULTIPROC_DIR": os.path.join(directory, "metrics"),
+            }
+            os.makedirs(environment["PROMETHEUS_MULTIPROC_DIR"])
+            subprocess.run(
+                [sys.executable, "-m", "flask", "--app", "wsgi", "init-db"],
+                env=environment,
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+            # The dev server's reloader runs the app in a child process, so the
+            # whole process group is stopped at the end
+            process = subprocess.Popen(
+                command,
+                env=environment,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+
+            try:
+                wait_until_up(url, process)
+                target = HttpTarget(url, "benchmark", "benchmark")
+                results, duration = run_workload(target, workload)
+            finally:
+                if process.poll() is None:
+                    os.killpg(process.pid, signal.SIGTERM)
+                process.wait()
+
+        endpoint = summarize(results, duration, target)["endpoints"]["all"]
+        print(
+            f"{name:>10} {endpoint['requests_per_second']:>8.1f} "
+            f"{endpoint['p50_ms']:>8.2f} {endpoint['p99_ms']:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
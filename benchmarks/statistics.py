@@ -0,0 +1,113 @@
+"""Compare the NumPy statistics engine to looping over the transaction models.
+
+Usage: python -m benchmarks.statistics [--sizes 10000 100000 1000000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from app import create_app
+from app.models import db, Dispenser, Transaction
+from app.statistics import get_dispenser_statistics
+from benchmarks.close_latency import DISPENSER_COUNT, fill_transactions
+
+
+def get_model_method_statistics(dispensers):
+    """Statistics built one transaction model at a time, as the API used to."""
+    statistics = []
+    now = datetime.utcnow()
+
+    for dispenser in dispensers:
+        total_amount = 0
+        total_revenue = 0
+        transactions = []
+
+        for transaction in dispenser.transactions:
+            amount, revenue = transaction.get_amount_and_revenue(now)
+            total_amount += amount
+            total_revenue += revenue
+            transactions.append(
+                {
+                    "transaction_id": transaction.id,
+                    "start_time": transaction.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "end_time": transaction.end_time.strftime("%Y-%m-%d %H:%M:%S")
+                    if transaction.end_time
+                    else None,
+                    "amount": amount,
+                    "revenue": revenue,
+                }
+            )
+
+        statistics.append(
+            {
+                "dispenser_id": dispenser.id,
+                "total_transactions": len(transactions),
+                "total_amount": total_amount,
+                "total_revenue": total_revenue,
+                "transactions": transactions,
+            }
+        )
+
+    return statistics
+
+
+def measure(function):
+    # Start from an empty identity map, as a new request would
+    db.session.expire_all()
+    db.session.expunge_all()
+    dispensers = Dispenser.query.order_by(Dispenser.id).all()
+
+    started = time.perf_counter()
+    function(dispensers)
+
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "benchmark.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}"})
+
+        with app.app_context():
+            db.create_all()
+
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(DISPENSER_COUNT)
+            ]
+            db.session.add_all(dispensers)
+            db.session.commit()
+            dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+            # A few taps are pouring, so live amounts have to be computed too
+            db.session.add_all(
+                Transaction(dispenser_id=dispenser_id, start_time=datetime.utcnow())
+                for dispenser_id in dispenser_ids[:10]
+            )
+            db.session.commit()
+
+            filled = 0
+            print(
+                f"{'transactions':>12} {'models s':>9} {'numpy s':>8} {'summary s':>9}"
+            )
+
+            for size in sorted(args.sizes):
+                fill_transactions(dispenser_ids, size - filled)
+                filled = size
+
+                models = measure(get_model_method_statistics)
+                columns = measure(get_dispenser_statistics)
+                summary = measure(
+                    lambda dispensers: get_dispenser_statistics(
+                        dispensers, summary_only=True
+                    )
+                )
+                print(f"{size:>12} {models:>9.2f} {columns:>8.2f} {summary:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
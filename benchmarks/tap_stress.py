@@ -0,0 +1,118 @@
+"""Hammer open/close from several processes and check that every dispenser ends
+up with at most one open transaction.
+
+Each process runs its own copy of the app and connection pool, like gunicorn
+workers do. Point --db-uri at a PostgreSQL database to check it as well.
+
+Usage: python -m benchmarks.tap_stress [--db-uri postgresql://...] [--processes 4]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from app import create_app
+from app.models import db, Dispenser, Transaction, check_dispenser_aggregates
+
+
+def run_worker(db_uri, dispenser_ids, iterations, seed):
+    app = create_app({"SQLALCHEMY_DATABASE_URI": db_uri})
+    rng = random.Random(seed)
+    statuses = Counter()
+
+    with app.test_client() as client:
+        for _ in range(iterations):
+            action = rng.choice(["open", "close"])
+            dispenser_id = rng.choice(dispenser_ids)
+            response = client.post(f"/api/dispenser/{dispenser_id}/{action}")
+            statuses[response.status_code] += 1
+
+    return statuses
+
+
+def check_dispensers():
+    errors = []
+
+    for dispenser in Dispenser.query.all():
+        open_ids = [
+            transaction.id
+            for transaction in Transaction.query.filter_by(
+                dispenser_id=dispenser.id, end_time=None
+            )
+        ]
+        expected = [dispenser.open_transaction_id] if dispenser.is_open else []
+
+        if open_ids != expected:
+            errors.append(
+                f"Dispenser {dispenser.id}: open transactions {open_ids}, "
+                f"expected {expected}"
+            )
+
+    for mismatch in check_dispenser_aggregates():
+        errors.append(f"Dispenser {mismatch['dispenser_id']}: totals out of sync")
+
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-uri")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--dispensers", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_uri = args.db_uri or "sqlite:///" + os.path.join(directory, "stress.db")
+        app = create_app({"SQLALCHEMY_DATABASE_URI": db_uri})
+
+        with app.app_context():
+            db.create_all()
+
+            dispensers = [
+                Dispenser(flow_volume=0.5, price=2.0) for _ in range(args.dispensers)
+            ]
+            db.session.add_all(dispensers)
+            db.session.commit()
+            dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(args.processes) as pool:
+            results = pool.starmap(
+                run_worker,
+                [
+                    (db_uri, dispenser_ids, args.iterations, seed)
+                    for seed in range(args.processes)
+                ],
+            )
+
+        statuses = sum(results, Counter())
+        print(f"Responses by status: {dict(sorted(statuses.items()))}")
+
+        with app.app_context():
+            errors = check_dispensers()
+            db.session.remove()
+            if args.db_uri:
+                # Leave a shared database as it was found
+                Dispenser.query.filter(Dispenser.id.in_(dispenser_ids)).update(
+                    {"open_transaction_id": None}
+                )
+                Transaction.query.filter(
+                    Transaction.dispenser_id.in_(dispenser_ids)
+                ).delete()
+                Dispenser.query.filter(Dispenser.id.in_(dispenser_ids)).delete()
+                db.session.commit()
+
+    for error in errors:
+        print(error)
+
+    if errors or set(statuses) - {200, 400}:
+        sys.exit(1)
+
+    print("Every dispenser has at most one open transaction.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Gunicorn settings of the production server: `gunicorn wsgi:app`.
+
+Every setting can be overridden in the environment, see the Production section of
+the README.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+from dotenv import load_dotenv
+
+# The settings of the .env file, which the app loads as well, decide below
+load_dotenv()
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+
+# gevent serves every request of a worker on a greenlet, so the long-lived
+# /api/events streams do not hold a thread each as they would with gthread
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# The write-behind ingestion tracks the open taps in memory, in a single process
+if os.getenv("INGEST_MODE") == "write_behind":
+    workers = 1
+
+# Load the app once in the master, so that forked workers start right away. The
+# database is set up beforehand by `flask --app wsgi init-db`
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# An empty GUNICORN_ACCESS_LOG turns the access log off
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+errorlog = "-"
+
+# The workers share their Prometheus metrics through files in this directory. It
+# has to be set before prometheus_client is imported, i.e. before the app loads
+if workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+
+# The dispenser info cache and the open tap registry of a worker only see the
+# writes of the others through the version counter stored in the database
+if workers > 1:
+    if os.environ.setdefault("DISPENSER_CACHE_BACKEND", "database") == "local":
+        raise RuntimeError(
+            "DISPENSER_CACHE_BACKEND=local serves stale dispenser info with "
+            f"{workers} workers; use the database backend or GUNICORN_WORKERS=1"
+        )
+
+
+def make_psycopg2_green():
+    """Wait for psycopg2 queries on the gevent hub rather than blocking the worker."""
+    try:
+        import psycopg2
+        from psycopg2 import extensions
+    except ImportError:
+        return
+
+    from gevent.socket import wait_read, wait_write
+
+    def wait(connection, timeout=None):
+        while True:
+            state = connection.poll()
+            if state == extensions.POLL_OK:
+                return
+            if state == extensions.POLL_READ:
+                wait_read(connection.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(connection.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f"Bad poll state: {state}")
+
+    extensions.set_wait_callback(wait)
+
+
+def on_starting(server):
+    # Drop the metrics files left by a previous run
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # Connections opened by the master while preloading must not be shared with
+    # the workers; each worker opens its own
+    from app.models import db
+
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+if worker_class == "gevent":
+    # Patched before the app is preloaded, so that the locks and conditions it
+    # creates at import time yield to the other greenlets instead of blocking
+    from gevent import monkey
+
+    monkey.patch_all()
+    make_psycopg2_green()
@@ -1,10 +1,19 @@
 #!/bin/bash
 
-while true
-do
-    BASE_URL="http://localhost:5000/api"
-    DISPENSERS=$(curl -s "${BASE_URL}/dispenser")
+BASE_URL="${BASE_URL:-http://localhost:5000/api}"
+
+declare -A FLOW_VOLUMES PRICES STATUSES LAST_POURS
+
+load_dispensers() {
+    while read -r id flow_volume price is_open
+    do
+        FLOW_VOLUMES[$id]=$flow_volume
+        PRICES[$id]=$price
+        STATUSES[$id]=$(if [ "$is_open" = "true" ]; then echo "Open"; else echo "Closed"; fi)
+    done < <(curl -s "${BASE_URL}/$1" | jq -r '[.] | flatten | .[] | "\(.id) \(.flow_volume) \(.price) \(.is_open)"')
+}
 
+render() {
     clear
 
     heading="Dispenser Monitoring"
@@ -15,25 +24,57 @@ do
     printf "%*s\n" $heading_center "$heading"
     echo "=============================================================================================="
 
-    DISPENSER_COUNT=$(echo "${DISPENSERS}" | jq length)
-    COLUMNS=1
-
-    for ((i = 0; i < DISPENSER_COUNT; i += COLUMNS))
+    for id in $(printf "%s\n" "${!STATUSES[@]}" | sort -n)
     do
-        for ((j = 0; j < COLUMNS && (i + j) < DISPENSER_COUNT; j++))
-        do
-            INDEX=$((i + j))
-            DISPENSER=$(echo "${DISPENSERS}" | jq -r ".[${INDEX}]")
-
-            id=$(echo "${DISPENSER}" | jq -r '.id')
-            flow_volume=$(echo "${DISPENSER}" | jq -r '.flow_volume')
-            price=$(echo "${DISPENSER}" | jq -r '.price')
-            is_open=$(echo "${DISPENSER}" | jq -r '.is_open')
-
-            printf "Dispenser ID: %-8s | Flow Volume: %-8sL/s | Price: \$%-6s | Status: %s\n" "${id}" "${flow_volume}" "${price}" "$(if [ "$is_open" = "true" ]; then echo "Open"; else echo "Closed"; fi)"
-        done
+        printf "Dispenser ID: %-8s | Flow Volume: %-8sL/s | Price: \$%-6s | Status: %-6s | %s\n" "${id}" "${FLOW_VOLUMES[$id]}" "${PRICES[$id]}" "${STATUSES[$id]}" "${LAST_POURS[$id]}"
         echo "----------------------------------------------------------------------------------------------"
     done
+}
+
+LAST_EVENT_ID=""
+
+# Follow the server-sent dispenser events instead of polling the dispenser list,
+# resuming from the last event seen whenever the stream drops
+while true
+do
+    HEADERS=()
+    if [ -n "${LAST_EVENT_ID}" ]; then
+        HEADERS=(-H "Last-Event-ID: ${LAST_EVENT_ID}")
+    fi
+
+    while IFS= read -r line
+    do
+        line=${line%$'\r'}
+
+        case "${line}" in
+            retry:*)
+                # The stream is connected, so no change can be missed from here on
+                if [ -z "${LAST_EVENT_ID}" ]; then
+                    load_dispensers "dispenser"
+                    render
+                fi
+                ;;
+            id:*)
+                LAST_EVENT_ID=${line#id: }
+                ;;
+            data:*)
+                read -r type id amount cost < <(echo "${line#data: }" | jq -r '"\(.type) \(.dispenser_id) \(.amount) \(.cost)"')
+
+                if [ -z "${STATUSES[$id]}" ]; then
+                    load_dispensers "dispenser/${id}"
+                fi
+
+                if [ "${type}" = "open" ]; then
+                    STATUSES[$id]="Open"
+                else
+                    STATUSES[$id]="Closed"
+                    LAST_POURS[$id]=$(printf "Last pour: %.2fL \$%.2f" "${amount}" "${cost}")
+                fi
+
+                render
+                ;;
+        esac
+    done < <(curl -sN "${HEADERS[@]}" "${BASE_URL}/events")
 
-    sleep 5
-done
\ No newline at end of file
+    sleep 1
+done
@@ -1,18 +1,34 @@
 import pytest
-from app import app
-from app.models import db, Admin, Dispenser, Transaction
+from sqlalchemy import event
+from app import create_app
+from app.ratelimit import tap_limiter
+from app.models import (
+    db,
+    Admin,
+    Dispenser,
+    Transaction,
+    ArchivedTransaction,
+    DispenserEvent,
+    DispenserRollup,
+    IdempotencyRecord,
+)
 from flask_jwt_extended import create_access_token
 
 
 @pytest.fixture(scope="session")
-def test_setup():
-    app.testing = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///test_data.db"
-    app.config["JWT_SECRET_KEY"] = "test_secret_key"
-    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = False
+def app():
+    return create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///test_data.db",
+            "JWT_SECRET_KEY": "test_secret_key",
+            "JWT_ACCESS_TOKEN_EXPIRES": False,
+        }
+    )
 
-    db.init_app(app)
 
+@pytest.fixture(scope="session")
+def test_setup(app):
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
@@ -33,4 +49,28 @@ def test_teardown(test_setup):
     yield
     db.session.query(Dispenser).delete()
     db.session.query(Transaction).delete()
+    db.session.query(ArchivedTransaction).delete()
+    db.session.query(DispenserEvent).delete()
+    db.session.query(DispenserRollup).delete()
+    db.session.query(IdempotencyRecord).delete()
     db.session.commit()
+
+
+@pytest.fixture(scope="function")
+def sql_statements(test_setup):
+    _, db, _ = test_setup
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record_statement)
+    yield statements
+    event.remove(db.engine, "before_cursor_execute", record_statement)
+
+
+@pytest.fixture(scope="function")
+def limits(app):
+    yield tap_limiter
+    # Back to the limits of the configuration, i.e. none
+    tap_limiter.init_app(app)
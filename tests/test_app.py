@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import pytest
+
+from app.models import Admin
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestApp:
+    def test_creating_the_app_does_not_touch_the_database(self, tmp_path):
+        db_path = tmp_path / "untouched.db"
+        environment = {**os.environ, "DB_URI": f"sqlite:///{db_path}"}
+
+        subprocess.run(
+            [sys.executable, "-c", "from app import create_app; create_app()"],
+            env=environment,
+            check=True,
+        )
+
+        assert not db_path.exists()
+
+    def test_init_db_creates_the_admin_once(self, app, test_setup, monkeypatch):
+        _, db, _ = test_setup
+        monkeypatch.setitem(app.config, "ADMIN_USERNAME", "init_db_admin")
+        monkeypatch.setitem(app.config, "ADMIN_PASSWORD", "password")
+        runner = app.test_cli_runner()
+
+        try:
+            created = runner.invoke(args=["init-db"])
+            existing = runner.invoke(args=["init-db"])
+        finally:
+            Admin.query.filter_by(username="init_db_admin").delete()
+            db.session.commit()
+
+        assert "Admin user created." in created.output
+        assert "Admin user already exists." in existing.output
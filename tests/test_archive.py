@@ -0,0 +1,92 @@
+import pytest
+import json
+
+from app.archive import archive_transactions
+from app.models import (
+    Dispenser,
+    Transaction,
+    ArchivedTransaction,
+    check_dispenser_aggregates,
+)
+from app.rollup import rebuild_rollups, get_rollups
+from datetime import datetime, timedelta
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestArchive:
+    def add_transactions(self, db):
+        dispenser = Dispenser(flow_volume=1.0, price=2.0)
+        db.session.add(dispenser)
+        db.session.flush()
+
+        now = datetime.utcnow().replace(microsecond=0)
+        # Two pours a year ago, one yesterday and the pour in progress
+        starts = [now - timedelta(days=365, hours=i) for i in (1, 0)]
+        starts.append(now - timedelta(days=1))
+        for start in starts:
+            db.session.add(
+                Transaction(
+                    dispenser_id=dispenser.id,
+                    start_time=start,
+                    end_time=start + timedelta(seconds=10),
+                    amount=10.0,
+                    revenue=20.0,
+                )
+            )
+
+        dispenser.record_closed_transaction(30.0, 60.0, count=3)
+        db.session.add(Transaction(dispenser_id=dispenser.id, start_time=now))
+        dispenser.is_open = True
+        db.session.commit()
+
+        return dispenser, now
+
+    def test_old_transactions_are_moved_in_batches(self, test_setup):
+        _, db, _ = test_setup
+        dispenser, now = self.add_transactions(db)
+
+        assert archive_transactions(now - timedelta(days=90), batch_size=1) == 2
+        assert archive_transactions(now - timedelta(days=90)) == 0
+
+        assert Transaction.query.count() == 2
+        assert ArchivedTransaction.query.count() == 2
+        assert check_dispenser_aggregates() == []
+
+        rebuild_rollups()
+        [series] = get_rollups(
+            "day", start=now - timedelta(days=366), end=now - timedelta(days=364)
+        )
+        assert sum(bucket["transactions"] for bucket in series["buckets"]) == 2
+
+    def test_statistics_and_export_merge_the_archive(self, test_setup):
+        client, db, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        dispenser, now = self.add_transactions(db)
+        archive_transactions(now - timedelta(days=90))
+
+        response = client.get(f"/api/statistics/{dispenser.id}", headers=headers)
+        assert response.json["total_transactions"] == 4
+        assert len(response.json["transactions"]) == 4
+
+        year_ago = (now - timedelta(days=366)).isoformat()
+        response = client.get(
+            f"/api/statistics/{dispenser.id}",
+            headers=headers,
+            query_string={"from": year_ago, "limit": 1},
+        )
+        assert response.json["total_transactions"] == 4
+        assert len(response.json["transactions"]) == 1
+
+        response = client.get(
+            f"/api/statistics/{dispenser.id}",
+            headers=headers,
+            query_string={"from": (now - timedelta(days=2)).isoformat()},
+        )
+        assert response.json["total_transactions"] == 2
+
+        response = client.get("/api/export/transactions", headers=headers)
+        ids = [
+            json.loads(line)["transaction_id"] for line in response.text.splitlines()
+        ]
+        assert len(ids) == 4
+        assert ids == sorted(ids)
@@ -0,0 +1,204 @@
+import pytest
+import asyncio
+import json
+
+from app.asgi import create_asgi_app
+from app.cache import dispenser_cache, DatabaseVersionBackend, LocalVersionBackend
+from app.models import Dispenser, DispenserRollup
+
+
+@pytest.fixture(scope="module")
+def asgi_app(app):
+    asgi_app = create_asgi_app(app)
+    yield asgi_app
+    asyncio.run(asgi_app.state.engine.dispose())
+
+
+def call(asgi_app, method, path, headers=None, query_string=""):
+    """Send a request to asgi_app, returning (status, headers, body)."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query_string.encode(),
+        "headers": [
+            (name.lower().encode(), value.encode())
+            for name, value in (headers or {}).items()
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+
+    start = messages[0]
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+
+    return start["status"], headers, body
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestAsgi:
+    def add_dispenser(self, db):
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        return dispenser.id
+
+    def test_taps_answer_like_the_flask_routes(self, test_setup, asgi_app):
+        client, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        info_path = f"/api/dispenser/{dispenser_id}"
+
+        status, headers, body = call(asgi_app, "GET", info_path)
+        assert status == 200
+        assert body == client.get(info_path).data
+        status, _, _ = call(
+            asgi_app, "GET", info_path, {"If-None-Match": headers["etag"]}
+        )
+        assert status == 304
+
+        status, _, body = call(asgi_app, "POST", f"{info_path}/open")
+        assert (status, json.loads(body)) == (
+            200,
+            {"message": "Dispenser opened successfully"},
+        )
+        assert call(asgi_app, "POST", f"{info_path}/open")[0] == 400
+        assert json.loads(call(asgi_app, "GET", info_path)[2])["is_open"] is True
+
+        status, _, body = call(asgi_app, "POST", f"{info_path}/close")
+        assert status == 200
+        assert json.loads(body)["message"] == "Dispenser closed successfully"
+        assert call(asgi_app, "POST", f"{info_path}/close")[0] == 400
+        assert call(asgi_app, "POST", "/api/dispenser/0/close")[0] == 404
+
+        db.session.expire_all()
+        dispenser = db.session.get(Dispenser, dispenser_id)
+        assert (dispenser.is_open, dispenser.closed_transactions) == (False, 1)
+        assert DispenserRollup.query.filter_by(dispenser_id=dispenser_id).count() == 3
+        _, _, body = call(asgi_app, "GET", "/api/dispenser")
+        assert body == client.get("/api/dispenser").data
+
+    def test_taps_are_rate_limited(self, test_setup, asgi_app, limits):
+        _, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        limits.dispenser_limit = (0.5, 1)
+
+        assert call(asgi_app, "POST", f"/api/dispenser/{dispenser_id}/open")[0] == 200
+        status, headers, body = call(
+            asgi_app, "POST", f"/api/dispenser/{dispenser_id}/close"
+        )
+        assert (status, headers["retry-after"]) == (429, "2")
+        assert json.loads(body)["message"] == "Too many requests, try again later"
+
+    def test_clients_behind_a_trusted_proxy(self, app, test_setup, limits, monkeypatch):
+        _, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        limits.client_limit = (0.01, 1)
+        info_path = f"/api/dispenser/{dispenser_id}"
+
+        monkeypatch.setitem(app.config, "TRUSTED_PROXIES", 1)
+        proxied_app = create_asgi_app(app)
+
+        try:
+            for address, status in (
+                ("10.0.0.1", 200),
+                ("10.0.0.1", 429),
+                ("172.16.0.1, 10.0.0.2", 400),
+            ):
+                headers = {"X-Forwarded-For": address}
+                assert (
+                    call(proxied_app, "POST", f"{info_path}/open", headers)[0] == status
+                )
+
+            # Same key, other client: served, not replayed
+            headers = {"X-Forwarded-For": "10.0.0.3", "Idempotency-Key": "proxied"}
+            call(proxied_app, "POST", f"{info_path}/close", headers)
+            headers["X-Forwarded-For"] = "10.0.0.4"
+            status, headers, _ = call(
+                proxied_app, "POST", f"{info_path}/close", headers
+            )
+            assert status == 400
+            assert "idempotent-replayed" not in headers
+        finally:
+            asyncio.run(proxied_app.state.engine.dispose())
+
+    def test_taps_with_the_database_cache_backend(self, test_setup, asgi_app):
+        _, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        info_path = f"/api/dispenser/{dispenser_id}"
+
+        dispenser_cache.backend = DatabaseVersionBackend()
+        try:
+            version = dispenser_cache.backend.current()
+            # The version is bumped on the single connection of the SQLite pool,
+            # by the transaction opening the tap
+            assert call(asgi_app, "POST", f"{info_path}/open")[0] == 200
+            assert dispenser_cache.backend.current() == version + 1
+            assert json.loads(call(asgi_app, "GET", info_path)[2])["is_open"] is True
+            assert call(asgi_app, "POST", f"{info_path}/close")[0] == 200
+            assert dispenser_cache.backend.current() == version + 2
+        finally:
+            dispenser_cache.backend = LocalVersionBackend()
+
+    def test_retried_taps_are_replayed(self, test_setup, asgi_app):
+        client, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        client.post(f"/api/dispenser/{dispenser_id}/open")
+        path = f"/api/dispenser/{dispenser_id}/close"
+        headers = {"Idempotency-Key": "asgi-close"}
+
+        status, _, body = call(asgi_app, "POST", path, headers)
+        assert status == 200
+        status, headers, retry_body = call(asgi_app, "POST", path, headers)
+        assert (status, retry_body) == (200, body)
+        assert headers["idempotent-replayed"] == "true"
+
+    def test_statistics_require_a_token(self, test_setup, asgi_app):
+        client, db, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        dispenser_id = self.add_dispenser(db)
+        client.post(f"/api/dispenser/{dispenser_id}/open")
+        client.post(f"/api/dispenser/{dispenser_id}/close")
+
+        assert call(asgi_app, "GET", "/api/statistics")[0] == 401
+        status, _, _ = call(asgi_app, "GET", "/api/statistics", {"Authorization": "x"})
+        assert status == 401
+        status, _, _ = call(
+            asgi_app, "GET", "/api/statistics", {"Authorization": "Bearer x"}
+        )
+        assert status == 422
+
+        path = f"/api/statistics/{dispenser_id}"
+        status, _, body = call(asgi_app, "GET", path, headers)
+        assert status == 200
+        assert body == client.get(path, headers=headers).data
+
+        status, _, body = call(asgi_app, "GET", path, headers, "limit=0")
+        assert status == 400
+
+    def test_other_routes_are_served_by_flask(self, test_setup, asgi_app):
+        _, _, test_jwt = test_setup
+
+        status, _, body = call(
+            asgi_app,
+            "GET",
+            "/api/statistics/rollup",
+            {"Authorization": f"Bearer {test_jwt}"},
+        )
+        assert status == 200
+        assert json.loads(body)["series"] == []
@@ -1,5 +1,15 @@
 import pytest
+import inspect
 import json
+import threading
+import time
+
+from app.auth import admin_cache, verified_tokens
+from app.models import Admin
+from app.passwords import password_hasher
+from datetime import timedelta
+from flask_jwt_extended import JWTManager, create_access_token
+from prometheus_client import REGISTRY
 
 
 @pytest.mark.usefixtures("test_setup", "test_teardown")
@@ -26,3 +36,99 @@ class TestAuth:
         data = response.get_json()
 
         assert response.status_code == 401
+
+    def test_verified_tokens_expire(self, test_setup):
+        client, _, _ = test_setup
+
+        # exp is truncated to whole seconds, so the token lives at least 1 second
+        with client.application.app_context():
+            token = create_access_token(identity=1, expires_delta=timedelta(seconds=2))
+        headers = {"Authorization": f"Bearer {token}"}
+
+        hits = verified_tokens.hits
+        assert client.get("/api/statistics", headers=headers).status_code == 200
+        assert client.get("/api/statistics", headers=headers).status_code == 200
+        assert verified_tokens.hits == hits + 1
+
+        time.sleep(2.1)
+        assert client.get("/api/statistics", headers=headers).status_code == 401
+
+    def test_cache_lookups_are_exported(self, test_setup):
+        client, _, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+
+        def lookups(cache, result):
+            labels = {"cache": cache, "result": result}
+            return REGISTRY.get_sample_value("cache_lookups_total", labels) or 0.0
+
+        client.get("/api/statistics", headers=headers)
+        hits = lookups("jwt", "hit"), lookups("admin", "hit")
+        client.get("/api/statistics", headers=headers)
+
+        assert lookups("jwt", "hit") == hits[0] + 1
+        assert lookups("admin", "hit") == hits[1] + 1
+        assert "cache_lookups_total" in client.get("/metrics").get_data(True)
+
+    def test_deleted_admin_is_rejected(self, test_setup):
+        client, db, _ = test_setup
+
+        admin = Admin(username="short_lived", password="password")
+        db.session.add(admin)
+        db.session.commit()
+        token = create_access_token(identity=admin.id)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        assert client.get("/api/statistics", headers=headers).status_code == 200
+        assert admin_cache.get(admin.id) is not None
+
+        db.session.delete(admin)
+        db.session.commit()
+
+        assert admin_cache.get(admin.id) is None
+        assert client.get("/api/statistics", headers=headers).status_code == 401
+
+    def test_login_rehashes_when_cost_changes(self, test_setup, monkeypatch):
+        client, db, _ = test_setup
+
+        admin = Admin(username="rehashed", password="password")
+        db.session.add(admin)
+        db.session.commit()
+        assert admin.password_hash.startswith(b"$2b$12$")
+
+        monkeypatch.setattr(password_hasher, "rounds", 4)
+        response = client.post(
+            "/auth/login", json={"username": "rehashed", "password": "password"}
+        )
+        assert response.status_code == 200
+
+        db.session.expire_all()
+        assert admin.password_hash.startswith(b"$2b$04$")
+        assert admin.check_password("password")
+
+        db.session.delete(admin)
+        db.session.commit()
+
+    def test_login_rejected_when_bcrypt_pool_is_full(self, test_setup, monkeypatch):
+        client, _, _ = test_setup
+
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        monkeypatch.setattr(password_hasher, "_slots", slots)
+
+        response = client.post(
+            "/auth/login", json={"username": "test_user", "password": "test_password"}
+        )
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+
+
+def test_overridden_decode_method_is_unchanged():
+    # CachingJWTManager overrides this private method of flask-jwt-extended
+    parameters = inspect.signature(JWTManager._decode_jwt_from_config).parameters
+
+    assert list(parameters) == [
+        "self",
+        "encoded_token",
+        "csrf_value",
+        "allow_expired",
+    ]
@@ -0,0 +1,108 @@
+import pytest
+
+from app.models import (
+    Dispenser,
+    Transaction,
+    DispenserEvent,
+    check_dispenser_aggregates,
+)
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestBulkDispensers:
+    def test_create_dispensers_reports_each_item(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.post(
+            "api/dispenser/bulk",
+            headers=headers,
+            json={
+                "dispensers": [
+                    {"flow_volume": 0.5, "price": 2.0},
+                    {"flow_volume": 0.5},
+                    {"flow_volume": 0.1, "price": 3.0},
+                ]
+            },
+        )
+        assert response.status_code == 200
+
+        results = response.json["results"]
+        assert [result["status"] for result in results] == [201, 400, 201]
+        assert Dispenser.query.count() == 2
+        assert db.session.get(Dispenser, results[2]["id"]).price == 3.0
+
+    def test_create_dispensers_requires_auth_and_a_list(self, test_setup):
+        client, _, test_jwt = test_setup
+
+        response = client.post(
+            "api/dispenser/bulk", json={"dispensers": [{"flow_volume": 1, "price": 1}]}
+        )
+        assert response.status_code == 401
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.post(
+            "api/dispenser/bulk", headers=headers, json={"dispensers": []}
+        )
+        assert response.status_code == 400
+
+    def test_open_and_close_dispensers(self, test_setup):
+        client, db, _ = test_setup
+
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(3)]
+        db.session.add_all(dispensers)
+        db.session.commit()
+        ids = [dispenser.id for dispenser in dispensers]
+        missing_id = max(ids) + 1
+
+        client.post(f"api/dispenser/{ids[0]}/open")
+
+        response = client.post(
+            "api/dispenser/bulk/open",
+            json={"dispenser_ids": ids + [missing_id, ids[1]]},
+        )
+        assert response.status_code == 200
+        assert [result["status"] for result in response.json["results"]] == [
+            400,
+            200,
+            200,
+            404,
+            400,
+        ]
+
+        db.session.expire_all()
+        assert all(
+            db.session.get(Dispenser, dispenser_id).is_open for dispenser_id in ids
+        )
+        assert Transaction.query.filter(Transaction.end_time.is_(None)).count() == 3
+
+        response = client.post(
+            "api/dispenser/bulk/close", json={"dispenser_ids": ids[:2]}
+        )
+        assert response.status_code == 200
+        results = response.json["results"]
+        assert [result["status"] for result in results] == [200, 200]
+        assert all(result["amount"] >= 0 for result in results)
+
+        response = client.post("api/dispenser/bulk/close", json={"dispenser_ids": ids})
+        assert [result["status"] for result in response.json["results"]] == [
+            400,
+            400,
+            200,
+        ]
+
+        db.session.expire_all()
+        assert not any(
+            db.session.get(Dispenser, dispenser_id).is_open for dispenser_id in ids
+        )
+        assert db.session.get(Dispenser, ids[0]).closed_transactions == 1
+        assert check_dispenser_aggregates() == []
+        assert DispenserEvent.query.filter_by(event_type="open").count() == 3
+        assert DispenserEvent.query.filter_by(event_type="close").count() == 3
+
+    def test_open_dispensers_rejects_invalid_ids(self, test_setup):
+        client, _, _ = test_setup
+
+        for body in ({}, {"dispenser_ids": []}, {"dispenser_ids": ["1"]}):
+            response = client.post("api/dispenser/bulk/open", json=body)
+            assert response.status_code == 400
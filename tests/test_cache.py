@@ -0,0 +1,91 @@
+import pytest
+
+from app.cache import dispenser_cache, DatabaseVersionBackend, LocalVersionBackend
+from app.models import Dispenser, CacheVersion
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestDispenserCache:
+    def test_repeated_reads_are_served_from_cache(self, test_setup, sql_statements):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        first = client.get("api/dispenser")
+        sql_statements.clear()
+        second = client.get("api/dispenser")
+
+        assert second.status_code == 200
+        assert second.data == first.data
+        assert second.json[0]["id"] == dispenser.id
+        assert sql_statements == []
+
+    def test_if_none_match_returns_not_modified(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        response = client.get(f"api/dispenser/{dispenser.id}")
+        etag = response.headers["ETag"]
+
+        response = client.get(
+            f"api/dispenser/{dispenser.id}", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.data == b""
+
+        client.post(f"api/dispenser/{dispenser.id}/open")
+
+        response = client.get(
+            f"api/dispenser/{dispenser.id}", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.json["is_open"] is True
+        assert response.headers["ETag"] != etag
+
+    def test_create_open_and_close_invalidate(self, test_setup):
+        client, _, test_jwt = test_setup
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        assert client.get("api/dispenser").json == []
+
+        dispenser_id = client.post(
+            "api/dispenser", headers=headers, json={"flow_volume": 0.5, "price": 2.0}
+        ).json["id"]
+        assert [d["id"] for d in client.get("api/dispenser").json] == [dispenser_id]
+
+        client.post(f"api/dispenser/{dispenser_id}/open")
+        assert client.get("api/dispenser").json[0]["is_open"] is True
+
+        client.post(f"api/dispenser/{dispenser_id}/close")
+        assert client.get("api/dispenser").json[0]["is_open"] is False
+
+    def test_database_backend_sees_other_workers_writes(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser_cache.backend = DatabaseVersionBackend()
+        try:
+            dispenser = Dispenser(flow_volume=0.5, price=2.0)
+            db.session.add(dispenser)
+            db.session.commit()
+
+            assert client.get("api/dispenser").json[0]["price"] == 2.0
+
+            # Another worker writes through its own connection, so this
+            # process only learns about it from the shared version
+            with db.engine.begin() as connection:
+                connection.execute(db.update(Dispenser).values(price=3.0))
+            assert client.get("api/dispenser").json[0]["price"] == 2.0
+
+            with db.engine.begin() as connection:
+                connection.execute(
+                    db.update(CacheVersion).values(version=CacheVersion.version + 1)
+                )
+            db.session.expire_all()
+            assert client.get("api/dispenser").json[0]["price"] == 3.0
+        finally:
+            dispenser_cache.backend = LocalVersionBackend()
@@ -0,0 +1,91 @@
+import pytest
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.models import Dispenser, Transaction, check_dispenser_aggregates
+
+THREADS = 8
+ITERATIONS = 40
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestConcurrency:
+    @pytest.fixture(autouse=True)
+    def wal_mode(self, test_setup):
+        _, db, _ = test_setup
+
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    def test_simultaneous_opens_create_one_transaction(self, app, test_setup):
+        _, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+        dispenser_id = dispenser.id
+        barrier = threading.Barrier(THREADS)
+
+        def open_tap(_):
+            with app.test_client() as client:
+                barrier.wait()
+                return client.post(f"api/dispenser/{dispenser_id}/open").status_code
+
+        with ThreadPoolExecutor(THREADS) as executor:
+            statuses = list(executor.map(open_tap, range(THREADS)))
+
+        assert sorted(statuses) == [200] + [400] * (THREADS - 1)
+
+        db.session.expire_all()
+        open_transactions = Transaction.query.filter_by(
+            dispenser_id=dispenser_id, end_time=None
+        ).all()
+        assert len(open_transactions) == 1
+        assert dispenser.open_transaction_id == open_transactions[0].id
+
+    def test_interleaved_open_close_stay_consistent(self, app, test_setup):
+        _, db, _ = test_setup
+
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(3)]
+        db.session.add_all(dispensers)
+        db.session.commit()
+        dispenser_ids = [dispenser.id for dispenser in dispensers]
+
+        def tap(worker):
+            rng = random.Random(worker)
+            statuses = []
+
+            with app.test_client() as client:
+                for _ in range(ITERATIONS):
+                    dispenser_id = rng.choice(dispenser_ids)
+                    action = rng.choice(["open", "close"])
+                    response = client.post(f"api/dispenser/{dispenser_id}/{action}")
+                    statuses.append(response.status_code)
+
+            return statuses
+
+        with ThreadPoolExecutor(THREADS) as executor:
+            statuses = [
+                status
+                for result in executor.map(tap, range(THREADS))
+                for status in result
+            ]
+
+        assert set(statuses) <= {200, 400}
+
+        db.session.expire_all()
+        for dispenser in Dispenser.query.all():
+            open_transactions = Transaction.query.filter_by(
+                dispenser_id=dispenser.id, end_time=None
+            ).all()
+
+            if dispenser.is_open:
+                assert [t.id for t in open_transactions] == [
+                    dispenser.open_transaction_id
+                ]
+            else:
+                assert open_transactions == []
+                assert dispenser.open_transaction_id is None
+
+        assert check_dispenser_aggregates() == []
@@ -0,0 +1,23 @@
+import pytest
+
+from app.database import get_engine_options
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestDatabase:
+    def test_engine_options_from_environment(self, monkeypatch):
+        monkeypatch.setenv("DB_POOL_SIZE", "20")
+        monkeypatch.setenv("DB_POOL_PRE_PING", "true")
+        monkeypatch.setenv("DB_POOL_RECYCLE", "")
+
+        assert get_engine_options() == {"pool_size": 20, "pool_pre_ping": True}
+
+    def test_sqlite_pragmas(self, test_setup):
+        _, db, _ = test_setup
+
+        with db.engine.connect() as connection:
+            journal_mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+            busy_timeout = connection.exec_driver_sql("PRAGMA busy_timeout").scalar()
+
+        assert journal_mode == "wal"
+        assert busy_timeout == 5000
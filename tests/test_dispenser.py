@@ -1,7 +1,7 @@
 import pytest
 
-from app.models import Dispenser, Transaction
-from datetime import datetime
+from app.models import Dispenser, Transaction, repair_dispenser_state
+from datetime import datetime, timedelta
 
 
 @pytest.mark.usefixtures("test_setup", "test_teardown")
@@ -175,3 +175,74 @@ class TestDispenser:
         response = client.post(f"api/dispenser/{dispenser.id}/close")
         assert response.status_code == 400
         assert "Dispenser is already closed" in response.json["message"]
+
+    def test_open_and_close_track_open_transaction(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        client.post(f"api/dispenser/{dispenser.id}/open")
+        dispenser = db.session.get(Dispenser, dispenser.id)
+        transaction = db.session.get(Transaction, dispenser.open_transaction_id)
+        assert transaction.dispenser_id == dispenser.id
+        assert transaction.end_time is None
+
+        response = client.post(f"api/dispenser/{dispenser.id}/close")
+        assert response.status_code == 200
+
+        db.session.expire_all()
+        assert dispenser.open_transaction_id is None
+        assert transaction.end_time is not None
+        assert transaction.amount == response.json["amount"]
+
+    def test_repair_dispenser_state(self, test_setup):
+        _, db, _ = test_setup
+
+        closed_with_open_transaction = Dispenser(flow_volume=1.0, price=2.0)
+        open_without_transaction = Dispenser(flow_volume=1.0, price=2.0)
+        open_with_two_transactions = Dispenser(flow_volume=1.0, price=2.0)
+        consistent = Dispenser(flow_volume=1.0, price=2.0)
+        db.session.add_all(
+            [
+                closed_with_open_transaction,
+                open_without_transaction,
+                open_with_two_transactions,
+                consistent,
+            ]
+        )
+        db.session.flush()
+
+        start = datetime(2023, 7, 14, 10, 0, 0)
+        orphan = Transaction(closed_with_open_transaction.id, start)
+        stale = Transaction(open_with_two_transactions.id, start)
+        latest = Transaction(
+            open_with_two_transactions.id, start + timedelta(seconds=10)
+        )
+        db.session.add_all([orphan, stale, latest])
+        open_without_transaction.is_open = True
+        open_with_two_transactions.is_open = True
+        db.session.commit()
+
+        repaired = repair_dispenser_state()
+
+        assert sorted(repaired) == sorted(
+            [
+                closed_with_open_transaction.id,
+                open_without_transaction.id,
+                open_with_two_transactions.id,
+            ]
+        )
+
+        assert closed_with_open_transaction.is_open is True
+        assert closed_with_open_transaction.open_transaction_id == orphan.id
+        assert open_without_transaction.is_open is False
+        assert open_without_transaction.open_transaction_id is None
+        assert open_with_two_transactions.open_transaction_id == latest.id
+        assert stale.end_time == latest.start_time
+        assert stale.amount == 10.0
+        assert open_with_two_transactions.closed_transactions == 1
+        assert open_with_two_transactions.closed_revenue == 20.0
+
+        assert repair_dispenser_state() == []
@@ -0,0 +1,132 @@
+import pytest
+import json
+import threading
+from datetime import datetime, timedelta
+
+from app.events import prune_dispenser_events
+from app.models import Dispenser, DispenserEvent, Transaction
+
+
+def read_event(chunks):
+    for chunk in chunks:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith((":", "retry:")):
+            continue
+
+        fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+        return int(fields["id"]), fields["event"], json.loads(fields["data"])
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestEvents:
+    def test_stream_resumes_after_last_event_id(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        client.post(f"api/dispenser/{dispenser.id}/open")
+        closed = client.post(f"api/dispenser/{dispenser.id}/close").json
+        client.post(f"api/dispenser/{dispenser.id}/open")
+        first_id = db.session.query(db.func.min(DispenserEvent.id)).scalar()
+
+        response = client.get(
+            "api/events",
+            headers={"Last-Event-ID": str(first_id)},
+            buffered=False,
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+
+        chunks = iter(response.response)
+        try:
+            event_id, event_type, data = read_event(chunks)
+            assert event_id == first_id + 1
+            assert event_type == "close"
+            assert data["dispenser_id"] == dispenser.id
+            assert data["amount"] == closed["amount"]
+            assert data["cost"] == closed["cost"]
+            assert data["end_time"] is not None
+
+            event_id, event_type, data = read_event(chunks)
+            assert event_id == first_id + 2
+            assert event_type == "open"
+            assert data["amount"] is None
+        finally:
+            response.close()
+
+    def test_stream_delivers_new_events(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+        dispenser_id = dispenser.id
+        last_id = db.session.query(db.func.max(DispenserEvent.id)).scalar() or 0
+
+        response = client.get(
+            "api/events", headers={"Last-Event-ID": str(last_id)}, buffered=False
+        )
+        chunks = iter(response.response)
+        received = []
+        listener = threading.Thread(target=lambda: received.append(read_event(chunks)))
+        listener.start()
+
+        try:
+            client.post(f"api/dispenser/{dispenser_id}/open")
+            listener.join(timeout=5)
+
+            assert not listener.is_alive()
+            [(event_id, event_type, data)] = received
+            assert event_id > last_id
+            assert event_type == "open"
+            assert data["dispenser_id"] == dispenser_id
+        finally:
+            response.close()
+
+    def test_old_events_are_pruned(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        now = datetime.utcnow()
+        poured = now - timedelta(days=2, seconds=10)
+        for start_time, end_time in (
+            (poured, now - timedelta(days=2)),
+            (poured, None),
+            (now - timedelta(seconds=10), now),
+        ):
+            transaction = Transaction(dispenser.id, start_time, end_time)
+            db.session.add(transaction)
+            db.session.flush()
+            event_type = "open" if end_time is None else "close"
+            db.session.add(DispenserEvent(event_type, transaction))
+        db.session.commit()
+        old_close_id, old_open_id, recent_id = [
+            event.id for event in DispenserEvent.query.order_by(DispenserEvent.id)
+        ]
+
+        # Events not read by the poller yet are kept, however old
+        assert prune_dispenser_events(now - timedelta(days=1), old_close_id) == 1
+        assert prune_dispenser_events(now - timedelta(days=1), recent_id) == 1
+
+        # A listener resuming from a pruned event gets the ones that are left
+        response = client.get(
+            "api/events",
+            headers={"Last-Event-ID": str(old_close_id - 1)},
+            buffered=False,
+        )
+        try:
+            event_id, _, _ = read_event(iter(response.response))
+            assert event_id == recent_id
+        finally:
+            response.close()
+
+    def test_invalid_last_event_id(self, test_setup):
+        client, _, _ = test_setup
+
+        response = client.get("api/events", headers={"Last-Event-ID": "abc"})
+        assert response.status_code == 400
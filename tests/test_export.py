@@ -0,0 +1,90 @@
+import pytest
+import json
+
+from app.models import Dispenser, Transaction
+from datetime import datetime, timedelta
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestExport:
+    def add_transactions(self, db):
+        dispenser1 = Dispenser(flow_volume=1.0, price=2.0)
+        dispenser2 = Dispenser(flow_volume=2.0, price=3.0)
+        db.session.add_all([dispenser1, dispenser2])
+        db.session.flush()
+
+        start = datetime(2023, 7, 14, 10, 0, 0)
+        for i, dispenser in enumerate([dispenser1, dispenser2, dispenser1]):
+            db.session.add(
+                Transaction(
+                    dispenser_id=dispenser.id,
+                    start_time=start + timedelta(hours=i),
+                    end_time=start + timedelta(hours=i, seconds=5),
+                    amount=5.0 * dispenser.flow_volume,
+                    revenue=5.0 * dispenser.flow_volume * dispenser.price,
+                )
+            )
+        db.session.commit()
+
+        return dispenser1, dispenser2
+
+    def test_export_ndjson(self, test_setup):
+        client, db, test_jwt = test_setup
+        self.add_transactions(db)
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get("/api/export/transactions", headers=headers)
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == "application/x-ndjson"
+
+        rows = [json.loads(line) for line in response.data.decode().splitlines()]
+        assert len(rows) == 3
+        assert rows[0]["start_time"] == "2023-07-14 10:00:00"
+        assert rows[0]["end_time"] == "2023-07-14 10:00:05"
+        assert rows[1]["amount"] == 10.0
+        assert rows[1]["revenue"] == 30.0
+
+    def test_export_csv_with_filters(self, test_setup):
+        client, db, test_jwt = test_setup
+        dispenser1, _ = self.add_transactions(db)
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get(
+            "/api/export/transactions",
+            headers=headers,
+            query_string={
+                "format": "csv",
+                "dispenser_id": dispenser1.id,
+                "from": "2023-07-14T11:00:00",
+            },
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+
+        lines = response.data.decode().splitlines()
+        assert (
+            lines[0] == "transaction_id,dispenser_id,start_time,end_time,amount,revenue"
+        )
+        assert len(lines) == 2
+        assert lines[1].split(",")[1:4] == [
+            str(dispenser1.id),
+            "2023-07-14 12:00:00",
+            "2023-07-14 12:00:05",
+        ]
+
+    def test_export_invalid_parameters(self, test_setup):
+        client, _, test_jwt = test_setup
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        for query in ({"format": "xml"}, {"dispenser_id": "one"}, {"to": "soon"}):
+            response = client.get(
+                "/api/export/transactions", headers=headers, query_string=query
+            )
+            assert response.status_code == 400
+
+    def test_export_requires_auth(self, test_setup):
+        client, _, _ = test_setup
+
+        response = client.get("/api/export/transactions")
+        assert response.status_code == 401
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+import pytest
+import runpy
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "gunicorn.conf.py")
+
+
+@pytest.fixture
+def environment(monkeypatch, tmp_path):
+    # Left alone by the configuration once set
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    monkeypatch.delenv("DISPENSER_CACHE_BACKEND", raising=False)
+    # gevent would monkeypatch the test process
+    monkeypatch.setenv("GUNICORN_WORKER_CLASS", "gthread")
+
+    return monkeypatch
+
+
+def test_several_workers_share_the_cache_version(environment):
+    environment.setenv("GUNICORN_WORKERS", "3")
+    runpy.run_path(CONFIG_PATH)
+    assert os.environ["DISPENSER_CACHE_BACKEND"] == "database"
+
+    environment.setenv("DISPENSER_CACHE_BACKEND", "local")
+    with pytest.raises(RuntimeError):
+        runpy.run_path(CONFIG_PATH)
+
+    environment.setenv("GUNICORN_WORKERS", "1")
+    assert runpy.run_path(CONFIG_PATH)["workers"] == 1
+
+
+def test_gevent_workers_by_default(environment):
+    environment.delenv("GUNICORN_WORKER_CLASS")
+    script = (
+        "import runpy\n"
+        "from gevent import monkey\n"
+        f"settings = runpy.run_path({CONFIG_PATH!r})\n"
+        "print(settings['worker_class'], monkey.is_module_patched('threading'))\n"
+    )
+
+    output = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    ).stdout
+
+    assert output.split() == ["gevent", "True"]
@@ -0,0 +1,134 @@
+import pytest
+from datetime import datetime, timedelta
+
+from app.idempotency import (
+    DatabaseIdempotencyBackend,
+    IdempotencyKeyError,
+    LocalIdempotencyBackend,
+    idempotency_store,
+)
+from app.models import Dispenser, IdempotencyRecord
+
+
+@pytest.fixture(scope="function")
+def store(app):
+    yield idempotency_store
+    idempotency_store.init_app(app)
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestIdempotency:
+    def add_dispenser(self, db):
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        return dispenser.id
+
+    def test_retried_close_is_replayed(self, test_setup, store, sql_statements):
+        client, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        client.post(f"/api/dispenser/{dispenser_id}/open")
+
+        path = f"/api/dispenser/{dispenser_id}/close"
+        headers = {"Idempotency-Key": "close-1"}
+        first = client.post(path, headers=headers)
+        del sql_statements[:]
+        retry = client.post(path, headers=headers)
+
+        assert sql_statements == []
+        assert (retry.status_code, retry.data) == (200, first.data)
+        assert retry.json["amount"] == first.json["amount"]
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert client.post(path).status_code == 400
+
+        response = client.post(f"/api/dispenser/{dispenser_id}/open", headers=headers)
+        assert response.status_code == 422
+
+    def test_bulk_requests_are_replayed(self, test_setup, store):
+        client, db, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}", "Idempotency-Key": "b-1"}
+        body = {"dispensers": [{"flow_volume": 0.5, "price": 2.0}]}
+
+        first = client.post("/api/dispenser/bulk", headers=headers, json=body)
+        retry = client.post("/api/dispenser/bulk", headers=headers, json=body)
+
+        assert retry.json == first.json
+        assert Dispenser.query.count() == 1
+
+    def test_database_backend_is_shared(self, test_setup, store, sql_statements):
+        client, db, _ = test_setup
+        dispenser_id = self.add_dispenser(db)
+        store.backend = DatabaseIdempotencyBackend(2**20)
+
+        path = f"/api/dispenser/{dispenser_id}/open"
+        first = client.post(path, headers={"Idempotency-Key": "open-1"})
+        # As seen by another worker
+        store.backend = DatabaseIdempotencyBackend(2**20)
+        del sql_statements[:]
+        retry = client.post(path, headers={"Idempotency-Key": "open-1"})
+
+        assert retry.data == first.data
+        assert len(sql_statements) == 1
+        assert "idempotency_record" in sql_statements[0]
+
+        # An expired response gives its key up
+        now = datetime.utcnow()
+        record = (b"x", 200, b"{}", now - timedelta(seconds=1))
+        store.backend.put("open-2", record, now - timedelta(days=1))
+        store.backend.put("open-2", (b"y", 200, b"{}", now + store.ttl), now)
+        assert db.session.get(IdempotencyRecord, "open-2").fingerprint == b"y"
+
+    def test_keys_belong_to_their_caller(self, test_setup, store):
+        client, db, test_jwt = test_setup
+        first, second = self.add_dispenser(db), self.add_dispenser(db)
+        headers = {"Idempotency-Key": "tap-1"}
+        other_client = {"REMOTE_ADDR": "10.0.0.2"}
+
+        opened = client.post(f"/api/dispenser/{first}/open", headers=headers)
+        response = client.post(
+            f"/api/dispenser/{second}/open", headers=headers, environ_base=other_client
+        )
+        assert response.status_code == 200
+        assert db.session.get(Dispenser, second).is_open is True
+        retry = client.post(f"/api/dispenser/{first}/open", headers=headers)
+        assert (retry.status_code, retry.data) == (200, opened.data)
+
+        # The same request, sent by another client, is served again
+        path = f"/api/dispenser/{first}/close"
+        headers["Idempotency-Key"] = "tap-2"
+        assert client.post(path, headers=headers).status_code == 200
+        response = client.post(path, headers=headers, environ_base=other_client)
+        assert response.status_code == 400
+        assert "Idempotent-Replayed" not in response.headers
+
+        # The requests of an admin are told apart from those of its address
+        headers["Authorization"] = f"Bearer {test_jwt}"
+        body = {"dispensers": [{"flow_volume": 0.5, "price": 2.0}]}
+        client.post("/api/dispenser/bulk", headers=headers, json=body)
+        assert Dispenser.query.count() == 3
+
+    def test_keys_are_claimed_until_finished(self, store):
+        assert store.start("10.0.0.1", "pending", b"x") is None
+
+        with pytest.raises(IdempotencyKeyError) as error:
+            store.start("10.0.0.1", "pending", b"x")
+        assert error.value.status == 409
+        assert store.start("10.0.0.2", "pending", b"x") is None
+
+        store.finish("10.0.0.1", "pending", b"x", 503, b"{}")
+        assert store.start("10.0.0.1", "pending", b"x") is None
+
+
+def test_local_backend_evicts_the_least_recently_used():
+    backend = LocalIdempotencyBackend(max_bytes=700)
+    now = datetime.utcnow()
+    later = now + timedelta(hours=1)
+
+    for key in ("a", "b", "c"):
+        backend.put(key, (b"", 200, b"{}", later), now)
+    backend.get("a", now)
+    backend.put("d", (b"", 200, b"{}", later), now)
+
+    assert [key for key in "abcd" if backend.get(key, now)] == ["a", "c", "d"]
+    assert backend.get("a", later) is None
@@ -0,0 +1,141 @@
+import json
+import pytest
+
+from app.ingest import TapIngestion, tap_ingestion
+from app.models import Dispenser, Transaction, DispenserEvent, IngestCheckpoint
+
+
+@pytest.fixture
+def write_behind(app, test_setup, tmp_path):
+    app.config["INGEST_MODE"] = "write_behind"
+    app.config["INGEST_LOG_PATH"] = str(tmp_path / "ingest.log")
+    app.config["INGEST_DEAD_LETTER_PATH"] = str(tmp_path / "ingest.dead.log")
+    yield tap_ingestion
+    tap_ingestion.stop()
+    app.config["INGEST_MODE"] = "sync"
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestWriteBehindIngestion:
+    def test_taps_are_acknowledged_and_written_in_batches(
+        self, test_setup, write_behind
+    ):
+        client, db, test_jwt = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+        dispenser_id = dispenser.id
+
+        response = client.post(f"api/dispenser/{dispenser_id}/open")
+        assert response.status_code == 200
+        assert client.post(f"api/dispenser/{dispenser_id}/open").status_code == 400
+
+        response = client.post(f"api/dispenser/{dispenser_id}/close")
+        assert response.status_code == 200
+        amount = response.json["amount"]
+        assert client.post(f"api/dispenser/{dispenser_id}/close").status_code == 400
+
+        # Statistics wait for the acknowledged events to reach the database
+        db.session.expire_all()
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get(f"api/statistics/{dispenser_id}", headers=headers)
+        assert response.status_code == 200
+        assert response.json["total_amount"] == amount
+        assert response.json["total_transactions"] == 1
+
+        db.session.expire_all()
+        assert db.session.get(Dispenser, dispenser_id).closed_transactions == 1
+        assert DispenserEvent.query.count() == 2
+
+    def test_no_acknowledged_event_is_lost_on_crash(
+        self, app, test_setup, write_behind
+    ):
+        client, db, _ = test_setup
+
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(3)]
+        db.session.add_all(dispensers)
+        db.session.commit()
+        ids = [dispenser.id for dispenser in dispensers]
+
+        # The worker never gets to write anything before the process dies
+        app.config["INGEST_FLUSH_INTERVAL"] = 60
+        try:
+            client.post("api/dispenser/bulk/open", json={"dispenser_ids": ids})
+            client.post(f"api/dispenser/{ids[0]}/close")
+            tap_ingestion.stop()
+        finally:
+            app.config["INGEST_FLUSH_INTERVAL"] = 0.05
+
+        db.session.expire_all()
+        assert Transaction.query.count() == 0
+
+        log_path = app.config["INGEST_LOG_PATH"]
+        with open(log_path) as log:
+            records = log.read()
+        # A record torn in the middle of its write was never acknowledged
+        with open(log_path, "a") as log:
+            log.write('{"sequence": 1000, "type": "op')
+
+        restarted = TapIngestion(app)
+        try:
+            assert restarted.flush()
+        finally:
+            restarted.stop()
+
+        db.session.expire_all()
+        assert Transaction.query.count() == 3
+        assert Transaction.query.filter(Transaction.end_time.isnot(None)).count() == 1
+        assert [db.session.get(Dispenser, i).is_open for i in ids] == [
+            False,
+            True,
+            True,
+        ]
+
+        # Records already covered by the checkpoint are not written twice
+        with open(log_path, "w") as log:
+            log.write(records)
+
+        restarted = TapIngestion(app)
+        try:
+            assert restarted.flush()
+        finally:
+            restarted.stop()
+
+        db.session.expire_all()
+        assert Transaction.query.count() == 3
+        assert DispenserEvent.query.count() == 4
+        last_sequence = json.loads(records.splitlines()[-1])["sequence"]
+        assert db.session.get(IngestCheckpoint, "tap_events").sequence == last_sequence
+
+    def test_failing_records_do_not_hold_the_others_up(
+        self, app, test_setup, write_behind
+    ):
+        client, db, test_jwt = test_setup
+
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(2)]
+        db.session.add_all(dispensers)
+        db.session.commit()
+        first, second = [dispenser.id for dispenser in dispensers]
+
+        client.post(f"api/dispenser/{first}/open")
+        poison = {"type": "close", "dispenser_id": first, "time": "not a time"}
+        with tap_ingestion._lock:
+            tap_ingestion._append([{**poison, "amount": 1.0, "revenue": 2.0}])
+        client.post(f"api/dispenser/{second}/open")
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        assert client.get(f"api/statistics/{second}", headers=headers).status_code == (
+            200
+        )
+
+        db.session.expire_all()
+        assert [db.session.get(Dispenser, i).is_open for i in (first, second)] == [
+            True,
+            True,
+        ]
+        with open(app.config["INGEST_DEAD_LETTER_PATH"]) as dead_letters:
+            [dead_letter] = [json.loads(line) for line in dead_letters]
+        assert dead_letter["time"] == "not a time"
+        checkpoint = db.session.get(IngestCheckpoint, "tap_events")
+        assert checkpoint.sequence == dead_letter["sequence"] + 1
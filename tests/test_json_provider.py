@@ -0,0 +1,41 @@
+import pytest
+
+from app.json_provider import ApiJSONProvider
+from datetime import datetime
+from flask.json.provider import DefaultJSONProvider
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestJSONProvider:
+    def test_responses_match_default_provider(self, app):
+        payloads = [
+            {"b": 1, "a": [0.1, -0.0, 1e-4, 123456789012345.6, None, True]},
+            {"amount": 1e-05, "revenue": 1e16},
+            {"amount": float("nan"), "revenue": [float("inf"), -float("inf"), None]},
+            {"name": "Cañas y tapas", "emoji": "\U0001f37a", "delete": "\x7f"},
+            {"big": 2**70},
+            {"control": "tab\tnew\nline\x01", "quote": '"\\/'},
+            [],
+            None,
+        ]
+        default_provider = DefaultJSONProvider(app)
+
+        with app.app_context():
+            for payload in payloads:
+                assert (
+                    app.json.response(payload).get_data()
+                    == default_provider.response(payload).get_data()
+                )
+                assert app.json.dumps(payload) == default_provider.dumps(payload)
+
+    def test_datetimes_use_api_format(self, app):
+        start_time = datetime(2023, 7, 14, 10, 0, 0, 123456)
+        provider = ApiJSONProvider(app)
+
+        with app.app_context():
+            assert provider.response({"start_time": start_time}).get_data() == (
+                b'{"start_time":"2023-07-14 10:00:00"}\n'
+            )
+            assert provider.dumps([start_time, None]) == (
+                '["2023-07-14 10:00:00", null]'
+            )
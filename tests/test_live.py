@@ -0,0 +1,56 @@
+import pytest
+
+from app.live import open_tap_registry
+from app.models import Dispenser
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestLivePours:
+    def add_dispensers(self, db, count):
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(count)]
+        db.session.add_all(dispensers)
+        db.session.commit()
+
+        return [dispenser.id for dispenser in dispensers]
+
+    def test_open_taps_are_estimated_without_queries(self, test_setup, sql_statements):
+        client, db, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        first, second = self.add_dispensers(db, 2)
+
+        client.post(f"/api/dispenser/{first}/open")
+        client.post(f"/api/dispenser/{second}/open")
+        response = client.get("/api/statistics/live", headers=headers)
+        assert [pour["dispenser_id"] for pour in response.json["pours"]] == [
+            first,
+            second,
+        ]
+
+        client.post(f"/api/dispenser/{first}/close")
+        del sql_statements[:]
+        response = client.get("/api/statistics/live", headers=headers)
+
+        assert sql_statements == []
+        [pour] = response.json["pours"]
+        assert pour["dispenser_id"] == second
+        assert pour["revenue"] == pytest.approx(pour["amount"] * 2.0)
+        assert response.json["total_amount"] == pour["amount"]
+
+        client.post(f"/api/dispenser/{second}/close")
+        body = client.get("/api/statistics/live", headers=headers).data
+        assert b'"total_amount":0.0' in body and b'"total_revenue":0.0' in body
+
+    def test_registry_reloads_after_other_changes(self, test_setup):
+        client, db, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        [dispenser_id] = self.add_dispensers(db, 1)
+        client.post(f"/api/dispenser/{dispenser_id}/open")
+        assert len(open_tap_registry.snapshot()) == 1
+
+        # Bulk statements are not tracked, and only move the cache version on
+        db.session.query(Dispenser).filter_by(id=dispenser_id).update({"price": 4.0})
+        db.session.commit()
+
+        response = client.get("/api/statistics/live", headers=headers)
+        [pour] = response.json["pours"]
+        assert pour["revenue"] == pytest.approx(pour["amount"] * 4.0)
@@ -0,0 +1,79 @@
+import pytest
+
+from app.models import Dispenser
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+
+
+def get_sample(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestMetrics:
+    def test_requests_and_pours_are_counted(self, test_setup):
+        client, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+        dispenser_id = dispenser.id
+
+        route = {"method": "POST", "route": "/api/dispenser/<int:dispenser_id>/close"}
+        requests = get_sample("http_requests_total", {**route, "status": "200"})
+        statements = get_sample(
+            "db_statements_per_request_count", {"route": route["route"]}
+        )
+        litres = get_sample("dispensed_litres_total")
+        revenue = get_sample("revenue_total")
+
+        client.post(f"api/dispenser/{dispenser_id}/open")
+        closed = client.post(f"api/dispenser/{dispenser_id}/close").json
+
+        assert get_sample("http_requests_total", {**route, "status": "200"}) == (
+            requests + 1
+        )
+        assert get_sample("http_request_duration_seconds_count", route) >= 1
+        assert (
+            get_sample("db_statements_per_request_count", {"route": route["route"]})
+            == statements + 1
+        )
+        assert get_sample("dispensed_litres_total") == pytest.approx(
+            litres + closed["amount"]
+        )
+        assert get_sample("revenue_total") == pytest.approx(revenue + closed["cost"])
+
+    def test_metrics_endpoint(self, test_setup):
+        client, db, _ = test_setup
+
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(2)]
+        dispensers[0].is_open = True
+        db.session.add_all(dispensers)
+        db.session.commit()
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.content_type.startswith("text/plain")
+
+        families = {
+            family.name: family
+            for family in text_string_to_metric_families(response.get_data(True))
+        }
+        assert families["dispensers_open"].samples[0].value == 1
+        assert "http_request_duration_seconds" in families
+        assert "db_pool_connections_checked_out" in families
+
+    def test_failed_requests_are_counted(self, app, test_setup, monkeypatch):
+        client, _, _ = test_setup
+
+        def fail():
+            raise RuntimeError("Database is gone")
+
+        monkeypatch.setitem(app.view_functions, "api.get_all_dispenser_info", fail)
+        labels = {"method": "GET", "route": "/api/dispenser", "status": "500"}
+        requests = get_sample("http_requests_total", labels)
+
+        with pytest.raises(RuntimeError):
+            client.get("/api/dispenser")
+
+        assert get_sample("http_requests_total", labels) == requests + 1
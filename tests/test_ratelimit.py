@@ -0,0 +1,141 @@
+import os
+import subprocess
+import sys
+import pytest
+import time
+
+from app.models import Dispenser
+from app.ratelimit import LocalBucketBackend, SharedBucketBackend
+
+BEHIND_A_PROXY = """
+from app import create_app
+from app.models import db, Dispenser
+
+app = create_app()
+with app.app_context():
+    db.create_all()
+    db.session.add(Dispenser(flow_volume=0.5, price=2.0))
+    db.session.commit()
+
+client = app.test_client()
+for address in ("10.0.0.1", "10.0.0.1", "10.0.0.2"):
+    response = client.post(
+        "/api/dispenser/1/open",
+        headers={"X-Forwarded-For": address},
+        environ_base={"REMOTE_ADDR": "192.168.0.1"},
+    )
+    print(response.status_code)
+"""
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestRateLimit:
+    def add_dispensers(self, db, count):
+        dispensers = [Dispenser(flow_volume=0.5, price=2.0) for _ in range(count)]
+        db.session.add_all(dispensers)
+        db.session.commit()
+
+        return [dispenser.id for dispenser in dispensers]
+
+    def test_dispenser_is_throttled(self, test_setup, limits):
+        client, db, _ = test_setup
+        first, second = self.add_dispensers(db, 2)
+        limits.dispenser_limit = (0.01, 2)
+
+        assert client.post(f"/api/dispenser/{first}/open").status_code == 200
+        assert client.post(f"/api/dispenser/{first}/close").status_code == 200
+        response = client.post(f"/api/dispenser/{first}/open")
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "100"
+        assert db.session.get(Dispenser, first).is_open is False
+        assert client.post(f"/api/dispenser/{second}/open").status_code == 200
+
+    def test_clients_are_throttled_separately(self, test_setup, limits):
+        client, db, _ = test_setup
+        [dispenser_id] = self.add_dispensers(db, 1)
+        limits.client_limit = (0.01, 1)
+        path = f"/api/dispenser/{dispenser_id}/open"
+
+        bad_client = {"REMOTE_ADDR": "10.0.0.1"}
+        assert client.post(path, environ_base=bad_client).status_code == 200
+        assert client.post(path, environ_base=bad_client).status_code == 429
+        response = client.post(
+            "/api/dispenser/bulk/close",
+            json={"dispenser_ids": [dispenser_id]},
+            environ_base=bad_client,
+        )
+        assert response.status_code == 429
+
+        good_client = {"REMOTE_ADDR": "10.0.0.2"}
+        response = client.post(
+            f"/api/dispenser/{dispenser_id}/close", environ_base=good_client
+        )
+        assert response.status_code == 200
+
+    def test_clients_behind_a_trusted_proxy_are_throttled_separately(self, tmp_path):
+        environment = {
+            **os.environ,
+            "DB_URI": f"sqlite:///{tmp_path / 'proxied.db'}",
+            "TRUSTED_PROXIES": "1",
+            "RATE_LIMIT_CLIENT_RATE": "0.01",
+            "RATE_LIMIT_CLIENT_BURST": "1",
+        }
+
+        output = subprocess.run(
+            [sys.executable, "-c", BEHIND_A_PROXY],
+            env=environment,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+
+        # The second open of 10.0.0.1 is throttled, then answered 400 to 10.0.0.2
+        assert output.split() == ["200", "429", "400"]
+
+    def test_retries_are_replayed_before_the_limits(self, test_setup, limits):
+        client, db, _ = test_setup
+        [dispenser_id] = self.add_dispensers(db, 1)
+        limits.client_limit = (0.01, 1)
+        path = f"/api/dispenser/{dispenser_id}/open"
+        headers = {"Idempotency-Key": "open-throttled"}
+
+        first = client.post(path, headers=headers)
+        retry = client.post(path, headers=headers)
+
+        assert (retry.status_code, retry.data) == (200, first.data)
+        assert retry.headers["Idempotent-Replayed"] == "true"
+        assert client.post(path).status_code == 429
+
+    def test_requests_are_shed_while_the_database_is_slow(self, test_setup, limits):
+        client, db, _ = test_setup
+        [dispenser_id] = self.add_dispensers(db, 1)
+        limits.latency_threshold = 0.05
+
+        now = time.time()
+        limits.observe(4.0, now)
+        response = client.post(f"/api/dispenser/{dispenser_id}/open")
+        assert response.status_code == 429
+        # The average of 0.4 s halves every second down to 0.05 s
+        assert response.headers["Retry-After"] == "3"
+
+        assert limits.check("10.0.0.1", dispenser_id, now + 3.1) is None
+
+
+def test_buckets_refill_at_their_rate(tmp_path):
+    shared_path = tmp_path / "ratelimit.bin"
+
+    for backend, other in (
+        (LocalBucketBackend(), None),
+        (SharedBucketBackend(str(shared_path)), SharedBucketBackend(str(shared_path))),
+    ):
+        assert backend.take("tap", 2, 2, 100.0) == 0
+        assert backend.take("tap", 2, 2, 100.0) == 0
+        assert backend.take("tap", 2, 2, 100.0) == 0.5
+        assert backend.take("tap", 2, 2, 100.25) == 0.25
+        assert backend.take("other tap", 2, 2, 100.25) == 0
+
+        # Every process mapping the file shares the buckets
+        if other is not None:
+            assert other.take("tap", 2, 2, 100.5) == 0
+            assert backend.take("tap", 2, 2, 100.5) == 0.5
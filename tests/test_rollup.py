@@ -0,0 +1,154 @@
+import pytest
+
+from app.models import Dispenser, Transaction
+from app.rollup import split_into_buckets, rebuild_rollups
+from datetime import datetime, timedelta
+
+
+@pytest.mark.usefixtures("test_setup", "test_teardown")
+class TestRollup:
+    def test_pours_are_split_across_buckets(self):
+        start = datetime(2023, 7, 14, 10, 59, 30)
+        end = datetime(2023, 7, 14, 11, 0, 30)
+
+        hour = 60 * 24 * 19552 + 10 * 60
+        assert split_into_buckets(start, end, 6.0, 12.0, 60) == [
+            (hour, 1, 3.0, 6.0),
+            (hour + 60, 0, 3.0, 6.0),
+        ]
+        assert split_into_buckets(start, end, 6.0, 12.0, 1440) == [
+            (hour - 10 * 60, 1, 6.0, 12.0)
+        ]
+        assert split_into_buckets(start, start, 0.0, 0.0, 1) == [
+            (hour + 59, 1, 0.0, 0.0)
+        ]
+
+    def test_close_updates_rollups(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.flush()
+        transaction = Transaction(
+            dispenser_id=dispenser.id,
+            start_time=datetime.utcnow() - timedelta(seconds=90),
+        )
+        db.session.add(transaction)
+        db.session.flush()
+        dispenser.is_open = True
+        dispenser.open_transaction_id = transaction.id
+        db.session.commit()
+        dispenser_id = dispenser.id
+
+        closed = client.post(f"api/dispenser/{dispenser_id}/close").json
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get(
+            "/api/statistics/rollup",
+            headers=headers,
+            query_string={"granularity": "minute", "dispenser_id": dispenser_id},
+        )
+        assert response.status_code == 200
+        [series] = response.json["series"]
+        assert series["dispenser_id"] == dispenser_id
+        assert len(series["buckets"]) >= 2
+        assert sum(b["transactions"] for b in series["buckets"]) == 1
+        assert sum(b["amount"] for b in series["buckets"]) == pytest.approx(
+            closed["amount"]
+        )
+        assert sum(b["revenue"] for b in series["buckets"]) == pytest.approx(
+            closed["cost"]
+        )
+
+    def test_fleet_rollups_by_hour(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        dispensers = [Dispenser(flow_volume=1.0, price=2.0) for _ in range(2)]
+        db.session.add_all(dispensers)
+        db.session.flush()
+        start = datetime(2023, 7, 14, 10, 0, 0)
+        db.session.add_all(
+            [
+                Transaction(
+                    dispenser_id=dispensers[i % 2].id,
+                    start_time=start + timedelta(minutes=30 * i),
+                    end_time=start + timedelta(minutes=30 * i, seconds=10),
+                    amount=10.0,
+                    revenue=20.0,
+                )
+                for i in range(6)
+            ]
+        )
+        db.session.commit()
+        rebuild_rollups()
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get(
+            "/api/statistics/rollup",
+            headers=headers,
+            query_string={
+                "granularity": "hour",
+                "fleet": "true",
+                "from": "2023-07-14T11:00:00",
+                "to": "2023-07-14T13:00:00",
+            },
+        )
+        assert response.status_code == 200
+        assert response.json == {
+            "granularity": "hour",
+            "series": [
+                {
+                    "dispenser_id": None,
+                    "buckets": [
+                        {
+                            "start": "2023-07-14 11:00:00",
+                            "transactions": 2,
+                            "amount": 20.0,
+                            "revenue": 40.0,
+                        },
+                        {
+                            "start": "2023-07-14 12:00:00",
+                            "transactions": 2,
+                            "amount": 20.0,
+                            "revenue": 40.0,
+                        },
+                    ],
+                }
+            ],
+        }
+
+        # The same window, given in another time zone
+        response = client.get(
+            "/api/statistics/rollup",
+            headers=headers,
+            query_string={
+                "granularity": "hour",
+                "fleet": "true",
+                "from": "2023-07-14T13:00:00+02:00",
+                "to": "2023-07-14T15:00:00+02:00",
+            },
+        )
+        assert response.status_code == 200
+        assert len(response.json["series"][0]["buckets"]) == 2
+
+        response = client.get(
+            "/api/statistics/rollup",
+            headers=headers,
+            query_string={"granularity": "day"},
+        )
+        assert [
+            series["buckets"][0]["amount"] for series in response.json["series"]
+        ] == [
+            30.0,
+            30.0,
+        ]
+
+    def test_rollups_invalid_parameters(self, test_setup):
+        client, _, test_jwt = test_setup
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        for query in ({"granularity": "week"}, {"dispenser_id": "one"}):
+            response = client.get(
+                "/api/statistics/rollup", headers=headers, query_string=query
+            )
+            assert response.status_code == 400
@@ -1,6 +1,12 @@
 import pytest
 
-from app.models import Dispenser, Transaction
+from app.models import (
+    Dispenser,
+    Transaction,
+    rebuild_dispenser_aggregates,
+    check_dispenser_aggregates,
+)
+from app.statistics import get_dispenser_statistics
 from datetime import datetime, timedelta
 
 
@@ -141,3 +147,338 @@ class TestStatistics:
         assert data["total_revenue"] > 0.0
         assert data["total_transactions"] == 1
         assert "transactions" in data
+
+    def test_close_updates_dispenser_aggregates(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        dispenser = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add(dispenser)
+        db.session.commit()
+
+        client.post(f"api/dispenser/{dispenser.id}/open")
+        first = client.post(f"api/dispenser/{dispenser.id}/close").json
+        client.post(f"api/dispenser/{dispenser.id}/open")
+        second = client.post(f"api/dispenser/{dispenser.id}/close").json
+
+        dispenser = db.session.get(Dispenser, dispenser.id)
+        assert dispenser.closed_transactions == 2
+        assert dispenser.closed_amount == first["amount"] + second["amount"]
+        assert dispenser.closed_revenue == first["cost"] + second["cost"]
+        assert check_dispenser_aggregates() == []
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        data = client.get(f"/api/statistics/{dispenser.id}", headers=headers).json
+        assert data["total_transactions"] == 2
+        assert data["total_amount"] == dispenser.closed_amount
+        assert data["total_revenue"] == dispenser.closed_revenue
+
+    def test_check_and_rebuild_dispenser_aggregates(self, test_setup):
+        _, db, _ = test_setup
+
+        dispenser = Dispenser(flow_volume=1.0, price=2.0)
+        db.session.add(dispenser)
+        db.session.flush()
+        db.session.add(
+            Transaction(
+                dispenser_id=dispenser.id,
+                start_time=datetime.now(),
+                end_time=datetime.now() + timedelta(seconds=3),
+                amount=3.0,
+                revenue=6.0,
+            )
+        )
+        db.session.commit()
+
+        mismatches = check_dispenser_aggregates()
+        assert len(mismatches) == 1
+        assert mismatches[0]["dispenser_id"] == dispenser.id
+        assert mismatches[0]["scanned"] == (1, 3.0, 6.0)
+
+        rebuild_dispenser_aggregates()
+
+        assert check_dispenser_aggregates() == []
+        dispenser = db.session.get(Dispenser, dispenser.id)
+        assert dispenser.closed_transactions == 1
+        assert dispenser.closed_amount == 3.0
+        assert dispenser.closed_revenue == 6.0
+
+    def test_statistics_query_count_does_not_grow_with_dispensers(
+        self, test_setup, sql_statements
+    ):
+        client, db, test_jwt = test_setup
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+
+        def add_dispensers(count):
+            dispensers = [Dispenser(flow_volume=1.0, price=2.0) for _ in range(count)]
+            db.session.add_all(dispensers)
+            db.session.flush()
+            for dispenser in dispensers:
+                db.session.add(
+                    Transaction(
+                        dispenser_id=dispenser.id,
+                        start_time=datetime.now(),
+                        end_time=datetime.now() + timedelta(seconds=1),
+                        amount=1.0,
+                        revenue=2.0,
+                    )
+                )
+                db.session.add(Transaction(dispenser.id, datetime.now()))
+                dispenser.is_open = True
+            db.session.commit()
+            db.session.expire_all()
+
+        add_dispensers(2)
+        sql_statements.clear()
+        response = client.get("/api/statistics", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json) == 2
+        queries_for_two = len(sql_statements)
+
+        add_dispensers(20)
+        sql_statements.clear()
+        response = client.get("/api/statistics", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json) == 22
+        assert len(sql_statements) == queries_for_two
+
+        sql_statements.clear()
+        response = client.get(
+            f"/api/statistics/{response.json[0]['dispenser_id']}", headers=headers
+        )
+        assert response.status_code == 200
+        assert len(sql_statements) <= queries_for_two
+
+    def test_get_statistics_paginated(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        dispenser = Dispenser(flow_volume=1.0, price=2.0)
+        db.session.add(dispenser)
+        db.session.flush()
+        start = datetime(2023, 7, 14, 10, 0, 0)
+        db.session.add_all(
+            [
+                Transaction(
+                    dispenser_id=dispenser.id,
+                    start_time=start + timedelta(minutes=i),
+                    end_time=start + timedelta(minutes=i, seconds=1),
+                    amount=1.0,
+                    revenue=2.0,
+                )
+                for i in range(5)
+            ]
+        )
+        db.session.commit()
+        rebuild_dispenser_aggregates()
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        url = f"/api/statistics/{dispenser.id}"
+        seen = []
+        cursor = None
+
+        while True:
+            query = {"limit": 2}
+            if cursor is not None:
+                query["cursor"] = cursor
+            data = client.get(url, headers=headers, query_string=query).json
+
+            assert data["total_transactions"] == 5
+            assert data["total_amount"] == 5.0
+            assert len(data["transactions"]) <= 2
+            seen.extend(t["transaction_id"] for t in data["transactions"])
+
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert len(seen) == 5
+        assert seen == sorted(seen)
+
+    def test_get_statistics_paginated_per_dispenser(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        dispensers = [Dispenser(flow_volume=1.0, price=2.0) for _ in range(2)]
+        db.session.add_all(dispensers)
+        db.session.flush()
+        start = datetime(2023, 7, 14, 10, 0, 0)
+        # The ids of the two dispensers' transactions interleave
+        transactions = [
+            Transaction(
+                dispenser_id=dispensers[i % 2].id,
+                start_time=start + timedelta(minutes=i),
+                end_time=start + timedelta(minutes=i, seconds=1),
+                amount=1.0,
+                revenue=2.0,
+            )
+            for i in range(8)
+        ]
+        db.session.add_all(transactions)
+        db.session.commit()
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get(
+            "/api/statistics", headers=headers, query_string={"limit": 1, "cursor": 1}
+        )
+        assert response.status_code == 400
+
+        first_pages = client.get(
+            "/api/statistics", headers=headers, query_string={"limit": 1}
+        ).json
+
+        for dispenser, data in zip(dispensers, first_pages):
+            seen = [t["transaction_id"] for t in data["transactions"]]
+            cursor = data["next_cursor"]
+
+            while cursor is not None:
+                data = client.get(
+                    f"/api/statistics/{dispenser.id}",
+                    headers=headers,
+                    query_string={"limit": 1, "cursor": cursor},
+                ).json
+                seen.extend(t["transaction_id"] for t in data["transactions"])
+                cursor = data["next_cursor"]
+
+            assert seen == [
+                transaction.id
+                for transaction in transactions
+                if transaction.dispenser_id == dispenser.id
+            ]
+
+    def test_get_statistics_time_window(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        dispenser = Dispenser(flow_volume=1.0, price=2.0)
+        db.session.add(dispenser)
+        db.session.flush()
+        start = datetime(2023, 7, 14, 10, 0, 0)
+        db.session.add_all(
+            [
+                Transaction(
+                    dispenser_id=dispenser.id,
+                    start_time=start + timedelta(hours=i),
+                    end_time=start + timedelta(hours=i, seconds=1),
+                    amount=1.0 + i,
+                    revenue=2.0 + i,
+                )
+                for i in range(3)
+            ]
+        )
+        db.session.commit()
+        rebuild_dispenser_aggregates()
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        response = client.get(
+            "/api/statistics",
+            headers=headers,
+            query_string={"from": "2023-07-14T11:00:00", "to": "2023-07-14T12:00:00"},
+        )
+        assert response.status_code == 200
+        [data] = response.json
+        assert data["total_transactions"] == 1
+        assert data["total_amount"] == 2.0
+        assert data["total_revenue"] == 3.0
+        assert [t["start_time"] for t in data["transactions"]] == [
+            "2023-07-14 11:00:00"
+        ]
+
+        response = client.get(
+            "/api/statistics",
+            headers=headers,
+            query_string={"from": "2023-07-14T11:00:00Z", "summary_only": "true"},
+        )
+        [data] = response.json
+        assert data["total_transactions"] == 2
+        assert data["total_amount"] == 5.0
+        assert "transactions" not in data
+
+        # Offsets are converted to UTC
+        response = client.get(
+            "/api/statistics",
+            headers=headers,
+            query_string={
+                "from": "2023-07-14T13:00:00+02:00",
+                "to": "2023-07-14T14:00:00+02:00",
+            },
+        )
+        [data] = response.json
+        assert data["total_transactions"] == 1
+        assert data["total_amount"] == 2.0
+
+    def test_get_statistics_window_without_closed_transactions(self, test_setup):
+        client, db, test_jwt = test_setup
+
+        pouring = Dispenser(flow_volume=0.5, price=2.0)
+        unused = Dispenser(flow_volume=0.5, price=2.0)
+        db.session.add_all([pouring, unused])
+        db.session.commit()
+        client.post(f"/api/dispenser/{pouring.id}/open")
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        window = {"from": "2023-07-14T00:00:00"}
+        response = client.get("/api/statistics", headers=headers, query_string=window)
+        assert response.status_code == 200
+        assert [data["total_transactions"] for data in response.json] == [1, 0]
+        assert response.json[0]["total_amount"] > 0
+
+        response = client.get(
+            f"/api/statistics/{unused.id}", headers=headers, query_string=window
+        )
+        assert response.status_code == 200
+        assert response.json["total_amount"] == 0.0
+
+    def test_listed_and_summarized_totals_agree(self, test_setup):
+        _, db, _ = test_setup
+
+        dispensers = [Dispenser(flow_volume=0.5 + i, price=2.0) for i in range(3)]
+        db.session.add_all(dispensers)
+        db.session.flush()
+        start = datetime.utcnow() - timedelta(hours=1)
+        db.session.add_all(
+            [
+                Transaction(
+                    dispenser_id=dispensers[i % 2].id,
+                    start_time=start + timedelta(minutes=i),
+                    end_time=start + timedelta(minutes=i, seconds=10),
+                    amount=0.5 * i,
+                    revenue=1.0 * i,
+                )
+                for i in range(10)
+            ]
+            + [Transaction(dispenser_id=dispensers[1].id, start_time=start)]
+        )
+        db.session.commit()
+
+        window = {"start": start, "end": start + timedelta(hours=2)}
+        listed = get_dispenser_statistics(dispensers, **window)
+        summarized = get_dispenser_statistics(dispensers, summary_only=True, **window)
+
+        for listed_stats, summarized_stats in zip(listed, summarized):
+            assert listed_stats["total_transactions"] == len(
+                listed_stats["transactions"]
+            )
+            # The open transaction keeps pouring between the two calls
+            for total in ("total_transactions", "total_amount", "total_revenue"):
+                assert listed_stats[total] == pytest.approx(
+                    summarized_stats[total], abs=0.1
+                )
+
+        [open_transaction] = [
+            t for t in listed[1]["transactions"] if t["end_time"] is None
+        ]
+        assert open_transaction["amount"] == pytest.approx(3600 * 1.5, abs=1)
+        assert open_transaction["revenue"] == pytest.approx(3600 * 1.5 * 2.0, abs=2)
+        assert listed[2]["transactions"] == []
+
+    def test_get_statistics_invalid_parameters(self, test_setup):
+        client, _, test_jwt = test_setup
+
+        headers = {"Authorization": f"Bearer {test_jwt}"}
+        for query in (
+            {"from": "yesterday"},
+            {"limit": "0"},
+            {"limit": "ten"},
+            {"from": "2023-07-14T12:00:00", "to": "2023-07-14T11:00:00"},
+        ):
+            response = client.get(
+                "/api/statistics", headers=headers, query_string=query
+            )
+            assert response.status_code == 400
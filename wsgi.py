@@ -1,10 +1,3 @@
-from app import app
-from app.models import db
-from run_dev import create_admin
+from app import create_app
 
-
-db.init_app(app)
-
-with app.app_context():
-    db.create_all()
-    create_admin()
+app = create_app()